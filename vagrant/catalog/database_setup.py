@@ -1,9 +1,16 @@
+import os
 import sys
 
+# db.py, slowquery.py and compression.py are shared with flask_catalog,
+# import them from there.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'flask_catalog'))
+
 from sqlalchemy import Column, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+
+from db import makeEngine, databaseUrl
 
 Base = declarative_base()
 
@@ -28,6 +35,6 @@ class MenuItem(Base):
     restaurant_id = Column(Integer, ForeignKey('restaurant.id'))
     restaurant = relationship(Restaurant)
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+engine = makeEngine(databaseUrl('sqlite:///restaurantmenu.db'))
 
 Base.metadata.create_all(engine)
@@ -1,9 +1,9 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from database_setup import Restaurant, Base, MenuItem
+from db import makeEngine, databaseUrl
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+engine = makeEngine(databaseUrl('sqlite:///restaurantmenu.db'))
 # Bind the engine to the metadata of the Base class so that the
 # declaratives can be accessed through a DBSession instance
 Base.metadata.bind = engine
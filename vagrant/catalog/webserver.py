@@ -1,20 +1,44 @@
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 import cgi
+import sys
 
-from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
 
 from database_setup import Base, Restaurant, MenuItem
+from db import makeEngine, databaseUrl
+from slowquery import enableFromEnvironment
+from compression import Compressor
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+engine = makeEngine(databaseUrl('sqlite:///restaurantmenu.db'))
+# log slow statements when SLOW_QUERY_MS is set.
+enableFromEnvironment(engine)
 
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
 session = DBSession()
+# compresses large pages for clients accepting gzip or brotli.
+compressor = Compressor()
 
 
 class webserverHandler(BaseHTTPRequestHandler):
+    def sendHtml(self, output):
+        """Send a 200 html response, compressed if it's worth it."""
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        if compressor.shouldCompress('text/html', output):
+            self.send_header('Vary', 'Accept-Encoding')
+            encoding = compressor.chooseEncoding(
+                self.headers.getheader('Accept-Encoding'))
+            if encoding is not None:
+                output = compressor.compress(output, encoding)
+                self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
     def do_GET(self):
         try:
             if self.path.endswith("/edit"):
@@ -22,10 +46,6 @@ class webserverHandler(BaseHTTPRequestHandler):
                 restaurantQuery = session.query(Restaurant)\
                     .filter_by(id=restaurantIDPath).one()
                 if restaurantQuery != []:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-
                     output = "<html><body>"
                     output += "<h1>%s</h1><br>" % restaurantQuery.name
                     output += "<form method='POST' enctype='multipart/form-da"\
@@ -34,7 +54,7 @@ class webserverHandler(BaseHTTPRequestHandler):
                               "bmit' value='Rename'></form>"
                     output += "</body></html>"
 
-                    self.wfile.write(output)
+                    self.sendHtml(output)
                     print output
                     return
 
@@ -43,10 +63,6 @@ class webserverHandler(BaseHTTPRequestHandler):
                 restaurantQuery = session.query(Restaurant)\
                     .filter_by(id=restaurantIDPath).one()
                 if restaurantQuery != []:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-
                     output = "<html><body>"
                     output += "<h1>Are you sure you want to delete %s?</h1>"\
                               % restaurantQuery.name
@@ -56,15 +72,11 @@ class webserverHandler(BaseHTTPRequestHandler):
                     output += "<input type='submit' value='Delete'></form>"
                     output += "</body></html>"
 
-                    self.wfile.write(output)
+                    self.sendHtml(output)
                     print output
                     return
 
             if self.path.endswith("/restaurants/new"):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-
                 output = "<html><body>"
                 output += "<h1>Make a New Restaurant</h1><br>"
                 output += "<form method='POST' enctype='multipart/form-data' "\
@@ -73,15 +85,11 @@ class webserverHandler(BaseHTTPRequestHandler):
                           "e'></form>"
                 output += "</body></html>"
 
-                self.wfile.write(output)
+                self.sendHtml(output)
                 print output
                 return
 
             if self.path.endswith("/restaurants"):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-
                 output = "<html><body><a href='/restaurants/new'>Make a new r"\
                          "estaurant</a><ul>"
                 query = session.query(Restaurant).all()
@@ -91,16 +99,12 @@ class webserverHandler(BaseHTTPRequestHandler):
                               % (restaurant.name, restaurant.id, restaurant.id)
 
                 output += "</ul></body></html>"
-                self.wfile.write(output)
+                self.sendHtml(output)
                 print output
                 session.close()
                 return
 
             if self.path.endswith("/hello"):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-
                 output = ""
                 output += "<html><body>Hello!"
                 output += "<form method='POST' enctype='multipart/form-data' "\
@@ -108,15 +112,11 @@ class webserverHandler(BaseHTTPRequestHandler):
                           "</h2><input name='message' type='text'><input "\
                           "type='submit' value='Submit'></form>"
                 output += "</body></html>"
-                self.wfile.write(output)
+                self.sendHtml(output)
                 print output
                 return
 
             if self.path.endswith("/hola"):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-
                 output = ""
                 output += "<html><body>&#161hola! <a href='/hello'>Back to " \
                           "Hello</a>"
@@ -125,7 +125,7 @@ class webserverHandler(BaseHTTPRequestHandler):
                           "</h2><input name='message' type='text'><input "\
                           "type='submit' value='Submit'></form>"
                 output += "</body></html>"
-                self.wfile.write(output)
+                self.sendHtml(output)
                 print output
                 return
 
@@ -203,6 +203,10 @@ class webserverHandler(BaseHTTPRequestHandler):
                     self.send_header('Location', '/restaurants')
                     self.end_headers()
 
+                    # delete the menu first, databases enforcing foreign
+                    # keys refuse to leave its items behind.
+                    session.query(MenuItem).filter_by(
+                        restaurant_id=restaurantQuery.id).delete()
                     session.delete(restaurantQuery)
                     session.commit()
                     return
@@ -213,7 +217,7 @@ class webserverHandler(BaseHTTPRequestHandler):
 
 def main():
     try:
-        port = 8080
+        port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
         server = HTTPServer(('', port), webserverHandler)
         print "Web server running on port %s" % port
         server.serve_forever()
@@ -0,0 +1,152 @@
+"""
+Static asset pipeline for the catalog app.
+
+The build step copies every file under static/ to static/dist/ with a hash
+of its content in the name (styles.css -> styles.3f2a9c1e0b7d.css), writes
+gzip and, when the brotli package is installed, brotli compressed copies
+next to it and records the names in static/dist/manifest.json:
+
+    python assets.py
+
+When the manifest exists, initAssets() makes url_for('static', ...) return
+the hashed names and serves them with a year long immutable Cache-Control,
+picking the precompressed copy the browser accepts. A changed file gets a
+new name, so browsers never need to revalidate a cached one.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+# one year, the longest lifetime caches are expected to honour.
+ONE_YEAR = 31536000
+IMMUTABLE = 'public, max-age=%d, immutable' % ONE_YEAR
+# precompressed copies by preference: (Content-Encoding, file suffix).
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def fingerprint(path, length=12):
+    """Returns the first length hex digits of the file's SHA-256."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def compress(path):
+    """Write the gzip and brotli compressed copies of a file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    # a fixed mtime keeps the .gz output identical between builds.
+    with open(path + '.gz', 'wb') as raw:
+        out = gzip.GzipFile(os.path.basename(path), 'wb', 9, raw, mtime=0)
+        out.write(data)
+        out.close()
+    if brotli is not None:
+        with open(path + '.br', 'wb') as out:
+            out.write(brotli.compress(data))
+
+
+def buildAssets(static_dir):
+    """
+    Fingerprint and compress every file under static_dir into its dist
+    directory, replacing the previous build. Returns the manifest, a dict
+    of original to hashed names relative to static_dir.
+    """
+    dist_dir = os.path.join(static_dir, DIST)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and DIST in dirs:
+            dirs.remove(DIST)
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_dir)
+            stem, extension = os.path.splitext(relative)
+            hashed = '%s.%s%s' % (stem, fingerprint(source), extension)
+            target = os.path.join(dist_dir, hashed)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(source, target)
+            compress(target)
+            manifest[relative.replace(os.sep, '/')] = (
+                DIST + '/' + hashed.replace(os.sep, '/'))
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def loadManifest(static_dir):
+    """Returns the manifest of the last build, or None if there is none."""
+    path = os.path.join(static_dir, DIST, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def sendAsset(dist_dir, filename):
+    """
+    Send a built asset with far future caching, as its brotli or gzip
+    copy when the request accepts that encoding.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        if (accepted[encoding] and
+                os.path.exists(os.path.join(dist_dir, filename + suffix))):
+            response = send_from_directory(dist_dir, filename + suffix,
+                                           mimetype=mimetype,
+                                           cache_timeout=ONE_YEAR)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(dist_dir, filename,
+                                       mimetype=mimetype,
+                                       cache_timeout=ONE_YEAR)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def initAssets(app):
+    """
+    Serve the built assets and rewrite url_for('static', ...) to them, if
+    the build step has been run. Returns the manifest or None.
+    """
+    manifest = loadManifest(app.static_folder)
+    app.extensions['assets'] = manifest
+    if 'assets' in app.view_functions:
+        return manifest
+    dist_dir = os.path.join(app.static_folder, DIST)
+
+    def rewriteStatic(endpoint, values):
+        current = app.extensions.get('assets')
+        if endpoint == 'static' and current:
+            values['filename'] = current.get(values.get('filename'),
+                                             values.get('filename'))
+    app.url_defaults(rewriteStatic)
+    app.add_url_rule(app.static_url_path + '/' + DIST + '/<path:filename>',
+                     'assets', lambda filename: sendAsset(dist_dir, filename))
+    return manifest
+
+
+if __name__ == '__main__':
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'static')
+    for source, hashed in sorted(buildAssets(static_dir).items()):
+        print '%s -> %s' % (source, hashed)
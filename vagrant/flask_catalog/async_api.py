@@ -0,0 +1,154 @@
+"""
+Concurrent JSON API for the restaurant catalog, served by gevent.
+
+Serves the same JSON endpoints as final_project.py, with the same
+serialized columns, from a single process that can hold thousands of
+keep-alive connections: every connection is a greenlet, and database calls
+run on gevent's thread pool so a slow query never blocks the other clients.
+This is the Python 2 counterpart of an ASGI app on asyncio, with the thread
+pool playing the part of aiosqlite's background thread.
+
+    python async_api.py [port]
+
+Configure it with the CATALOG_* environment variables (see config.py), plus
+CATALOG_API_DB_THREADS for the size of the database thread pool.
+"""
+if __name__ == '__main__':
+    # make sockets cooperative before anything creates one.
+    from gevent import monkey
+    monkey.patch_all()
+
+import sys
+
+import gevent
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Response
+
+from config import loadConfig, engineOptions
+from database_setup import Restaurant, MenuItem, upgradeSchema
+from db import makeEngine
+from events import Broker, ChangeTailer
+from fastjson import dumps, serializedQuery, serializeRows
+from summary import summaryQuery, serializeSummary
+
+URLS = Map([
+    Rule('/restaurants/JSON', endpoint='restaurants'),
+    Rule('/restaurant/<int:restaurant_id>/menu/JSON', endpoint='menu'),
+    Rule('/restaurant/<int:restaurant_id>/menu/<int:menu_id>/JSON',
+         endpoint='item'),
+    Rule('/menu/events', endpoint='events'),
+    Rule('/restaurant/<int:restaurant_id>/menu/events', endpoint='events'),
+])
+
+
+class CatalogAPI(object):
+    """WSGI app for the JSON endpoints, for a cooperative server."""
+
+    def __init__(self, config=None):
+        self.config = loadConfig(config)
+        self.engine = makeEngine(self.config['DATABASE_URL'],
+                                 **engineOptions(self.config))
+        # add the tables and columns missing from older databases.
+        upgradeSchema(self.engine)
+        self.DBSession = sessionmaker(bind=self.engine)
+        # menu change events, read from the database on the thread pool.
+        self.tailer = ChangeTailer(
+            Broker(self.config['EVENTS_QUEUE_SIZE']), self.engine,
+            self.config['EVENTS_POLL_INTERVAL'],
+            self.config['EVENTS_HEARTBEAT'],
+            run=lambda function: gevent.get_hub().threadpool.apply(function))
+
+    def query(self, function, *args):
+        """
+        Run function(session, *args) on the database thread pool and return
+        its result, letting other greenlets run meanwhile.
+        """
+        def run():
+            session = self.DBSession()
+            try:
+                return function(session, *args)
+            finally:
+                session.close()
+        return gevent.get_hub().threadpool.apply(run)
+
+    def restaurants(self):
+        def load(session):
+            return [serializeSummary(row) for row in summaryQuery(session)]
+        return {'Restaurants': self.query(load)}
+
+    def menu(self, restaurant_id):
+        def load(session):
+            if session.query(Restaurant.id).filter_by(
+                    id=restaurant_id).first() is None:
+                return None
+            return serializeRows(MenuItem, serializedQuery(
+                session, MenuItem).filter_by(restaurant_id=restaurant_id))
+        items = self.query(load)
+        if items is None:
+            raise NotFound()
+        return {'MenuItems': items}
+
+    def item(self, restaurant_id, menu_id):
+        def load(session):
+            item = serializedQuery(session, MenuItem).filter_by(
+                id=menu_id).first()
+            if item is None:
+                return None
+            return serializeRows(MenuItem, [item])[0]
+        item = self.query(load)
+        if item is None:
+            raise NotFound()
+        return {'MenuItem': item}
+
+    def events(self, environ, restaurant_id=None):
+        """
+        Server-Sent Events stream of menu item changes, see events.py. An
+        idle stream is just a greenlet waiting on its queue.
+        """
+        if restaurant_id is not None:
+            def exists(session):
+                return session.query(Restaurant.id).filter_by(
+                    id=restaurant_id).first() is not None
+            if not self.query(exists):
+                raise NotFound()
+        last_event_id = environ.get('HTTP_LAST_EVENT_ID', '')
+        stream = self.tailer.stream(
+            restaurant_id,
+            int(last_event_id) if last_event_id.isdigit() else None)
+        return Response(stream, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    def __call__(self, environ, start_response):
+        try:
+            endpoint, values = URLS.bind_to_environ(environ).match()
+            if endpoint == 'events':
+                response = self.events(environ, **values)
+            else:
+                response = Response(
+                    dumps(getattr(self, endpoint)(**values)),
+                    mimetype='application/json')
+        except HTTPException as e:
+            response = Response(dumps({'error': e.name}), e.code,
+                                mimetype='application/json')
+        return response(environ, start_response)
+
+
+def create_api(config=None):
+    """Returns the JSON API WSGI app for a config, see config.py."""
+    return CatalogAPI(config)
+
+
+def main():
+    from gevent.pywsgi import WSGIServer
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5001
+    api = create_api()
+    gevent.get_hub().threadpool.maxsize = api.config['API_DB_THREADS']
+    server = WSGIServer(('0.0.0.0', port), api, log=None)
+    print 'JSON API running on port %s' % port
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Local proxy and thumbnail cache for user portraits.
+
+User.picture points at full size images on third party hosts, so every
+page showing a portrait made the browser download it from there. Pages now
+link to /user/<id>/avatar/<size> instead, which fetches the picture once,
+shrinks it to the size it is displayed at with Pillow and keeps it in an on
+disk cache. Without Pillow the pictures are cached at full size, and a
+warning says so when the cache is created, unless resizing is turned off.
+
+The cache is content addressed: every image is stored once in blobs/ under
+the SHA-256 of its bytes, and index/ maps a hash of the picture url and
+size to its blob. When the blobs outgrow max_bytes the least recently
+served ones are removed, as every hit touches the blob's modification time.
+
+A picture that can't be fetched is remembered for failure_ttl seconds, and
+its avatar redirects to the picture straight away in the meantime, so a
+host that is down or never answers holds up one request per picture and
+size rather than every page view. Requests waiting for a fetch that fails
+share its failure instead of trying again one after the other.
+"""
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib2
+import warnings
+from io import BytesIO
+
+from flask import current_app, redirect, request, url_for
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# the sizes pages ask for, in pixels: the 100px portraits at 2x and the
+# 300px picture on the login page.
+AVATAR_SIZES = (200, 300)
+# pictures larger than this aren't fetched.
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+ONE_YEAR = 31536000
+
+
+class AvatarError(Exception):
+    """A picture couldn't be fetched or isn't an image."""
+
+
+def pictureVersion(picture):
+    """Returns a short hash of a picture url, to version avatar urls."""
+    return hashlib.sha1(picture.encode('utf-8')).hexdigest()[:12]
+
+
+def avatarUrl(user_id, picture, size=AVATAR_SIZES[0]):
+    """
+    Returns the url of a user's portrait, through the avatar cache when it
+    is enabled. The url changes with the picture, so it can be cached
+    forever.
+    """
+    if not picture or current_app.extensions.get('avatars') is None:
+        return picture
+    return url_for('userAvatar', user_id=user_id, size=size,
+                   v=pictureVersion(picture))
+
+
+def resize(data, mimetype, size):
+    """
+    Shrink an image to fit in size x size pixels. Returns the new image
+    data and mimetype. Needs Pillow.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except IOError:
+        raise AvatarError('not an image')
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    out = BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'image/png'
+    image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue(), 'image/jpeg'
+
+
+def writeAtomically(path, data):
+    """Write data to path through a temporary file in the same directory."""
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(temp, path)
+
+
+class AvatarCache(object):
+    """
+    An on disk cache of resized pictures in cache_dir, holding at most
+    max_bytes of images. With resize off, or without Pillow, pictures are
+    stored as fetched.
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, timeout=5,
+                 failure_ttl=60, resize=True):
+        if resize and Image is None:
+            warnings.warn('Pillow is not installed, so avatars are served at '
+                          'full size: pip install Pillow, or turn resizing '
+                          'off with CATALOG_AVATAR_RESIZE=0', RuntimeWarning)
+        self.resize = resize and Image is not None
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.index_dir = os.path.join(cache_dir, 'index')
+        for directory in (self.blob_dir, self.index_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.failure_ttl = failure_ttl
+        self.lock = threading.Lock()
+        # a lock and the number of requests using it per picture being
+        # fetched, so it's only fetched once.
+        self.fetching = {}
+        # the time until which a picture that failed isn't fetched again,
+        # and the error, by (url, size).
+        self.failures = {}
+        self.total_bytes = sum(size for path, size, mtime in self.blobs())
+        self.fetches = 0
+
+    def blobs(self):
+        """Returns (path, size, mtime) of every cached image."""
+        found = []
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((path, stat.st_size, stat.st_mtime))
+        return found
+
+    def indexPath(self, url, size):
+        key = hashlib.sha1('%d %s' % (size, url.encode('utf-8')))
+        return os.path.join(self.index_dir, key.hexdigest())
+
+    def blobPath(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def lookup(self, url, size):
+        """Returns (digest, mimetype) of a cached picture, or None."""
+        index = self.indexPath(url, size)
+        try:
+            with open(index) as f:
+                digest, mimetype = f.read().split()
+        except (IOError, ValueError):
+            return None
+        try:
+            # mark it as recently used.
+            os.utime(self.blobPath(digest), None)
+        except OSError:
+            # the image was evicted.
+            try:
+                os.remove(index)
+            except OSError:
+                pass
+            return None
+        return digest, mimetype
+
+    def fetch(self, url):
+        """Download a picture. Returns its data and mimetype."""
+        if not url.startswith(('http://', 'https://')):
+            raise AvatarError('%s is not an http url' % url)
+        self.fetches += 1
+        try:
+            response = urllib2.urlopen(url, timeout=self.timeout)
+            data = response.read(MAX_IMAGE_BYTES + 1)
+            mimetype = response.info().gettype()
+        except (urllib2.URLError, socket.error, ValueError) as e:
+            raise AvatarError('fetching %s failed: %s' % (url, e))
+        if len(data) > MAX_IMAGE_BYTES:
+            raise AvatarError('%s is too large' % url)
+        if not mimetype.startswith('image/'):
+            raise AvatarError('%s is %s, not an image' % (url, mimetype))
+        return data, mimetype
+
+    def checkFailure(self, key):
+        """Raise the AvatarError of a recent failure to fetch key."""
+        with self.lock:
+            failure = self.failures.get(key)
+            if failure is None:
+                return
+            if failure[0] > time.time():
+                raise AvatarError(failure[1])
+            del self.failures[key]
+
+    def recordFailure(self, key, error):
+        """Remember that fetching key failed, forgetting expired failures."""
+        now = time.time()
+        with self.lock:
+            for old in [old for old, (until, message)
+                        in self.failures.items() if until <= now]:
+                del self.failures[old]
+            self.failures[key] = (now + self.failure_ttl, str(error))
+
+    def store(self, url, size, data, mimetype):
+        """Add an image to the cache. Returns its (digest, mimetype)."""
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blobPath(digest)
+        if not os.path.exists(blob):
+            writeAtomically(blob, data)
+            with self.lock:
+                self.total_bytes += len(data)
+        writeAtomically(self.indexPath(url, size),
+                        '%s %s' % (digest, mimetype))
+        if self.total_bytes > self.max_bytes:
+            self.evict(keep=blob)
+        return digest, mimetype
+
+    def evict(self, keep=None):
+        """Remove the least recently used images until the cache fits."""
+        with self.lock:
+            blobs = sorted(self.blobs(), key=lambda blob: blob[2])
+            self.total_bytes = sum(size for path, size, mtime in blobs)
+            for path, size, mtime in blobs:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.total_bytes -= size
+
+    def get(self, url, size):
+        """
+        Returns (digest, mimetype, path) of a picture resized to size,
+        fetching it if it isn't cached. Raises AvatarError if it can't be
+        fetched, or failed to be within the last failure_ttl seconds.
+        """
+        found = self.lookup(url, size)
+        if found is None:
+            key = (url, size)
+            self.checkFailure(key)
+            with self.lock:
+                fetching = self.fetching.setdefault(
+                    key, [threading.Lock(), 0])
+                fetching[1] += 1
+            try:
+                with fetching[0]:
+                    # another thread may have fetched it, or failed to,
+                    # while we waited.
+                    found = self.lookup(url, size)
+                    if found is None:
+                        self.checkFailure(key)
+                        try:
+                            data, mimetype = self.fetch(url)
+                            if self.resize:
+                                data, mimetype = resize(data, mimetype, size)
+                        except AvatarError as e:
+                            self.recordFailure(key, e)
+                            raise
+                        found = self.store(url, size, data, mimetype)
+            finally:
+                with self.lock:
+                    fetching[1] -= 1
+                    if not fetching[1]:
+                        del self.fetching[key]
+        digest, mimetype = found
+        return digest, mimetype, self.blobPath(digest)
+
+
+def sendAvatar(cache, picture, size):
+    """
+    Send a picture from the cache. Versioned urls are cached for a year,
+    and a picture that can't be fetched, or recently failed to be, is left
+    to the browser.
+    """
+    try:
+        digest, mimetype, path = cache.get(picture, size)
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (AvatarError, IOError):
+        response = redirect(picture)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response = current_app.response_class(data, mimetype=mimetype)
+    response.set_etag(digest)
+    if request.args.get('v') == pictureVersion(picture):
+        response.headers['Cache-Control'] = \
+            'public, max-age=%d, immutable' % ONE_YEAR
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response.make_conditional(request)
@@ -0,0 +1,328 @@
+"""
+Online backups of SQLite databases, with SQLite's backup API.
+
+backupDatabase() copies a live database a few pages at a time, pausing
+between steps so the server's own queries are never held up for long. The
+sqlite3 module of Python 2 doesn't expose the backup API, so it is called
+through ctypes. On a WAL database the copy holds a read transaction, which
+doesn't block writers, so it is a consistent snapshot of the moment it
+began. On a rollback journal database a read transaction would block the
+writers, so instead the copy restarts when the database is written, and
+after a few restarts copies the rest in one step.
+
+Backups are written to a temporary file, checked with PRAGMA quick_check
+and renamed into place, so a backup that exists is complete.
+
+    python backup.py backup restaurantmenu.db backup.db
+    python backup.py snapshot restaurantmenu.db backups --keep 7
+    python backup.py schedule restaurantmenu.db backups --every 3600 --keep 24
+    python backup.py list restaurantmenu.db backups
+    python backup.py restore backups/restaurantmenu-<time>.db restaurantmenu.db
+
+restore copies a snapshot back over the database, in one step so readers
+see either the old or the restored catalog, while the server keeps running.
+
+Any SQLite database can be given, e.g. from the puppies directory
+
+    python ../flask_catalog/backup.py snapshot puppies.db backups --keep 7
+"""
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import time
+
+# pages copied per step, and seconds to pause between steps.
+BACKUP_PAGES = 256
+BACKUP_PAUSE = 0.01
+# restarts of a rollback journal backup before copying the rest at once.
+MAX_RESTARTS = 3
+# milliseconds to wait for a lock before giving up.
+BUSY_TIMEOUT = 5000
+
+SQLITE_OK = 0
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+SQLITE_DONE = 101
+SQLITE_OPEN_READONLY = 0x01
+SQLITE_OPEN_READWRITE = 0x02
+SQLITE_OPEN_CREATE = 0x04
+
+log = logging.getLogger('backup')
+
+_library = None
+
+
+class BackupError(Exception):
+    """A backup or restore failed."""
+
+
+def sqliteLibrary():
+    """Returns the SQLite C library, loaded on first use."""
+    global _library
+    if _library is None:
+        name = ctypes.util.find_library('sqlite3')
+        if name is None:
+            raise BackupError('the SQLite library was not found')
+        lib = ctypes.CDLL(name)
+        handle = ctypes.c_void_p
+        lib.sqlite3_open_v2.argtypes = [ctypes.c_char_p,
+                                        ctypes.POINTER(handle),
+                                        ctypes.c_int, ctypes.c_char_p]
+        lib.sqlite3_close.argtypes = [handle]
+        lib.sqlite3_busy_timeout.argtypes = [handle, ctypes.c_int]
+        lib.sqlite3_exec.argtypes = [handle, ctypes.c_char_p, ctypes.c_void_p,
+                                     ctypes.c_void_p, ctypes.c_void_p]
+        lib.sqlite3_errmsg.argtypes = [handle]
+        lib.sqlite3_errmsg.restype = ctypes.c_char_p
+        lib.sqlite3_errstr.argtypes = [ctypes.c_int]
+        lib.sqlite3_errstr.restype = ctypes.c_char_p
+        lib.sqlite3_backup_init.argtypes = [handle, ctypes.c_char_p,
+                                            handle, ctypes.c_char_p]
+        lib.sqlite3_backup_init.restype = handle
+        for function in ('step', 'remaining', 'pagecount', 'finish'):
+            getattr(lib, 'sqlite3_backup_' + function).argtypes = (
+                [handle, ctypes.c_int] if function == 'step' else [handle])
+        _library = lib
+    return _library
+
+
+def openDatabase(path, flags):
+    """Open a database with the C library. Returns its handle."""
+    lib = sqliteLibrary()
+    db = ctypes.c_void_p()
+    rc = lib.sqlite3_open_v2(path, ctypes.byref(db), flags, None)
+    if rc != SQLITE_OK:
+        message = lib.sqlite3_errstr(rc)
+        lib.sqlite3_close(db)
+        raise BackupError('cannot open %s: %s' % (path, message))
+    lib.sqlite3_busy_timeout(db, BUSY_TIMEOUT)
+    return db
+
+
+def execute(db, sql):
+    """Run sql on a database handle, ignoring any rows."""
+    lib = sqliteLibrary()
+    if lib.sqlite3_exec(db, sql, None, None, None) != SQLITE_OK:
+        raise BackupError(lib.sqlite3_errmsg(db))
+
+
+def journalMode(path):
+    """Returns the journal mode of a database, e.g. 'wal'."""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA journal_mode').fetchone()[0].lower()
+    finally:
+        conn.close()
+
+
+def checkDatabase(path):
+    """Raise BackupError unless the database at path passes quick_check."""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        result = str(e)
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError('%s is damaged: %s' % (path, result))
+
+
+def copyPages(source, target, pages, pause, restarts=None):
+    """
+    Copy the main database of handle source to handle target, pages at a
+    time with a pause in between, or all at once if pages is -1. With a
+    number of restarts, copy the rest at once after that many. Returns the
+    (pages copied, restarts).
+    """
+    lib = sqliteLibrary()
+    backup = lib.sqlite3_backup_init(target, 'main', source, 'main')
+    if not backup:
+        raise BackupError(lib.sqlite3_errmsg(target))
+    restarted, remaining = 0, None
+    try:
+        while True:
+            rc = lib.sqlite3_backup_step(backup, pages)
+            if rc == SQLITE_DONE:
+                break
+            if rc not in (SQLITE_OK, SQLITE_BUSY, SQLITE_LOCKED):
+                raise BackupError(lib.sqlite3_errstr(rc))
+            left = lib.sqlite3_backup_remaining(backup)
+            if remaining is not None and left > remaining:
+                # the source was written, so the copy started over.
+                restarted += 1
+                if restarts is not None and restarted >= restarts:
+                    pages = -1
+            remaining = left
+            time.sleep(pause)
+        copied = lib.sqlite3_backup_pagecount(backup)
+    finally:
+        rc = lib.sqlite3_backup_finish(backup)
+    if rc != SQLITE_OK:
+        raise BackupError(lib.sqlite3_errmsg(target))
+    return copied, restarted
+
+
+def backupDatabase(source, target, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """
+    Copy the database file at source to target while it is in use. Returns
+    a dict of the pages copied, the restarts and the seconds it took.
+    """
+    if not os.path.exists(source):
+        raise BackupError('%s does not exist' % source)
+    start = time.time()
+    partial = target + '.part'
+    if os.path.exists(partial):
+        os.remove(partial)
+    wal = journalMode(source) == 'wal'
+    lib = sqliteLibrary()
+    src = openDatabase(source, SQLITE_OPEN_READONLY)
+    try:
+        dest = openDatabase(partial,
+                            SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE)
+        try:
+            if wal:
+                # copy from one snapshot, without blocking the writers.
+                execute(src, 'BEGIN; SELECT count(*) FROM sqlite_master')
+            try:
+                copied, restarts = copyPages(
+                    src, dest, pages, pause,
+                    None if wal else MAX_RESTARTS)
+            finally:
+                if wal:
+                    execute(src, 'COMMIT')
+        finally:
+            lib.sqlite3_close(dest)
+    finally:
+        lib.sqlite3_close(src)
+    try:
+        checkDatabase(partial)
+    except BackupError:
+        os.remove(partial)
+        raise
+    os.rename(partial, target)
+    return {'pages': copied, 'restarts': restarts,
+            'seconds': time.time() - start}
+
+
+def restoreDatabase(snapshot, target):
+    """
+    Replace the contents of the database at target with a snapshot, in a
+    single step while other connections wait. Returns the pages copied.
+    """
+    checkDatabase(snapshot)
+    lib = sqliteLibrary()
+    src = openDatabase(snapshot, SQLITE_OPEN_READONLY)
+    try:
+        dest = openDatabase(target,
+                            SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE)
+        try:
+            copied, restarts = copyPages(src, dest, -1, 0)
+        finally:
+            lib.sqlite3_close(dest)
+    finally:
+        lib.sqlite3_close(src)
+    return copied
+
+
+def snapshotPattern(source):
+    """Returns a regex matching the snapshot names of a database."""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return re.compile(r'^%s-\d{8}T\d{6}\.\d{6}Z\.db$' % re.escape(stem))
+
+
+def listSnapshots(source, directory):
+    """Returns the paths of the snapshots of a database, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    pattern = snapshotPattern(source)
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory)) if pattern.match(name)]
+
+
+def takeSnapshot(source, directory, keep=None, **options):
+    """
+    Back up a database to a new timestamped file in directory, then delete
+    all but the newest keep snapshots. Returns the backupDatabase() result
+    with the snapshot's path and the deleted paths.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    name = '%s-%s.db' % (stem, datetime.datetime.utcnow().strftime(
+        '%Y%m%dT%H%M%S.%fZ'))
+    result = backupDatabase(source, os.path.join(directory, name), **options)
+    result['snapshot'] = os.path.join(directory, name)
+    result['deleted'] = []
+    snapshots = listSnapshots(source, directory)
+    if keep is not None and len(snapshots) > keep:
+        for path in snapshots[:len(snapshots) - keep]:
+            os.remove(path)
+            result['deleted'].append(path)
+    return result
+
+
+def runSchedule(source, directory, every, keep=None, **options):
+    """Take a snapshot every so many seconds, forever."""
+    while True:
+        started = time.time()
+        try:
+            result = takeSnapshot(source, directory, keep, **options)
+            log.info('snapshot %s: %d pages in %.1fs', result['snapshot'],
+                     result['pages'], result['seconds'])
+        except (BackupError, OSError):
+            # try again at the next one.
+            log.exception('snapshot of %s failed', source)
+        time.sleep(max(0, every - (time.time() - started)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=BACKUP_PAGES,
+                        help='pages copied per step')
+    parser.add_argument('--pause', type=float, default=BACKUP_PAUSE,
+                        help='seconds between steps')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('backup')
+    command.add_argument('database')
+    command.add_argument('target')
+    for name in ('snapshot', 'schedule', 'list'):
+        command = commands.add_parser(name)
+        command.add_argument('database')
+        command.add_argument('directory')
+        if name != 'list':
+            command.add_argument('--keep', type=int)
+        if name == 'schedule':
+            command.add_argument('--every', type=float, default=3600)
+    command = commands.add_parser('restore')
+    command.add_argument('snapshot')
+    command.add_argument('database')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    options = {'pages': args.pages, 'pause': args.pause}
+    try:
+        if args.command == 'backup':
+            result = backupDatabase(args.database, args.target, **options)
+            print 'copied %d pages in %.1fs' % (result['pages'],
+                                                result['seconds'])
+        elif args.command == 'snapshot':
+            result = takeSnapshot(args.database, args.directory, args.keep,
+                                  **options)
+            print result['snapshot']
+        elif args.command == 'schedule':
+            runSchedule(args.database, args.directory, args.every,
+                        args.keep, **options)
+        elif args.command == 'list':
+            for path in listSnapshots(args.database, args.directory):
+                print path
+        else:
+            print 'restored %d pages' % restoreDatabase(args.snapshot,
+                                                       args.database)
+    except BackupError as e:
+        print 'failed: %s' % e
+        raise SystemExit(1)
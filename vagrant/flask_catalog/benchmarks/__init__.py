@@ -0,0 +1,7 @@
+"""
+Benchmarks for the restaurant catalog.
+
+Run the modules from the flask_catalog directory, e.g.
+
+    python -m benchmarks.startup
+"""
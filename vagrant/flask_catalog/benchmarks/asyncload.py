@@ -0,0 +1,147 @@
+"""
+Side by side load test of the JSON endpoints: final_project.py on the
+threaded development server against async_api.py on gevent.
+
+Both servers read the same seeded database. For every client count, each
+client keeps one connection alive and requests the JSON endpoints in turn
+for a fixed time. Clients are greenlets, so thousands of them fit in this
+process; a connection the server closes is reopened and counted.
+
+    python -m benchmarks.asyncload --clients 10 100 1000 --seconds 10
+"""
+if __name__ == '__main__':
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse
+import httplib
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+
+from benchmarks.loadtest import percentile
+from benchmarks.seed import seedDatabase
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+PORT = 5098
+
+RUN_FLASK = ("from final_project import create_app; "
+             "app = create_app({'WORKER_MODE': 'threaded', "
+             "'METRICS_ENABLED': False}); "
+             "app.run(host=%r, port=%d, threaded=True)" % (HOST, PORT))
+
+SERVERS = [
+    ('flask threaded', [sys.executable, '-c', RUN_FLASK]),
+    ('gevent async_api', [sys.executable, 'async_api.py', str(PORT)]),
+]
+
+
+def paths(restaurants, items):
+    """The JSON endpoint paths, cycled through by every client."""
+    return ['/restaurants/JSON'] + [
+        p for r in xrange(1, min(restaurants, 10) + 1) for p in (
+            '/restaurant/%d/menu/JSON' % r,
+            '/restaurant/%d/menu/%d/JSON' % (r, (r - 1) * items + 1))]
+
+
+def waitForPort(timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), 1).close()
+            return True
+        except socket.error:
+            gevent.sleep(0.1)
+    return False
+
+
+def client(number, deadline, urls, stats):
+    """Request urls over one kept alive connection until the deadline."""
+    conn = None
+    i = number
+    while time.time() < deadline:
+        if conn is None:
+            conn = httplib.HTTPConnection(HOST, PORT, timeout=30)
+            stats['connections'] += 1
+        path = urls[i % len(urls)]
+        i += 1
+        start = time.time()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+        except (socket.error, httplib.HTTPException):
+            stats['errors'] += 1
+            conn.close()
+            conn = None
+            continue
+        if response.status != 200:
+            stats['errors'] += 1
+        else:
+            stats['latencies'].append(time.time() - start)
+        if response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def run(name, command, env, urls, clients, seconds):
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                              stdout=open(os.devnull, 'w'),
+                              stderr=subprocess.STDOUT)
+    try:
+        if not waitForPort():
+            print '%-18s failed to start' % name
+            return
+        for count in clients:
+            stats = {'latencies': [], 'errors': 0, 'connections': 0}
+            deadline = time.time() + seconds
+            gevent.joinall([gevent.spawn(client, n, deadline, urls, stats)
+                            for n in xrange(count)])
+            latencies = sorted(stats['latencies'])
+            if not latencies:
+                print '%-18s %5d clients  no successful requests' % (
+                    name, count)
+                continue
+            print ('%-18s %5d clients %8.1f req/s  p50 %7.1fms  '
+                   'p99 %7.1fms  %6d connections  %d errors' % (
+                       name, count, len(latencies) / float(seconds),
+                       percentile(latencies, 50) * 1000,
+                       percentile(latencies, 99) * 1000,
+                       stats['connections'], stats['errors']))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--items', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='catalog-asyncload-')
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, args.restaurants, args.items).dispose()
+        env = dict(os.environ, CATALOG_DATABASE_URL=url)
+        urls = paths(args.restaurants, args.items)
+        for name, command in SERVERS:
+            run(name, command, env, urls, args.clients, args.seconds)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Offline check of the avatar proxy, against a local stub origin.
+
+Serves generated portraits from a stub http server on localhost, points the
+users of a seeded database at it and checks that pages link the local
+avatar route, that each picture is fetched from the origin once, that the
+responses are cacheable and revalidate with a 304, that equal images are
+stored once, that a broken picture falls back to the origin and isn't
+fetched again for a while, that requests for a picture on a host that
+never answers wait for a single fetch and that the cache evicts the least
+recently used images. Then compares serving a cached avatar with
+downloading the picture from the origin.
+
+    python -m benchmarks.avatars --requests 200
+"""
+# absolute, so that avatars below is the app module and not this one.
+from __future__ import absolute_import
+
+import argparse
+import os
+import re
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from benchmarks.replica import check
+from benchmarks.seed import seedDatabase
+from avatars import AvatarCache, AvatarError, Image
+from database_setup import User
+
+
+def makePng(width, height, color):
+    """Returns a solid color RGB png of width x height pixels."""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    row = b'\x00' + struct.pack('BBB', *color) * width
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0,
+                                       0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * height)) +
+            chunk(b'IEND', b''))
+
+
+class StubOrigin(object):
+    """
+    An http server on localhost serving images from a dict of path to png
+    data, counting the requests for each path.
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self.hits = dict((path, 0) for path in images)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = stub.images.get(self.path)
+                stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def checkProxy(final_project, origin, cache_dir):
+    """Check the avatar route against the stub. Returns True if it passes."""
+    client = final_project.app.test_client()
+    ok = True
+
+    page = client.get('/restaurant/1/menu').get_data(as_text=True)
+    link = re.search(r'src="(/user/1/avatar/200\?v=\w+)"', page)
+    ok = check('the public menu links the local avatar',
+               link and origin.url not in page) and ok
+    path = link.group(1) if link else '/user/1/avatar/200'
+
+    first = client.get(path)
+    for i in xrange(20):
+        client.get(path)
+    ok = check('the picture is fetched from the origin once',
+               first.status_code == 200 and origin.hits['/1.png'] == 1) \
+        and ok
+    ok = check('versioned avatars are cached for a year',
+               'immutable' in first.headers.get('Cache-Control', '') and
+               first.headers.get('ETag')) and ok
+    again = client.get(path, headers={'If-None-Match':
+                                      first.headers.get('ETag')})
+    ok = check('a revalidation is answered with 304',
+               again.status_code == 304) and ok
+
+    client.get('/user/2/avatar/200')
+    blobs = os.listdir(os.path.join(cache_dir, 'blobs'))
+    ok = check('users with the same image share one cached copy',
+               len(blobs) == 1) and ok
+
+    broken = client.get('/user/3/avatar/200')
+    ok = check('a broken picture redirects to the origin',
+               broken.status_code == 302 and
+               broken.headers['Location'] == origin.url + '/missing.png') \
+        and ok
+    again = client.get('/user/3/avatar/200')
+    ok = check('a broken picture is not fetched again for a while',
+               again.status_code == 302 and
+               origin.hits['/missing.png'] == 1) and ok
+    ok = check('unknown sizes are not served',
+               client.get('/user/1/avatar/123').status_code == 404) and ok
+    return ok
+
+
+def checkEviction(origin, cache_dir):
+    """Check the LRU eviction. Returns True if it passes."""
+    sizes = [len(origin.images['/%d.png' % i]) for i in (4, 5, 6)]
+    cache = AvatarCache(cache_dir, max_bytes=sizes[0] + sizes[1] + 1)
+    first = cache.get(origin.url + '/4.png', 200)[2]
+    # an old modification time, as if it was last served long ago.
+    second = cache.get(origin.url + '/5.png', 200)[2]
+    os.utime(second, (0, 0))
+    cache.get(origin.url + '/4.png', 200)
+    cache.get(origin.url + '/6.png', 200)
+    return check('the least recently used image is evicted',
+                 os.path.exists(first) and not os.path.exists(second) and
+                 cache.total_bytes <= cache.max_bytes)
+
+
+def checkSilentHost(cache_dir, timeout=0.5, requests=4):
+    """
+    Check that concurrent requests for a picture on a host that accepts
+    connections and never answers wait for one fetch, and that the next
+    request fails at once. Returns True if it passes.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    # connections queue in the backlog and are never answered.
+    listener.listen(requests * 2)
+    url = 'http://127.0.0.1:%d/silent.png' % listener.getsockname()[1]
+    cache = AvatarCache(cache_dir, timeout=timeout)
+    finished = []
+
+    def request():
+        start = time.time()
+        try:
+            cache.get(url, 200)
+        except AvatarError:
+            pass
+        finished.append(time.time() - start)
+
+    try:
+        threads = [threading.Thread(target=request)
+                   for i in xrange(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        request()
+    finally:
+        listener.close()
+    print '%d requests for a silent host finished after %s s' % (
+        requests, ', '.join('%.2f' % seconds for seconds in finished))
+    ok = check('waiting requests share a failed fetch',
+               cache.fetches == 1 and
+               max(finished[:requests]) < timeout * 1.5)
+    return check('a recent failure is reported at once',
+                 finished[-1] < timeout / 2) and ok
+
+
+def timeRequests(function, requests):
+    """Returns the mean seconds of requests calls to function."""
+    start = time.time()
+    for i in xrange(requests):
+        function()
+    return (time.time() - start) / requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    # users 1 and 2 have the same picture at different urls.
+    portrait = makePng(400, 400, (200, 80, 40))
+    images = {'/1.png': portrait, '/2.png': portrait}
+    for i, color in ((4, (1, 2, 3)), (5, (4, 5, 6)), (6, (7, 8, 9))):
+        images['/%d.png' % i] = makePng(300 + i, 300, color)
+    origin = StubOrigin(images)
+
+    import final_project
+    workdir = tempfile.mkdtemp(prefix='catalog-avatars-')
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        engine = seedDatabase(url, restaurants=3, items=5, users=3)
+        for user_id, name in ((1, '1.png'), (2, '2.png'), (3, 'missing.png')):
+            engine.execute(User.__table__.update()
+                           .where(User.id == user_id)
+                           .values(picture='%s/%s' % (origin.url, name)))
+        engine.dispose()
+        cache_dir = os.path.join(workdir, 'avatars')
+        final_project.create_app({'DATABASE_URL': url,
+                                  'WORKER_MODE': 'sync',
+                                  'METRICS_ENABLED': False,
+                                  'AVATAR_CACHE_DIR': cache_dir})
+        ok = checkProxy(final_project, origin, cache_dir)
+        ok = checkEviction(origin, os.path.join(workdir, 'lru')) and ok
+        ok = checkSilentHost(os.path.join(workdir, 'silent')) and ok
+
+        client = final_project.app.test_client()
+        path = '/user/1/avatar/200'
+        cached = timeRequests(lambda: client.get(path), args.requests)
+        direct = timeRequests(
+            lambda: urllib2.urlopen(origin.url + '/1.png').read(),
+            args.requests)
+        served = len(client.get(path).get_data())
+        print '%-30s %10s %10s' % ('source', 'ms/request', 'bytes')
+        print '%-30s %10.2f %10d' % ('origin (stub on localhost)',
+                                     direct * 1000, len(portrait))
+        print '%-30s %10.2f %10d' % ('avatar cache', cached * 1000, served)
+        if Image is None:
+            print 'Pillow is not installed, so the avatars are not resized'
+        else:
+            ok = check('avatars are resized', served < len(portrait)) and ok
+        final_project.engine.dispose()
+    finally:
+        origin.close()
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
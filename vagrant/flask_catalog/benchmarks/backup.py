@@ -0,0 +1,215 @@
+"""
+Check and benchmark of online backups, snapshots and restore.
+
+Serves a seeded catalog through the Flask test client while a thread keeps
+reading menus and adding menu items, and measures the request latency with
+no backup running, during a backup throttled by pages and pauses and during
+one copied in a single step. Checks that the backups taken under load are
+consistent, that the admin endpoint needs its token and keeps only the
+newest snapshots, and that restoring a snapshot into the running app's
+database brings back exactly the snapshot's rows.
+
+    python -m benchmarks.backup --restaurants 2000 --items 100
+"""
+# benchmarks.backup would otherwise import itself as backup.
+from __future__ import absolute_import
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.replica import check
+from benchmarks.routes import LOGIN, ITEM_FORM
+from benchmarks.seed import seedDatabase
+
+TOKEN = 'benchmark-token'
+
+
+class Load(threading.Thread):
+    """
+    Reads a menu and adds a menu item in turn through the app, recording
+    the latency of every request.
+    """
+
+    def __init__(self, app, restaurants):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.app = app
+        self.restaurants = restaurants
+        self.latencies = []
+        self.stopped = False
+
+    def run(self):
+        client = self.app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+        i = 0
+        while not self.stopped:
+            i += 1
+            start = time.time()
+            if i % 2:
+                client.get('/restaurant/%d/menu/JSON' %
+                           (i % self.restaurants + 1))
+            else:
+                client.post('/restaurant/1/menu/new',
+                            data=dict(ITEM_FORM, name='Load %d' % i))
+            self.latencies.append(time.time() - start)
+
+    def measure(self, action):
+        """Returns the latencies of the requests made during action()."""
+        first = len(self.latencies)
+        result = action()
+        return result, self.latencies[first:]
+
+
+def percentile(values, fraction):
+    """Returns a percentile of values in ms, as text, '-' if there are none."""
+    if not values:
+        return '-'
+    values = sorted(values)
+    return '%.1f' % (values[min(len(values) - 1,
+                               int(len(values) * fraction))] * 1000)
+
+
+def consistent(path):
+    """
+    Check a backup holds a single moment: every menu item added by the load
+    has the change log entry committed with it.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        items = conn.execute("SELECT count(*) FROM menu_item "
+                             "WHERE name LIKE 'Load %'").fetchone()[0]
+        logged = conn.execute(
+            "SELECT count(*) FROM change WHERE table_name = 'menu_item' "
+            "AND action = 'create'").fetchone()[0]
+        return items > 0 and items == logged
+    finally:
+        conn.close()
+
+
+def rows(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT * FROM %s ORDER BY id' % table).fetchall()
+    finally:
+        conn.close()
+
+
+def checkEndpoint(client, app, database, directory):
+    """Check the admin endpoint's token and snapshot retention."""
+    from backup import listSnapshots
+    auth = {'Authorization': 'Bearer ' + TOKEN}
+    ok = check('backups need the token',
+               client.post('/admin/backup').status_code == 401 and
+               client.post('/admin/backup', headers={
+                   'Authorization': 'Bearer wrong'}).status_code == 401)
+    names = [json.loads(client.post('/admin/backup', headers=auth)
+                        .get_data())['snapshot'] for i in xrange(4)]
+    listed = json.loads(client.get('/admin/backups', headers=auth)
+                        .get_data())['snapshots']
+    ok = check('the newest %d of 4 snapshots are kept' %
+               app.config['BACKUP_KEEP'],
+               [s['name'] for s in listed] == names[1:] and
+               len(listSnapshots(database, directory)) == 3) and ok
+    app.config['BACKUP_TOKEN'] = None
+    ok = check('without a token the endpoint is off',
+               client.post('/admin/backup', headers=auth).status_code == 404
+               ) and ok
+    app.config['BACKUP_TOKEN'] = TOKEN
+    return ok
+
+
+def checkRestore(client, database, snapshot):
+    """Check that restoring a snapshot undoes the changes made since."""
+    from backup import restoreDatabase
+    client.post('/restaurant/11/delete')
+    client.post('/restaurant/1/menu/new', data=ITEM_FORM)
+    changed = json.loads(client.get('/restaurants/JSON').get_data())
+    restoreDatabase(snapshot, database)
+    restored = json.loads(client.get('/restaurants/JSON').get_data())
+    return check('restoring a snapshot brings back its rows',
+                 11 not in [r['id'] for r in changed['Restaurants']] and
+                 11 in [r['id'] for r in restored['Restaurants']] and
+                 all(rows(database, table) == rows(snapshot, table)
+                     for table in ('user', 'restaurant', 'menu_item',
+                                   'change')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=256)
+    parser.add_argument('--pause', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    import final_project
+    from backup import backupDatabase, checkDatabase
+    workdir = tempfile.mkdtemp(prefix='catalog-backup-')
+    try:
+        database = os.path.join(workdir, 'catalog.db')
+        directory = os.path.join(workdir, 'backups')
+        seedDatabase('sqlite:///' + database, args.restaurants,
+                     args.items).dispose()
+        app = final_project.create_app({
+            'DATABASE_URL': 'sqlite:///' + database, 'WORKER_MODE': 'sync',
+            'METRICS_ENABLED': False, 'COMPRESSION_ENABLED': False,
+            'BACKUP_TOKEN': TOKEN, 'BACKUP_DIR': directory,
+            'BACKUP_KEEP': 3})
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+
+        load = Load(app, args.restaurants)
+        load.start()
+        time.sleep(0.5)
+        results = [('no backup', load.measure(lambda: time.sleep(2)))]
+        for name, pages, pause in (
+                ('throttled (%d pages, %gs)' % (args.pages, args.pause),
+                 args.pages, args.pause),
+                ('single step', -1, 0)):
+            target = os.path.join(workdir, 'backup-%d.db' % pages)
+            results.append((name, load.measure(
+                lambda: backupDatabase(database, target, pages, pause))))
+        load.stopped = True
+        load.join()
+
+        print '%.1fMB database under load' % (
+            os.path.getsize(database) / 1e6)
+        print '%-26s %9s %9s %9s %9s' % ('backup', 'seconds', 'requests',
+                                        'p50 ms', 'p99 ms')
+        for name, (result, latencies) in results:
+            print '%-26s %9s %9d %9s %9s' % (
+                name, '%.2f' % result['seconds'] if result else '-',
+                len(latencies), percentile(latencies, 0.5),
+                percentile(latencies, 0.99))
+        ok = True
+        for pages in (args.pages, -1):
+            target = os.path.join(workdir, 'backup-%d.db' % pages)
+            checkDatabase(target)
+            ok = check('a %s backup under load is consistent' % (
+                'throttled' if pages > 0 else 'single step'),
+                consistent(target)) and ok
+
+        ok = checkEndpoint(client, app, database, directory) and ok
+        from backup import listSnapshots
+        ok = checkRestore(client, database,
+                          listSnapshots(database, directory)[-1]) and ok
+        app.extensions['events'].stop()
+        final_project.session.remove()
+        final_project.engine.dispose()
+    finally:
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Check of the /changes feed, and the cost of a sync with and without it.
+
+Runs every create, edit and delete route on a seeded database and checks
+that /changes?since=<token> reports exactly the rows each one changed, that
+long feeds are paged, and that a mirror or the event tailer polling while
+two writers overlap misses neither of their changes, on PostgreSQL too
+when one is available (see benchmarks.dialects). Then compares the bytes
+and time a mirror needs to pick up a batch of edits by downloading
+/restaurants/JSON and every menu again with fetching the changes since its
+token.
+
+    python -m benchmarks.changefeed --restaurants 500 --items 20 --edits 50
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.dialects import postgresUrl
+from benchmarks.replica import check
+from benchmarks.routes import LOGIN, ITEM_FORM
+from benchmarks.seed import seedDatabase
+
+
+def changes(client, since):
+    """Returns the decoded /changes response after token since."""
+    return json.loads(client.get('/changes?since=%d' % since).get_data())
+
+
+def ids(feed, key):
+    return sorted(row['id'] for row in feed[key])
+
+
+def checkRoutes(client, items):
+    """
+    Run each write route and check the changes it logged. Returns True if
+    they all pass.
+    """
+    # restaurant 1 and its items 1..items are owned by user 1, and so is
+    # restaurant 11.
+    item = 1
+    doomed = range(10 * items + 1, 11 * items + 1)
+    bulk = json.dumps({'update': [{'id': 2, 'price': '$1.00'},
+                                  {'id': 3, 'price': '$2.00'}],
+                       'delete': [4]})
+    steps = [
+        ('new restaurant', lambda: client.post(
+            '/restaurant/new', data={'name': 'Fresh'}),
+         lambda feed: feed['Restaurants'][0]['name'] == 'Fresh'),
+        ('edit restaurant', lambda: client.post(
+            '/restaurant/1/edit', data={'name': 'Renamed'}),
+         lambda feed: feed['Restaurants'] == [{'id': 1, 'name': 'Renamed'}]),
+        ('new menu item', lambda: client.post(
+            '/restaurant/1/menu/new', data=ITEM_FORM),
+         lambda feed: [(row['name'], row['restaurant_id'])
+                       for row in feed['MenuItems']] ==
+            [(ITEM_FORM['name'], 1)]),
+        ('edit menu item', lambda: client.post(
+            '/restaurant/1/menu/%d/edit' % item,
+            data=dict(ITEM_FORM, name='Edited')),
+         lambda feed: ids(feed, 'MenuItems') == [item]),
+        ('delete menu item', lambda: client.post(
+            '/restaurant/1/menu/%d/delete' % item),
+         lambda feed: feed['deleted']['MenuItems'] == [item] and
+            not feed['MenuItems']),
+        ('import menu items', lambda: client.post(
+            '/restaurant/1/menu/import', content_type='application/json',
+            data=json.dumps([dict(ITEM_FORM, name='Imported %d' % i)
+                             for i in xrange(3)])),
+         lambda feed: sorted(row['name'] for row in feed['MenuItems']) ==
+            ['Imported 0', 'Imported 1', 'Imported 2']),
+        ('bulk edit menu items', lambda: client.post(
+            '/restaurant/1/menu/bulk', content_type='application/json',
+            data=bulk),
+         lambda feed: ids(feed, 'MenuItems') == [2, 3] and
+            feed['deleted']['MenuItems'] == [4]),
+        ('delete restaurant', lambda: client.post('/restaurant/11/delete'),
+         lambda feed: feed['deleted']['Restaurants'] == [11] and
+            feed['deleted']['MenuItems'] == doomed),
+    ]
+    ok = True
+    token = json.loads(client.get('/changes').get_data())['next']
+    for name, action, expected in steps:
+        status = action().status_code
+        feed = changes(client, token)
+        ok = check('%s is in the change feed' % name,
+                   status < 400 and expected(feed)) and ok
+        token = feed['next']
+    ok = check('an unchanged catalog has no changes',
+               changes(client, token)['next'] == token) and ok
+    ok = check('a bad token is rejected',
+               client.get('/changes?since=x').status_code == 400) and ok
+    return ok
+
+
+def checkPaging(client, page_size):
+    """Check that a feed longer than a page is paged without losses."""
+    token = json.loads(client.get('/changes').get_data())['next']
+    rows = [dict(ITEM_FORM, name='Paged %d' % i)
+            for i in xrange(page_size * 2 + 1)]
+    client.post('/restaurant/1/menu/import', content_type='application/json',
+                data=json.dumps(rows))
+    seen, pages, more = set(), 0, True
+    while more:
+        feed = changes(client, token)
+        seen.update(row['name'] for row in feed['MenuItems'])
+        token, more = feed['next'], feed['more']
+        pages += 1
+    return check('%d changes arrive in %d pages' % (len(rows), pages),
+                 seen == set(row['name'] for row in rows) and pages == 3)
+
+
+def overlappingWriters(url, poll):
+    """
+    Log a menu item change in one transaction and, while it is open, another
+    in a second one that commits first if it can, with a mirror calling
+    poll(session, since) -> (changed item ids, next token) in between.
+    Returns the item ids the mirror got.
+    """
+    from sqlalchemy.orm import sessionmaker
+
+    from changes import latestToken, logChanges
+    from database_setup import MenuItem
+    from db import makeEngine
+    engine = makeEngine(url)
+    DBSession = sessionmaker(bind=engine)
+    mirror = DBSession()
+    token = latestToken(mirror)
+    mirror.commit()
+
+    first = DBSession()
+    logChanges(first, MenuItem, 'update', [1], 1)
+
+    def second():
+        session = DBSession()
+        logChanges(session, MenuItem, 'update', [2], 1)
+        session.commit()
+        session.close()
+    thread = threading.Thread(target=second)
+    thread.start()
+    thread.join(0.5)
+
+    seen, token = poll(mirror, token)
+    mirror.commit()
+    first.commit()
+    first.close()
+    thread.join()
+    more, token = poll(mirror, token)
+    mirror.close()
+    engine.dispose()
+    return sorted(seen + more)
+
+
+def feedIds(session, since):
+    """Poll /changes' query. Returns (changed item ids, next token)."""
+    from changes import changesSince
+    feed = changesSince(session, since)
+    return ids(feed, 'MenuItems'), feed['next']
+
+
+def eventIds(session, since):
+    """Poll like the SSE tailer. Returns (changed item ids, next token)."""
+    from events import menuEvents
+    events, last = menuEvents(session, since)
+    return [event[3]['id'] for event in events], last
+
+
+def checkCommitOrder(urls):
+    """
+    Check that overlapping writers' changes all reach a mirror and the
+    event stream, for every (name, url) pair.
+    """
+    ok = True
+    for name, url in urls:
+        ok = check('%s: a poll between overlapping writers loses nothing' %
+                   name, overlappingWriters(url, feedIds) == [1, 2]) and ok
+        ok = check('%s: the event tailer loses nothing either' % name,
+                   overlappingWriters(url, eventIds) == [1, 2]) and ok
+    return ok
+
+
+def fullSync(client):
+    """Download the whole catalog. Returns (bytes, seconds)."""
+    start = time.time()
+    body = client.get('/restaurants/JSON').get_data()
+    size = len(body)
+    for restaurant in json.loads(body)['Restaurants']:
+        size += len(client.get('/restaurant/%d/menu/JSON' %
+                               restaurant['id']).get_data())
+    return size, time.time() - start
+
+
+def incrementalSync(client, token):
+    """Fetch the changes since token. Returns (bytes, seconds)."""
+    start = time.time()
+    size, more = 0, True
+    while more:
+        body = client.get('/changes?since=%d' % token).get_data()
+        size += len(body)
+        feed = json.loads(body)
+        token, more = feed['next'], feed['more']
+    return size, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=500)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--edits', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    import final_project
+    workdir = tempfile.mkdtemp(prefix='catalog-changes-')
+    cleanup = [lambda: shutil.rmtree(workdir)]
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, args.restaurants, args.items).dispose()
+        urls = [('sqlite', url)]
+        postgres = postgresUrl(cleanup)
+        if postgres:
+            from database_setup import Base
+            from db import makeEngine
+            engine = makeEngine(postgres)
+            Base.metadata.drop_all(engine)
+            engine.dispose()
+            seedDatabase(postgres, restaurants=2, items=2).dispose()
+            urls.append(('postgresql', postgres))
+        ok = checkCommitOrder(urls)
+        app = final_project.create_app({'DATABASE_URL': url,
+                                        'WORKER_MODE': 'sync',
+                                        'METRICS_ENABLED': False,
+                                        'COMPRESSION_ENABLED': False,
+                                        'CHANGES_PAGE_SIZE': args.page_size})
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+        ok = checkRoutes(client, args.items) and ok
+        ok = checkPaging(client, args.page_size) and ok
+
+        # a batch of edits spread over the restaurants user 1 owns.
+        token = json.loads(client.get('/changes').get_data())['next']
+        for i in xrange(args.edits):
+            restaurant = (i * 10) % args.restaurants + 1
+            if restaurant == 11:
+                continue
+            client.post('/restaurant/%d/edit' % restaurant,
+                        data={'name': 'Edit %d' % i})
+        full = fullSync(client)
+        incremental = incrementalSync(client, token)
+        print '%-24s %12s %10s' % ('sync', 'bytes', 'ms')
+        for name, (size, seconds) in (('full download', full),
+                                      ('changes since token', incremental)):
+            print '%-24s %12d %10.1f' % (name, size, seconds * 1000)
+        final_project.engine.dispose()
+    finally:
+        for step in reversed(cleanup):
+            step()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
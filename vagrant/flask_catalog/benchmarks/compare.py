@@ -0,0 +1,49 @@
+"""
+Compare two route benchmark reports, e.g. from two commits.
+
+    python -m benchmarks.compare before.json after.json
+
+Prints the change in throughput, median and 99th percentile latency and
+queries per request for every route found in both reports.
+"""
+import json
+import sys
+
+
+def change(before, after):
+    if not before or after is None:
+        return '       -'
+    return '%+7.1f%%' % ((after - before) * 100.0 / before)
+
+
+def compare(before, after):
+    names = sorted(set(before['results']) & set(after['results']))
+    print '%-50s %9s %9s %9s %9s' % ('route', 'req/s', 'p50', 'p99',
+                                     'queries')
+    for name in names:
+        old, new = before['results'][name], after['results'][name]
+        print '%-50s %9s %9s %9s %9s' % (
+            name,
+            change(old.get('throughput_rps'), new.get('throughput_rps')),
+            change(old.get('p50_ms'), new.get('p50_ms')),
+            change(old.get('p99_ms'), new.get('p99_ms')),
+            change(old.get('queries_per_request'),
+                   new.get('queries_per_request')))
+    for name in sorted(set(before['results']) ^ set(after['results'])):
+        print '%-50s only in %s' % (
+            name, 'before' if name in before['results'] else 'after')
+
+
+def main(argv):
+    if len(argv) != 2:
+        print __doc__
+        sys.exit(1)
+    reports = []
+    for path in argv:
+        with open(path) as f:
+            reports.append(json.load(f))
+    compare(*reports)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
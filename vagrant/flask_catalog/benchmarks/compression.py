@@ -0,0 +1,91 @@
+"""
+Bytes saved and CPU spent by response compression.
+
+Fetches the large html and JSON routes of final_project.py uncompressed,
+then for gzip and brotli reports the compressed size, the CPU time of a
+fresh compression and of a repeated response served from the compressed
+body cache, and the end to end latency of the route with that encoding.
+
+    python -m benchmarks.compression --restaurants 200 --items 50
+"""
+# absolute, so that compression below is the app module and not this one.
+from __future__ import absolute_import
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.routes import LOGIN
+from benchmarks.seed import seedDatabase
+import compression
+
+ROUTES = ['/restaurants', '/restaurant/1/menu', '/restaurants/JSON',
+          '/restaurant/1/menu/JSON']
+
+
+def cpu(function, repeat):
+    """Returns the median CPU seconds of repeat calls to function."""
+    times = []
+    for i in xrange(repeat):
+        start = time.clock()
+        function()
+        times.append(time.clock() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=200)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    encodings = ['gzip'] + (['br'] if compression.brotli else [])
+    import final_project
+    workdir = tempfile.mkdtemp(prefix='catalog-compression-')
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, args.restaurants, args.items).dispose()
+        app = final_project.create_app({'DATABASE_URL': url,
+                                        'WORKER_MODE': 'sync',
+                                        'METRICS_ENABLED': False})
+        compressor = app.extensions['compression']
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+
+        print '%-26s %-8s %9s %9s %7s %10s %10s %9s' % (
+            'route', 'encoding', 'bytes', 'sent', 'saved', 'cold cpu',
+            'cached cpu', 'latency')
+        for path in ROUTES:
+            body = client.get(path).get_data()
+            latency = cpu(lambda: client.get(path), args.repeat)
+            print '%-26s %-8s %9d %9d %6.1f%% %10s %10s %8.2fms' % (
+                path, 'identity', len(body), len(body), 0, '-', '-',
+                latency * 1000)
+            for encoding in encodings:
+                compressed = compressor.encode(body, encoding)
+                cold = cpu(lambda: compressor.encode(body, encoding),
+                           args.repeat)
+                compressor.compress(body, encoding)
+                cached = cpu(lambda: compressor.compress(body, encoding),
+                             args.repeat)
+                latency = cpu(lambda: client.get(
+                    path, headers={'Accept-Encoding': encoding}),
+                    args.repeat)
+                print '%-26s %-8s %9d %9d %6.1f%% %8.2fms %8.3fms ' \
+                    '%8.2fms' % (
+                        path, encoding, len(body), len(compressed),
+                        100.0 - len(compressed) * 100.0 / len(body),
+                        cold * 1000, cached * 1000, latency * 1000)
+        print 'compressed body cache: %d hits, %d misses, %d bytes' % (
+            compressor.hits, compressor.misses, compressor.cached_bytes)
+        final_project.engine.dispose()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
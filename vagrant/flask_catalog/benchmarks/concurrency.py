@@ -0,0 +1,111 @@
+"""
+Parallel editor check for the optimistic concurrency control of the edit
+routes.
+
+Starts a number of editor threads that all edit the same menu item (and
+restaurant) through the Flask test client, each rendering the edit form,
+reading the version from it and posting an edit based on that version. An
+edit is either applied or rejected as stale, never lost: the item's final
+version must be its initial version plus the number of applied edits.
+
+    python -m benchmarks.concurrency --editors 8 --rounds 50
+"""
+import argparse
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.routes import LOGIN
+from benchmarks.seed import seedDatabase
+from database_setup import Restaurant, MenuItem
+
+VERSION_FIELD = re.compile(r'name="version" value="(\d+)"')
+
+
+def editor(app, number, rounds, edit_path, form, counts, lock):
+    """Edit the object at edit_path rounds times, counting the outcomes."""
+    client = app.test_client()
+    with client.session_transaction() as login_session:
+        login_session.update(LOGIN)
+    for i in xrange(rounds):
+        page = client.get(edit_path)
+        version = VERSION_FIELD.search(page.get_data(as_text=True)).group(1)
+        data = dict(form, name='Editor %d edit %d' % (number, i),
+                    version=version)
+        response = client.post(edit_path, data=data)
+        location = response.headers.get('Location', '')
+        if response.status_code != 302:
+            outcome = 'errors'
+        elif location.endswith(edit_path):
+            # rejected and sent back to the form.
+            outcome = 'stale'
+        else:
+            outcome = 'applied'
+        with lock:
+            counts[outcome] += 1
+
+
+def run(app, session, model, object_id, edit_path, form, editors, rounds):
+    """Run the editors against one object and check no edit was lost."""
+    initial = session.query(model.version).filter_by(id=object_id).scalar()
+    session.remove()
+    counts = {'applied': 0, 'stale': 0, 'errors': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=editor,
+                                args=(app, number, rounds, edit_path, form,
+                                      counts, lock))
+               for number in xrange(editors)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    final = session.query(model.version).filter_by(id=object_id).scalar()
+    session.remove()
+    consistent = final == initial + counts['applied']
+    print '%-12s %5d applied %5d stale %3d errors %8.1f edits/s  %s' % (
+        model.__tablename__, counts['applied'], counts['stale'],
+        counts['errors'], editors * rounds / elapsed,
+        'ok' if consistent else
+        'LOST UPDATES (version %d, expected %d)' % (
+            final, initial + counts['applied']))
+    return consistent and not counts['errors']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--editors', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    import final_project
+    tmp = tempfile.mkdtemp(prefix='catalog-concurrency-')
+    try:
+        url = 'sqlite:///%s/catalog.db' % tmp
+        seedDatabase(url, restaurants=10, items=5).dispose()
+        app = final_project.create_app({'DATABASE_URL': url,
+                                        'WORKER_MODE': 'sync',
+                                        'METRICS_ENABLED': False})
+        session = final_project.session
+        # the benchmark user owns restaurant 1 and its items.
+        item_id = session.query(MenuItem.id).filter_by(
+            restaurant_id=1).order_by(MenuItem.id).first()[0]
+        ok = run(app, session, MenuItem, item_id,
+                 '/restaurant/1/menu/%d/edit' % item_id,
+                 {'description': '', 'course': 'Entree', 'price': ''},
+                 args.editors, args.rounds)
+        ok = run(app, session, Restaurant, 1, '/restaurant/1/edit', {},
+                 args.editors, args.rounds) and ok
+        final_project.engine.dispose()
+    finally:
+        shutil.rmtree(tmp)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
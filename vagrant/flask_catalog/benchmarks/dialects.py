@@ -0,0 +1,134 @@
+"""
+Run the route benchmark against every supported database.
+
+Seeds each database and drives every final_project.py route through it,
+failing if any route errors, so schema or query changes that only work on
+SQLite are caught. The matrix is:
+
+- sqlite: a temporary SQLite file.
+- postgresql: the database at CATALOG_TEST_POSTGRES_URL if it is set
+  (its tables are dropped and recreated), otherwise a throwaway cluster
+  started with initdb and pg_ctl when they are on the PATH. Skipped when
+  neither is available or psycopg2 isn't installed.
+
+    python -m benchmarks.dialects --iterations 20
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.routes import benchmarkFlask
+from benchmarks.seed import seedDatabase
+from database_setup import Base
+from db import makeEngine
+
+POSTGRES_PORT = 5499
+
+
+def which(program):
+    """Returns the path of program on the PATH, or None."""
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, program)
+        if os.access(path, os.X_OK):
+            return path
+    return None
+
+
+class TemporaryPostgres(object):
+    """A PostgreSQL cluster in a temporary directory, for the matrix."""
+
+    def __init__(self, port=POSTGRES_PORT):
+        self.port = port
+        self.directory = tempfile.mkdtemp(prefix='catalog-postgres-')
+        self.data = os.path.join(self.directory, 'data')
+
+    def start(self):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['initdb', '-D', self.data, '-U', 'catalog',
+                                   '-A', 'trust'], stdout=devnull)
+            subprocess.check_call(
+                ['pg_ctl', '-D', self.data, '-w', '-l',
+                 os.path.join(self.directory, 'log'), '-o',
+                 '-p %d -k %s -c listen_addresses=' % (self.port,
+                                                       self.directory),
+                 'start'], stdout=devnull)
+        return 'postgresql://catalog@/postgres?host=%s&port=%d' % (
+            self.directory, self.port)
+
+    def stop(self):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['pg_ctl', '-D', self.data, '-m', 'fast',
+                             'stop'], stdout=devnull)
+        shutil.rmtree(self.directory)
+
+
+def postgresUrl(cleanup):
+    """
+    Returns the URL of a PostgreSQL database for the matrix, or None with
+    the reason it is skipped printed. Adds what needs stopping to cleanup.
+    """
+    try:
+        import psycopg2
+    except ImportError:
+        print 'postgresql: skipped, psycopg2 is not installed'
+        return None
+    if os.environ.get('CATALOG_TEST_POSTGRES_URL'):
+        return os.environ['CATALOG_TEST_POSTGRES_URL']
+    if not (which('initdb') and which('pg_ctl')):
+        print 'postgresql: skipped, set CATALOG_TEST_POSTGRES_URL or put ' \
+            'initdb and pg_ctl on the PATH'
+        return None
+    server = TemporaryPostgres()
+    cleanup.append(server.stop)
+    return server.start()
+
+
+def runMatrix(urls, restaurants, items, iterations):
+    """Benchmark every (name, url) pair. Returns the failing route names."""
+    failures = []
+    for name, url in urls:
+        engine = makeEngine(url)
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+        seedDatabase(url, restaurants, items).dispose()
+        start = time.time()
+        results = benchmarkFlask(url, restaurants, items, iterations)
+        print '%s: %d routes in %.1fs' % (name, len(results),
+                                          time.time() - start)
+        for route in sorted(results):
+            errors = results[route].get('errors')
+            if errors:
+                print '  %-50s %d errors' % (route, errors)
+                failures.append('%s %s' % (name, route))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=20)
+    parser.add_argument('--items', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    cleanup = [lambda: shutil.rmtree(workdir)]
+    try:
+        urls = [('sqlite', 'sqlite:///' + os.path.join(workdir, 'catalog.db'))]
+        postgres = postgresUrl(cleanup)
+        if postgres:
+            urls.append(('postgresql', postgres))
+        failures = runMatrix(urls, args.restaurants, args.items,
+                             args.iterations)
+    finally:
+        for step in reversed(cleanup):
+            step()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
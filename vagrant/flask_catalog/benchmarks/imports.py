@@ -0,0 +1,169 @@
+"""
+Import time profile of final_project.py.
+
+Imports final_project in fresh interpreters and reports how long the import
+takes and where the time goes, by package and by module, like the
+'-X importtime' option of Python 3, which Python 2 lacks. Checks that the
+import leaves out the login provider libraries, doesn't touch a database,
+and that the app starts without the client secrets files. The import time
+is also part of the benchmarks.routes report, so benchmarks.compare tracks
+it between commits.
+
+    python -m benchmarks.imports --rounds 10
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.replica import check
+from benchmarks.routes import APP_DIR
+
+# the login provider libraries, imported on first login.
+PROVIDERS = ('oauth2client.client', 'httplib2', 'requests')
+
+# imports a module with every import timed, printing the profile as JSON.
+RUNNER = '''
+import __builtin__, json, sys, time
+original = __builtin__.__import__
+stack, modules = [], []
+
+
+def absoluteName(name, globals, level):
+    # the module a relative or implicitly relative import refers to.
+    if not globals or level == 0:
+        return name
+    package = globals.get('__package__') or globals.get('__name__', '')
+    if '__path__' not in globals and not globals.get('__package__'):
+        package = package.rpartition('.')[0]
+    if level > 0:
+        package = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return package + '.' + name if name else package
+    if package and package + '.' + name in sys.modules:
+        return package + '.' + name
+    return name
+
+
+def timedImport(name, globals=None, locals=None, fromlist=None, level=-1):
+    loaded = len(sys.modules)
+    start = time.time()
+    stack.append(0.0)
+    try:
+        return original(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.time() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += cumulative
+        if len(sys.modules) > loaded:
+            modules.append((absoluteName(name, globals, level),
+                            cumulative - children, cumulative))
+
+__builtin__.__import__ = timedImport
+start = time.time()
+__import__(sys.argv[1])
+total = time.time() - start
+__builtin__.__import__ = original
+print json.dumps({'total': total, 'modules': modules,
+                  'loaded': sorted(sys.modules)})
+'''
+
+
+def importProfile(module='final_project', environ=None):
+    """
+    Import module in a fresh interpreter. Returns a dict of the total
+    seconds, the (name, self seconds, cumulative seconds) of every import
+    that loaded something, and the names of the loaded modules.
+    """
+    output = subprocess.check_output([sys.executable, '-c', RUNNER, module],
+                                     cwd=APP_DIR, env=environ)
+    return json.loads(output.splitlines()[-1])
+
+
+def packageTimes(profile):
+    """Returns the self seconds of the profile by top level package."""
+    packages = {}
+    for name, own, cumulative in profile['modules']:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    return packages
+
+
+def checkStartup(workdir):
+    """
+    Check that importing final_project opens no database and that the app
+    serves pages without client secrets files. Returns True if so.
+    """
+    database = os.path.join(workdir, 'catalog.db')
+    environ = dict(os.environ, CATALOG_DATABASE_URL='sqlite:///' + database)
+    profile = importProfile(environ=environ)
+    ok = check('importing final_project opens no database',
+               not os.path.exists(database))
+    ok = check('the login provider libraries are not imported',
+               not [name for name in profile['loaded']
+                    if name.split('.')[0] in
+                    [provider.split('.')[0] for provider in PROVIDERS]]
+               ) and ok
+
+    import final_project
+    app = final_project.create_app({
+        'DATABASE_URL': 'sqlite:///' + database, 'WORKER_MODE': 'sync',
+        'METRICS_ENABLED': False,
+        'GOOGLE_CLIENT_SECRETS': os.path.join(workdir, 'missing.json'),
+        'FACEBOOK_CLIENT_SECRETS': os.path.join(workdir, 'missing.json')})
+    client = app.test_client()
+    ok = check('the app starts without client secrets',
+               client.get('/restaurants').status_code == 200 and
+               client.get('/login').status_code == 200) and ok
+    with client.session_transaction() as login_session:
+        login_session['state'] = 'benchmark'
+    ok = check('logins report the missing secrets',
+               client.post('/gconnect?state=benchmark').status_code == 503 and
+               client.post('/fbconnect?state=benchmark').status_code == 503
+               ) and ok
+    app.extensions['events'].stop()
+    final_project.session.remove()
+    final_project.engine.dispose()
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    profiles = [importProfile() for i in xrange(args.rounds)]
+    totals = sorted(profile['total'] for profile in profiles)
+    print 'import final_project: median %.1fms, best %.1fms of %d' % (
+        totals[len(totals) // 2] * 1000, totals[0] * 1000, len(totals))
+    # the median round's breakdown.
+    profile = sorted(profiles, key=lambda p: p['total'])[len(profiles) // 2]
+    print '\n%-30s %10s' % ('package', 'self ms')
+    for package, seconds in sorted(packageTimes(profile).items(),
+                                   key=lambda item: -item[1])[:args.top]:
+        print '%-30s %10.1f' % (package, seconds * 1000)
+    print '\n%-40s %10s %10s' % ('import', 'self ms', 'total ms')
+    for name, own, cumulative in sorted(profile['modules'],
+                                        key=lambda m: -m[2])[:args.top]:
+        print '%-40s %10.1f %10.1f' % (name, own * 1000, cumulative * 1000)
+
+    print '\n%-30s %10s' % ('provider library', 'import ms')
+    for name in PROVIDERS:
+        print '%-30s %10.1f' % (name, importProfile(name)['total'] * 1000)
+    print
+
+    workdir = tempfile.mkdtemp(prefix='catalog-imports-')
+    try:
+        ok = checkStartup(workdir)
+    finally:
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
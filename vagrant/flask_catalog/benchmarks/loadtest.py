@@ -0,0 +1,119 @@
+"""
+Load test comparing the development server with production WSGI servers.
+
+Starts each server in turn on a local port, hits a few read only routes from
+concurrent client threads for a fixed time and prints throughput and latency
+percentiles. Servers whose executable isn't installed are skipped.
+
+    python -m benchmarks.loadtest [seconds] [clients]
+"""
+import httplib
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+PORT = 5099
+PATHS = ['/restaurants', '/restaurants/JSON', '/restaurant/1/menu',
+         '/restaurant/1/menu/JSON']
+
+RUN_APP = ("from final_project import create_app; "
+           "app = create_app({'WORKER_MODE': %r}); "
+           "app.run(host=%r, port=%d, threaded=%r)")
+
+SERVERS = [
+    ('app.run', [sys.executable, '-c',
+                 RUN_APP % ('sync', HOST, PORT, False)]),
+    ('app.run threaded', [sys.executable, '-c',
+                          RUN_APP % ('threaded', HOST, PORT, True)]),
+    ('gunicorn 4 workers', ['gunicorn', '--workers', '4', '--bind',
+                            '%s:%d' % (HOST, PORT), 'wsgi:application']),
+    ('uwsgi 4 processes', ['uwsgi', '--http', '%s:%d' % (HOST, PORT),
+                           '--processes', '4', '--module',
+                           'wsgi:application', '--disable-logging']),
+]
+
+
+def waitForPort(timeout=15):
+    """Block until the server accepts connections."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+def client(deadline, latencies, errors):
+    """Request the benchmark paths in turn until the deadline passes."""
+    i = 0
+    while time.time() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.time()
+        try:
+            conn = httplib.HTTPConnection(HOST, PORT, timeout=10)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (socket.error, httplib.HTTPException) as e:
+            errors.append(e)
+            continue
+        latencies.append(time.time() - start)
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+def run(name, command, seconds, clients):
+    try:
+        server = subprocess.Popen(command, cwd=APP_DIR,
+                                  stdout=open(os.devnull, 'w'),
+                                  stderr=subprocess.STDOUT)
+    except OSError:
+        print '%-20s skipped (not installed)' % name
+        return
+    try:
+        if not waitForPort():
+            print '%-20s failed to start' % name
+            return
+        latencies, errors = [], []
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=client,
+                                    args=(deadline, latencies, errors))
+                   for i in xrange(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        latencies.sort()
+        if not latencies:
+            print '%-20s no successful requests' % name
+            return
+        print ('%-20s %8.1f req/s  p50 %6.1fms  p99 %6.1fms  errors %d' %
+               (name, len(latencies) / float(seconds),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, len(errors)))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(seconds=10, clients=16):
+    for name, command in SERVERS:
+        run(name, command, seconds, clients)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,151 @@
+"""
+Compare SQLite read and write throughput across the PRAGMA profiles of
+db.py.
+
+Every profile gets its own copy of a seeded database and is measured with
+the statements the catalog routes run:
+
+- reads: listing the restaurants and one restaurant's menu.
+- writes: inserting a menu item in its own committed transaction.
+- mixed: reader threads listing menus while one thread writes, which
+  is where the rollback journal makes readers wait for the writer.
+
+    python -m benchmarks.pragmas --profiles defaults wal tuned \
+        wal,cache_size=-20000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select
+
+from benchmarks.seed import seedDatabase
+from database_setup import Restaurant, MenuItem
+from db import makeEngine, PRAGMA_PROFILES
+
+
+def readOnce(conn, restaurant_id):
+    conn.execute(select([Restaurant.__table__])).fetchall()
+    conn.execute(select([MenuItem.__table__]).where(
+        MenuItem.restaurant_id == restaurant_id)).fetchall()
+
+
+def writeOnce(conn, restaurant_id, i):
+    with conn.begin():
+        conn.execute(MenuItem.__table__.insert(), name='Pragma %d' % i,
+                     restaurant_id=restaurant_id, user_id=1)
+
+
+def reads(engine, restaurants, count):
+    """Returns read operations per second on one connection."""
+    rng = random.Random(0)
+    conn = engine.connect()
+    start = time.time()
+    for i in xrange(count):
+        readOnce(conn, rng.randint(1, restaurants))
+    elapsed = time.time() - start
+    conn.close()
+    return count / elapsed
+
+
+def writes(engine, restaurants, count):
+    """Returns committed write transactions per second."""
+    conn = engine.connect()
+    start = time.time()
+    for i in xrange(count):
+        writeOnce(conn, i % restaurants + 1, i)
+    elapsed = time.time() - start
+    conn.close()
+    return count / elapsed
+
+
+def mixed(engine, restaurants, count, readers):
+    """
+    Returns reads and writes per second with reader threads running
+    alongside one writer thread, each doing count operations.
+    """
+    done = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        conn = engine.connect()
+        for i in xrange(count):
+            try:
+                readOnce(conn, rng.randint(1, restaurants))
+                key = 'reads'
+            except Exception:
+                key = 'errors'
+            with lock:
+                done[key] += 1
+        conn.close()
+
+    def writer():
+        conn = engine.connect()
+        for i in xrange(count):
+            try:
+                writeOnce(conn, i % restaurants + 1, i)
+                key = 'writes'
+            except Exception:
+                key = 'errors'
+            with lock:
+                done[key] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=reader, args=(n,))
+               for n in xrange(readers)]
+    threads.append(threading.Thread(target=writer))
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return done['reads'] / elapsed, done['writes'] / elapsed, done['errors']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--profiles', nargs='+',
+                        default=sorted(PRAGMA_PROFILES),
+                        help='profile specs, see db.sqlitePragmas()')
+    parser.add_argument('--restaurants', type=int, default=200)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--count', type=int, default=500,
+                        help='operations per measurement')
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='catalog-pragmas-')
+    try:
+        seeded = os.path.join(workdir, 'seeded.db')
+        seedDatabase('sqlite:///' + seeded, args.restaurants,
+                     args.items).dispose()
+        print '%-24s %10s %10s %12s %12s %7s' % (
+            'profile', 'reads/s', 'writes/s', 'mixed r/s', 'mixed w/s',
+            'errors')
+        for profile in args.profiles:
+            path = os.path.join(workdir, 'profile.db')
+            shutil.copyfile(seeded, path)
+            engine = makeEngine('sqlite:///' + path, pragmas=profile)
+            read_rate = reads(engine, args.restaurants, args.count)
+            write_rate = writes(engine, args.restaurants, args.count)
+            mixed_reads, mixed_writes, errors = mixed(
+                engine, args.restaurants, args.count, args.readers)
+            engine.dispose()
+            print '%-24s %10.1f %10.1f %12.1f %12.1f %7d' % (
+                profile, read_rate, write_rate, mixed_reads, mixed_writes,
+                errors)
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
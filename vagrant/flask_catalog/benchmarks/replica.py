@@ -0,0 +1,140 @@
+"""
+Local check of the read replica routing, with two SQLite files.
+
+Seeds a primary database and copies it to a replica file, which is never
+updated afterwards, so every read served by the replica is visibly stale
+after a change. Checks that read only routes go to the replica, that writes
+go to the primary and that a user reads their own writes from the primary
+until REPLICA_STICKY_SECONDS have passed, then compares the throughput of
+the read only routes with and without a replica.
+
+    python -m benchmarks.replica --iterations 300
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from benchmarks.routes import LOGIN
+from benchmarks.seed import seedDatabase
+from routing import LAST_WRITE_KEY
+
+READ_ROUTES = ['/restaurants', '/restaurant/1/menu', '/restaurants/JSON',
+               '/restaurant/1/menu/JSON']
+
+
+class EngineCounter(object):
+    """Counts the statements executed by each of a set of engines."""
+
+    def __init__(self, **engines):
+        self.counts = dict((name, 0) for name in engines)
+        for name, engine in engines.items():
+            event.listen(engine, 'before_cursor_execute', self.counter(name))
+
+    def counter(self, name):
+        def count(*args):
+            self.counts[name] += 1
+        return count
+
+    def reset(self):
+        for name in self.counts:
+            self.counts[name] = 0
+
+
+def check(description, ok):
+    print '%-60s %s' % (description, 'ok' if ok else 'FAILED')
+    return ok
+
+
+def checkRouting(final_project, client):
+    """Check where reads and writes go. Returns True if they all pass."""
+    counter = EngineCounter(primary=final_project.engine,
+                            replica=final_project.replica_engine)
+    ok = True
+    for path in READ_ROUTES:
+        counter.reset()
+        client.get(path)
+        ok = check('GET %s reads from the replica' % path,
+                   counter.counts['replica'] and
+                   not counter.counts['primary']) and ok
+
+    counter.reset()
+    client.post('/restaurant/1/edit', data={'name': 'Renamed On Primary'})
+    ok = check('POST /restaurant/1/edit writes to the primary',
+               counter.counts['primary'] and
+               not counter.counts['replica']) and ok
+
+    counter.reset()
+    page = client.get('/restaurant/1/menu').get_data(as_text=True)
+    ok = check('the editor reads their own write from the primary',
+               'Renamed On Primary' in page and
+               not counter.counts['replica']) and ok
+
+    with client.session_transaction() as login_session:
+        login_session[LAST_WRITE_KEY] -= (
+            final_project.app.config['REPLICA_STICKY_SECONDS'])
+    counter.reset()
+    page = client.get('/restaurant/1/menu').get_data(as_text=True)
+    ok = check('after the sticky period reads go to the (stale) replica',
+               'Renamed On Primary' not in page and
+               not counter.counts['primary']) and ok
+    return ok
+
+
+def throughput(client, iterations):
+    """Returns requests per second over the read only routes."""
+    start = time.time()
+    for i in xrange(iterations):
+        for path in READ_ROUTES:
+            client.get(path)
+    return iterations * len(READ_ROUTES) / (time.time() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    import final_project
+    tmp = tempfile.mkdtemp(prefix='catalog-replica-')
+    try:
+        primary = '%s/primary.db' % tmp
+        replica = '%s/replica.db' % tmp
+        seedDatabase('sqlite:///' + primary, restaurants=args.restaurants,
+                     items=args.items).dispose()
+        shutil.copyfile(primary, replica)
+        config = {'DATABASE_URL': 'sqlite:///' + primary,
+                  'WORKER_MODE': 'sync', 'METRICS_ENABLED': False}
+
+        app = final_project.create_app(dict(
+            config, REPLICA_DATABASE_URL='sqlite:///' + replica))
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+        ok = checkRouting(final_project, client)
+        with_replica = throughput(client, args.iterations)
+        final_project.engine.dispose()
+        final_project.replica_engine.dispose()
+
+        app = final_project.create_app(dict(config,
+                                            REPLICA_DATABASE_URL=None))
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+        primary_only = throughput(client, args.iterations)
+        final_project.engine.dispose()
+        print 'read only routes: %.1f req/s with replica, %.1f req/s ' \
+            'primary only' % (with_replica, primary_only)
+    finally:
+        shutil.rmtree(tmp)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
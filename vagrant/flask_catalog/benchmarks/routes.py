@@ -0,0 +1,376 @@
+"""
+Route benchmark suite.
+
+Seeds synthetic databases, then drives every route of final_project.py
+through the Flask test client (public pages, owner pages with a faked login
+session, JSON endpoints and every CRUD form POST) and every route of
+catalog/webserver.py over a local socket, and times importing
+final_project.py. Throughput, latency percentiles and SQL statements per
+request are written to a JSON report, which benchmarks/compare.py can diff
+against the report of another commit.
+
+    python -m benchmarks.routes --restaurants 200 --items 50 \\
+        --iterations 300 --output report.json
+"""
+import argparse
+import httplib
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from benchmarks.seed import seedDatabase
+from database_setup import Restaurant, MenuItem
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBSERVER = os.path.join(os.path.dirname(APP_DIR), 'catalog', 'webserver.py')
+WEBSERVER_PORT = 8099
+
+# the faked login of the benchmark user, who owns restaurant 1.
+LOGIN = {'username': 'User 1', 'email': 'user1@example.com',
+         'picture': 'https://example.com/avatars/1.png', 'user_id': 1,
+         'provider': 'benchmark', 'state': 'benchmark'}
+
+ITEM_FORM = {'name': 'Benchmark Burger', 'description': 'benchmarked',
+             'course': 'Entree', 'price': '$9.99'}
+
+# body of the bulk import benchmark.
+IMPORT_ROWS = json.dumps([dict(ITEM_FORM, name='Imported %d' % i)
+                          for i in xrange(100)])
+
+
+class Timings(object):
+    """Latencies and statement counts of one benchmarked route."""
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {'requests': 0, 'errors': self.errors}
+        total = sum(latencies)
+        result = {
+            'requests': len(latencies),
+            'errors': self.errors,
+            'throughput_rps': round(len(latencies) / total, 1),
+            'mean_ms': round(total / len(latencies) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+        for p in (50, 90, 99):
+            index = min(len(latencies) - 1, int(len(latencies) * p / 100.0))
+            result['p%d_ms' % p] = round(latencies[index] * 1000, 3)
+        if self.queries:
+            result['queries_per_request'] = round(
+                sum(self.queries) / float(len(self.queries)), 2)
+        return result
+
+
+def addDoomedRows(engine, count):
+    """
+    Add restaurants and menu items owned by the benchmark user for the
+    delete routes to remove. Returns their ids.
+    """
+    conn = engine.connect()
+    with conn.begin():
+        restaurants = [
+            conn.execute(Restaurant.__table__.insert(), name='Doomed %d' % i,
+                         user_id=1).inserted_primary_key[0]
+            for i in xrange(count)]
+        items = [
+            conn.execute(MenuItem.__table__.insert(), name='Doomed %d' % i,
+                         restaurant_id=1, user_id=1).inserted_primary_key[0]
+            for i in xrange(count)]
+    conn.close()
+    return restaurants, items
+
+
+def flaskScenarios(restaurants, items, doomed_restaurants, doomed_items):
+    """
+    Returns (name, method, path(i), form(i), logged in) for every route of
+    final_project.py. Paths and forms are functions of the iteration number,
+    forms given as a string are sent as a JSON body.
+    """
+    def menu(i):
+        return i % restaurants + 1
+
+    def item(i):
+        # menu items of restaurant 1, which the benchmark user owns.
+        return i % items + 1
+
+    def newItem(i):
+        return dict(ITEM_FORM, name='Benchmark Burger %d' % i)
+
+    return [
+        ('GET /restaurants (public)', 'GET',
+         lambda i: '/restaurants', None, False),
+        ('GET /restaurants (owner)', 'GET',
+         lambda i: '/restaurants', None, True),
+        ('GET /restaurant/<id>/menu (public)', 'GET',
+         lambda i: '/restaurant/%d/menu' % menu(i), None, False),
+        ('GET /restaurant/<id>/menu (owner)', 'GET',
+         lambda i: '/restaurant/1/menu', None, True),
+        ('GET /restaurants/JSON', 'GET',
+         lambda i: '/restaurants/JSON', None, False),
+        ('GET /restaurant/<id>/menu/JSON', 'GET',
+         lambda i: '/restaurant/%d/menu/JSON' % menu(i), None, False),
+        ('GET /restaurant/<id>/menu/<id>/JSON', 'GET',
+         lambda i: '/restaurant/1/menu/%d/JSON' % item(i), None, False),
+        ('GET /login', 'GET', lambda i: '/login', None, False),
+        ('GET /restaurant/new', 'GET',
+         lambda i: '/restaurant/new', None, True),
+        ('POST /restaurant/new', 'POST', lambda i: '/restaurant/new',
+         lambda i: {'name': 'Benchmark %d' % i}, True),
+        ('GET /restaurant/<id>/edit', 'GET',
+         lambda i: '/restaurant/1/edit', None, True),
+        ('POST /restaurant/<id>/edit', 'POST', lambda i: '/restaurant/1/edit',
+         lambda i: {'name': 'Renamed %d' % i}, True),
+        ('GET /restaurant/<id>/delete', 'GET',
+         lambda i: '/restaurant/1/delete', None, True),
+        ('POST /restaurant/<id>/delete', 'POST',
+         lambda i: '/restaurant/%d/delete' % doomed_restaurants[i],
+         lambda i: {}, True),
+        ('GET /restaurant/<id>/menu/new', 'GET',
+         lambda i: '/restaurant/1/menu/new', None, True),
+        ('POST /restaurant/<id>/menu/new', 'POST',
+         lambda i: '/restaurant/1/menu/new', newItem, True),
+        ('POST /restaurant/<id>/menu/import (100 items)', 'POST',
+         lambda i: '/restaurant/1/menu/import', lambda i: IMPORT_ROWS, True),
+        ('POST /restaurant/<id>/menu/bulk (edit all items)', 'POST',
+         lambda i: '/restaurant/1/menu/bulk',
+         lambda i: json.dumps({'update': [
+             {'id': j + 1, 'price': '$%d.00' % (i % 20)}
+             for j in xrange(items)]}), True),
+        ('GET /restaurant/<id>/menu/<id>/edit', 'GET',
+         lambda i: '/restaurant/1/menu/%d/edit' % item(i), None, True),
+        ('POST /restaurant/<id>/menu/<id>/edit', 'POST',
+         lambda i: '/restaurant/1/menu/%d/edit' % item(i), newItem, True),
+        ('GET /restaurant/<id>/menu/<id>/delete', 'GET',
+         lambda i: '/restaurant/1/menu/%d/delete' % item(i), None, True),
+        ('POST /restaurant/<id>/menu/<id>/delete', 'POST',
+         lambda i: '/restaurant/1/menu/%d/delete' % doomed_items[i],
+         lambda i: {}, True),
+    ]
+
+
+def benchmarkFlask(url, restaurants, items, iterations):
+    """Benchmark final_project.py against the database at url."""
+    import final_project
+    app = final_project.create_app({'DATABASE_URL': url,
+                                    'WORKER_MODE': 'sync',
+                                    'METRICS_ENABLED': False})
+    engine = final_project.engine
+    doomed = addDoomedRows(engine, iterations)
+    counter = {'queries': 0}
+
+    def countQuery(*args):
+        counter['queries'] += 1
+    event.listen(engine, 'before_cursor_execute', countQuery)
+
+    public = app.test_client()
+    owner = app.test_client()
+    with owner.session_transaction() as login_session:
+        login_session.update(LOGIN)
+
+    results = {}
+    for name, method, path, form, logged_in in flaskScenarios(
+            restaurants, items, *doomed):
+        client = owner if logged_in else public
+        timings = Timings()
+        for i in xrange(iterations):
+            data = form(i) if form else None
+            content_type = None
+            if isinstance(data, str):
+                content_type = 'application/json'
+            counter['queries'] = 0
+            start = time.time()
+            response = client.open(path(i), method=method, data=data,
+                                   content_type=content_type)
+            elapsed = time.time() - start
+            if response.status_code >= 400:
+                timings.errors += 1
+                continue
+            timings.latencies.append(elapsed)
+            timings.queries.append(counter['queries'])
+            if method == 'POST':
+                # flash messages would pile up in the session otherwise.
+                with client.session_transaction() as login_session:
+                    login_session.pop('_flashes', None)
+        results['flask ' + name] = timings.summary()
+    event.remove(engine, 'before_cursor_execute', countQuery)
+    return results
+
+
+def multipart(fields):
+    """Encode a dict as a multipart/form-data body."""
+    boundary = 'benchmarkboundary'
+    body = ''.join('--%s\r\nContent-Disposition: form-data; name="%s"'
+                   '\r\n\r\n%s\r\n' % (boundary, key, value)
+                   for key, value in fields.items())
+    body += '--%s--\r\n' % boundary
+    return body, 'multipart/form-data; boundary=%s' % boundary
+
+
+def webserverScenarios(restaurants, doomed_restaurants):
+    """Returns (name, method, path(i), form(i)) for webserver.py."""
+    def restaurant(i):
+        return i % restaurants + 1
+
+    return [
+        ('GET /restaurants', 'GET', lambda i: '/restaurants', None),
+        ('GET /restaurants/new', 'GET', lambda i: '/restaurants/new', None),
+        ('POST /restaurants/new', 'POST', lambda i: '/restaurants/new',
+         lambda i: {'name': 'Benchmark %d' % i}),
+        ('GET /restaurants/<id>/edit', 'GET',
+         lambda i: '/restaurants/%d/edit' % restaurant(i), None),
+        ('POST /restaurants/<id>/edit', 'POST',
+         lambda i: '/restaurants/%d/edit' % restaurant(i),
+         lambda i: {'name': 'Renamed %d' % i}),
+        ('GET /restaurants/<id>/delete', 'GET',
+         lambda i: '/restaurants/%d/delete' % restaurant(i), None),
+        ('POST /restaurants/<id>/delete', 'POST',
+         lambda i: '/restaurants/%d/delete' % doomed_restaurants[i],
+         lambda i: {}),
+        ('GET /hello', 'GET', lambda i: '/hello', None),
+        ('GET /hola', 'GET', lambda i: '/hola', None),
+        ('POST /hello', 'POST', lambda i: '/hello',
+         lambda i: {'message': 'hi %d' % i}),
+    ]
+
+
+def benchmarkWebserver(restaurants, items, iterations, seed):
+    """Benchmark catalog/webserver.py on a local socket."""
+    workdir = tempfile.mkdtemp()
+    try:
+        engine = seedDatabase(
+            'sqlite:///' + os.path.join(workdir, 'restaurantmenu.db'),
+            restaurants, items, seed=seed)
+        doomed_restaurants = addDoomedRows(engine, iterations)[0]
+        engine.dispose()
+        server = subprocess.Popen(
+            [sys.executable, WEBSERVER, str(WEBSERVER_PORT)], cwd=workdir,
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        try:
+            waitForPort(WEBSERVER_PORT)
+            results = {}
+            for name, method, path, form in webserverScenarios(
+                    restaurants, doomed_restaurants):
+                timings = Timings()
+                for i in xrange(iterations):
+                    body, headers = None, {}
+                    if form:
+                        body, content_type = multipart(form(i))
+                        headers['Content-Type'] = content_type
+                    start = time.time()
+                    conn = httplib.HTTPConnection('127.0.0.1', WEBSERVER_PORT)
+                    conn.request(method, path(i), body, headers)
+                    response = conn.getresponse()
+                    response.read()
+                    conn.close()
+                    elapsed = time.time() - start
+                    if response.status >= 400:
+                        timings.errors += 1
+                        continue
+                    timings.latencies.append(elapsed)
+                results['webserver ' + name] = timings.summary()
+            return results
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmarkImports(rounds):
+    """Time importing final_project in fresh interpreters."""
+    # imported here, as benchmarks.imports imports this module.
+    from benchmarks.imports import importProfile
+    timings = Timings()
+    for i in xrange(rounds):
+        timings.latencies.append(importProfile()['total'])
+    return {'import final_project': timings.summary()}
+
+
+def waitForPort(port, timeout=15):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=APP_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--items', type=int, default=20,
+                        help='menu items per restaurant')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--skip-webserver', action='store_true')
+    parser.add_argument('--import-rounds', type=int, default=10,
+                        help='fresh imports of final_project to time')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'restaurantmenu.db')
+        seedDatabase(url, args.restaurants, args.items,
+                     seed=args.seed).dispose()
+        results = benchmarkFlask(url, args.restaurants, args.items,
+                                 args.iterations)
+    finally:
+        shutil.rmtree(workdir)
+    if args.import_rounds:
+        results.update(benchmarkImports(args.import_rounds))
+    if not args.skip_webserver:
+        results.update(benchmarkWebserver(args.restaurants, args.items,
+                                          args.iterations, args.seed))
+
+    report = {
+        'meta': {
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': int(time.time()),
+            'restaurants': args.restaurants,
+            'items': args.items,
+            'iterations': args.iterations,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    for name in sorted(results):
+        r = results[name]
+        print '%-50s %9s req/s  p50 %8s ms  p99 %8s ms  %s queries' % (
+            name, r.get('throughput_rps'), r.get('p50_ms'), r.get('p99_ms'),
+            r.get('queries_per_request', '-'))
+    print 'report written to %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Synthetic catalog databases for the benchmarks.
+
+The generated database uses the flask_catalog schema, which is a superset of
+the catalog/webserver.py schema, so the same file can be served by both.
+"""
+import random
+
+from sqlalchemy import text
+
+from database_setup import Base, User, Restaurant, MenuItem
+from db import makeEngine
+
+COURSES = ['Appetizer', 'Entree', 'Dessert', 'Beverage']
+WORDS = ['Grilled', 'Smoked', 'Spicy', 'Crispy', 'Burger', 'Salad', 'Soup',
+         'Tacos', 'Noodles', 'Cake', 'Lemonade', 'Curry', 'Dumplings',
+         'Risotto', 'Pie', 'Sandwich']
+
+
+def randomName(rng, words=2):
+    return ' '.join(rng.choice(WORDS) for i in xrange(words))
+
+
+def seedDatabase(url, restaurants=100, items=20, users=10, seed=0):
+    """
+    Create the catalog tables at url and fill them with users, restaurants
+    and menu items chosen by a seeded random generator, so the same sizes
+    always produce the same database. Restaurants are owned by the users in
+    turn, so user 1 owns every users-th restaurant. Returns the engine.
+    """
+    rng = random.Random(seed)
+    engine = makeEngine(url)
+    Base.metadata.create_all(engine)
+    conn = engine.connect()
+    with conn.begin():
+        conn.execute(User.__table__.insert(), [
+            {'id': i, 'name': 'User %d' % i,
+             'email': 'user%d@example.com' % i,
+             'picture': 'https://example.com/avatars/%d.png' % i}
+            for i in xrange(1, users + 1)])
+        conn.execute(Restaurant.__table__.insert(), [
+            {'id': i, 'name': randomName(rng, 3),
+             'user_id': (i - 1) % users + 1}
+            for i in xrange(1, restaurants + 1)])
+        rows = []
+        for r in xrange(1, restaurants + 1):
+            for i in xrange(items):
+                rows.append({
+                    'name': randomName(rng),
+                    'description': randomName(rng, 8),
+                    'course': rng.choice(COURSES),
+                    'price': '$%d.%02d' % (rng.randint(1, 30),
+                                           rng.randint(0, 99)),
+                    'restaurant_id': r,
+                    'user_id': (r - 1) % users + 1})
+            if len(rows) >= 10000:
+                conn.execute(MenuItem.__table__.insert(), rows)
+                rows = []
+        if rows:
+            conn.execute(MenuItem.__table__.insert(), rows)
+        if engine.dialect.name == 'postgresql':
+            # the ids were given explicitly, so move the sequences past them.
+            for table in ('user', 'restaurant', 'menu_item'):
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), "
+                    "(SELECT max(id) FROM \"%s\"))" % (table, table)))
+    conn.close()
+    return engine
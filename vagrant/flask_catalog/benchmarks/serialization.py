@@ -0,0 +1,96 @@
+"""
+Microbenchmark of the menu JSON serialization at 10k items per menu.
+
+Compares the old path, ORM objects and their serialize dicts encoded by
+jsonify with pretty printing, with the row tuples of fastjson.py encoded by
+every available encoder, and times the /restaurant/1/menu/JSON route end to
+end with the encoder fastjson picked.
+
+    python -m benchmarks.serialization --items 10000 --repeat 20
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from flask import jsonify
+
+from benchmarks.seed import seedDatabase
+from database_setup import MenuItem
+import fastjson
+
+
+def encoders():
+    """Returns (name, dumps) for every installed JSON encoder."""
+    found = [('json', lambda obj: json.dumps(obj, separators=(',', ':')))]
+    if fastjson.ujson is not None:
+        found.append(('ujson', lambda obj: fastjson.ujson.dumps(
+            obj, escape_forward_slashes=False)))
+    if fastjson.orjson is not None:
+        found.append(('orjson', fastjson.orjson.dumps))
+    return found
+
+
+def timeit(function, repeat):
+    """Returns the median seconds of repeat calls to function."""
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import final_project
+    workdir = tempfile.mkdtemp(prefix='catalog-serialization-')
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, restaurants=2, items=args.items).dispose()
+        app = final_project.create_app({'DATABASE_URL': url,
+                                        'WORKER_MODE': 'sync',
+                                        'METRICS_ENABLED': False})
+        session = final_project.session
+
+        def old():
+            items = session.query(MenuItem).filter_by(restaurant_id=1).all()
+            jsonify(MenuItems=[i.serialize for i in items]).get_data()
+            session.remove()
+
+        def tuples(dumps):
+            def run():
+                rows = fastjson.serializedQuery(session, MenuItem)\
+                    .filter_by(restaurant_id=1).all()
+                dumps({'MenuItems': fastjson.serializeRows(MenuItem, rows)})
+                session.remove()
+            return run
+
+        cases = [('orm objects + jsonify (old)', old)]
+        cases.extend(('row tuples + %s' % name, tuples(dumps))
+                     for name, dumps in encoders())
+        client = app.test_client()
+        cases.append(('GET /restaurant/1/menu/JSON (%s)' % fastjson.ENCODER,
+                      lambda: client.get('/restaurant/1/menu/JSON')))
+
+        print '%-40s %10s %12s' % ('path', 'ms/menu', 'us/item')
+        # a request in a test request context, as jsonify's pretty
+        # printing depends on it.
+        with app.test_request_context('/restaurant/1/menu/JSON'):
+            for name, function in cases:
+                seconds = timeit(function, args.repeat)
+                print '%-40s %10.1f %12.2f' % (
+                    name, seconds * 1000, seconds * 1e6 / args.items)
+        final_project.engine.dispose()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
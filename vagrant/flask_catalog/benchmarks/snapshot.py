@@ -0,0 +1,123 @@
+"""
+Check and benchmark of snapshot export and import.
+
+Seeds a catalog, exports it with snapshot.py, imports the snapshot into a
+new database and checks that every row arrived unchanged and the menu
+summaries were rebuilt. Reports the time, throughput, peak memory and file
+size of both directions, for the full catalog and for a quarter of it, so
+the peak memory shows whether it grows with the catalog.
+
+    python -m benchmarks.snapshot --restaurants 2000 --items 250
+"""
+# benchmarks.snapshot would otherwise import itself as snapshot.
+from __future__ import absolute_import
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.asyncload import APP_DIR
+from benchmarks.replica import check
+from benchmarks.seed import seedDatabase
+
+# runs snapshot.py and prints its peak memory in KB. ru_maxrss would
+# include the peak of the process before exec, i.e. of the seeding.
+RUNNER = '''
+import runpy, sys
+sys.argv = ['snapshot.py'] + sys.argv[1:]
+runpy.run_path('snapshot.py', run_name='__main__')
+print [line.split()[1] for line in open('/proc/self/status')
+       if line.startswith('VmHWM:')][0]
+'''
+
+
+def runSnapshot(url, command, path):
+    """
+    Run snapshot.py. Returns (seconds, peak memory in KB). The tuned
+    SQLite profile's page cache and memory map are capped, but count in the
+    peak as the database grows, so they are left out.
+    """
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', RUNNER, command, path], cwd=APP_DIR,
+        env=dict(os.environ, CATALOG_DATABASE_URL=url,
+                 CATALOG_SQLITE_PRAGMAS='wal'))
+    return time.time() - start, int(output.split()[-1])
+
+
+def tableDigest(engine, table):
+    """Returns a digest of a table's rows, read in id order."""
+    from sqlalchemy import select
+    digest = hashlib.sha1()
+    for row in engine.execute(select(list(table.c)).order_by(table.c.id)):
+        digest.update(repr(tuple(row)))
+    return digest.hexdigest()
+
+
+def roundTrip(workdir, restaurants, items):
+    """
+    Export a seeded catalog and import it into a new database. Returns True
+    if the copy matches.
+    """
+    from sqlalchemy import func, select
+
+    from database_setup import RestaurantSummary
+    from db import makeEngine
+    from snapshot import TABLES
+    source = os.path.join(workdir, 'source-%d.db' % restaurants)
+    target = os.path.join(workdir, 'target-%d.db' % restaurants)
+    path = os.path.join(workdir, 'catalog-%d.ndjson.gz' % restaurants)
+    seedDatabase('sqlite:///' + source, restaurants, items).dispose()
+    rows = restaurants * (items + 1) + 10
+    export = runSnapshot('sqlite:///' + source, 'export', path)
+    load = runSnapshot('sqlite:///' + target, 'import', path)
+
+    print '%d rows, %.1fMB database, %.1fMB snapshot' % (
+        rows, os.path.getsize(source) / 1e6, os.path.getsize(path) / 1e6)
+    for name, (seconds, memory) in (('export', export), ('import', load)):
+        print '  %-8s %8.2fs %10d rows/s %8.1fMB peak' % (
+            name, seconds, rows / seconds, memory / 1024.0)
+
+    source_engine = makeEngine('sqlite:///' + source)
+    target_engine = makeEngine('sqlite:///' + target)
+    ok = check('%d rows are imported unchanged' % rows,
+               all(tableDigest(source_engine, table) ==
+                   tableDigest(target_engine, table) for table in TABLES))
+    ok = check('the menu summaries are rebuilt on import',
+               target_engine.execute(select([func.count()]).select_from(
+                   RestaurantSummary.__table__)).scalar() == restaurants
+               ) and ok
+    source_engine.dispose()
+    target_engine.dispose()
+    return ok, max(export[1], load[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=250)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='catalog-snapshot-')
+    try:
+        ok, small = roundTrip(workdir, args.restaurants // 4, args.items)
+        full_ok, full = roundTrip(workdir, args.restaurants, args.items)
+        ok = full_ok and ok
+        # the peak grows by less than the summaries and interpreter noise,
+        # not with the rows.
+        ok = check('peak memory is bounded (%.1fMB for 4x the rows of '
+                   '%.1fMB)' % (full / 1024.0, small / 1024.0),
+                   full < small * 1.5) and ok
+    finally:
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
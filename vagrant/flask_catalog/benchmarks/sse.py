@@ -0,0 +1,223 @@
+"""
+Check and load test of the Server-Sent Events streams of menu changes.
+
+Serves a seeded database with async_api.py on gevent, opens a crowd of
+idle streams to it, half of them for restaurant 1 and half global, edits
+menu items through final_project.py and checks that every stream gets
+exactly the events it subscribed to. Reports how long the events took to
+reach all subscribers and the server's memory per open stream, then checks
+the Last-Event-ID replay, the eviction of a subscriber that stops reading
+and the same stream served by final_project.py.
+
+    python -m benchmarks.sse --subscribers 2000
+"""
+if __name__ == '__main__':
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+
+from benchmarks.asyncload import APP_DIR, HOST, PORT, waitForPort
+from benchmarks.replica import check
+from benchmarks.routes import LOGIN, ITEM_FORM
+from benchmarks.seed import seedDatabase
+
+
+def openStream(path, last_event_id=None):
+    """Open an SSE stream to the server. Returns a file to read events."""
+    sock = socket.create_connection((HOST, PORT))
+    headers = 'Accept: text/event-stream\r\n'
+    if last_event_id is not None:
+        headers += 'Last-Event-ID: %d\r\n' % last_event_id
+    sock.sendall('GET %s HTTP/1.1\r\nHost: %s\r\n%s\r\n' % (
+        path, HOST, headers))
+    stream = sock.makefile('rb')
+    while stream.readline() not in ('\r\n', ''):
+        pass
+    return stream
+
+
+def readEvent(stream):
+    """
+    Returns the next event of a stream as a dict of its fields, skipping
+    comments and chunk sizes, or None when the stream ends.
+    """
+    event = {}
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.rstrip('\r\n')
+        if not line:
+            if 'event' in event:
+                return event
+            continue
+        field, colon, value = line.partition(': ')
+        if colon and field in ('id', 'event', 'data'):
+            event[field] = value
+
+
+def serverMemory(pid):
+    """Returns the resident memory of a process in KB."""
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def edit(client, item, price):
+    client.post('/restaurant/1/menu/%d/edit' % item,
+                data=dict(ITEM_FORM, price=price))
+
+
+def checkCrowd(client, pid, subscribers, items):
+    """
+    Open the streams, make two edits, in restaurant 1 and restaurant 11,
+    and check who got what. Returns True if everything arrived.
+    """
+    before = serverMemory(pid)
+    streams = []
+    for i in xrange(subscribers):
+        path = '/restaurant/1/menu/events' if i % 2 else '/menu/events'
+        streams.append((path, openStream(path)))
+    # give the server time to register every subscription.
+    gevent.sleep(1)
+    per_stream = (serverMemory(pid) - before) / float(subscribers)
+
+    received = {}
+
+    def listen(index, path, stream, expected):
+        ids = []
+        for i in xrange(expected):
+            event = readEvent(stream)
+            if event is None:
+                break
+            ids.append(json.loads(event['data'])['MenuItem']['id'])
+        received[index] = (path, ids, time.time())
+
+    listeners = [gevent.spawn(listen, index, path, stream,
+                              1 if path != '/menu/events' else 2)
+                 for index, (path, stream) in enumerate(streams)]
+    start = time.time()
+    edit(client, 2, '$1.11')
+    client.post('/restaurant/11/menu/%d/edit' % (10 * items + 1),
+                data=dict(ITEM_FORM, price='$2.22'))
+    gevent.joinall(listeners, timeout=30)
+    done = [r for r in received.values() if r[1]]
+    latest = max(r[2] for r in done) if done else start
+    ok = check('%d global streams got both edits' % (subscribers // 2),
+               all(ids == [2, 10 * items + 1] for path, ids, t
+                   in received.values() if path == '/menu/events') and
+               len(received) == subscribers)
+    ok = check('%d restaurant streams got only their own' % (
+        subscribers // 2),
+        all(ids == [2] for path, ids, t in received.values()
+            if path != '/menu/events')) and ok
+    print '%d subscribers: events delivered to all in %.0fms, ' \
+        '%.1fKB server memory per open stream' % (
+            subscribers, (latest - start) * 1000, per_stream)
+    for path, stream in streams:
+        stream.close()
+    return ok
+
+
+def checkReplay(client):
+    """Check that a reconnecting client gets the events it missed."""
+    stream = openStream('/restaurant/1/menu/events')
+    edit(client, 3, '$3.33')
+    last = int(readEvent(stream)['id'])
+    stream.close()
+    edit(client, 4, '$4.44')
+    edit(client, 5, '$5.55')
+    stream = openStream('/restaurant/1/menu/events', last)
+    ids = [json.loads(readEvent(stream)['data'])['MenuItem']['id']
+           for i in xrange(2)]
+    stream.close()
+    return check('a reconnecting client is sent what it missed',
+                 ids == [4, 5])
+
+
+def checkEviction():
+    """Check that a subscriber with a full queue is evicted."""
+    from events import Broker, EVICTED
+    broker = Broker(queue_size=10)
+    slow = broker.subscribe('all')
+    fast = broker.subscribe('all')
+    for i in xrange(11):
+        broker.publish(['all'], i)
+        fast.get()
+    return check('a subscriber that stops reading is evicted',
+                 slow.get() is EVICTED and broker.evictions == 1 and
+                 broker.subscribers() == 1)
+
+
+def checkFlask(client):
+    """Check the stream served by final_project.py."""
+    stream = client.get('/restaurant/1/menu/events', buffered=False)
+    messages = iter(stream.response)
+    next(messages)
+    edit(client, 6, '$6.66')
+    event = None
+    while event is None:
+        message = next(messages)
+        if message.startswith('id: '):
+            event = message
+    stream.close()
+    return check('final_project.py streams the events too',
+                 'event: update' in event and '"id":6' in event)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import final_project
+    workdir = tempfile.mkdtemp(prefix='catalog-sse-')
+    server = None
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, restaurants=20, items=args.items).dispose()
+        config = {'DATABASE_URL': url, 'EVENTS_POLL_INTERVAL': 0.1,
+                  'EVENTS_HEARTBEAT': 1}
+        environ = dict(os.environ, **dict(('CATALOG_' + name, str(value))
+                                          for name, value in config.items()))
+        server = subprocess.Popen([sys.executable, 'async_api.py', str(PORT)],
+                                  cwd=APP_DIR, env=environ)
+        if not waitForPort():
+            print 'async_api.py did not start'
+            sys.exit(1)
+        app = final_project.create_app(dict(config, WORKER_MODE='sync',
+                                            METRICS_ENABLED=False))
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+
+        ok = checkCrowd(client, server.pid, args.subscribers, args.items)
+        ok = checkReplay(client) and ok
+        ok = checkEviction() and ok
+        ok = checkFlask(client) and ok
+        app.extensions['events'].stop()
+        final_project.engine.dispose()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
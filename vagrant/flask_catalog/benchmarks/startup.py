@@ -0,0 +1,68 @@
+"""
+Startup benchmark for the template environment.
+
+Measures how long a freshly started worker takes to get every template in
+flask_catalog/templates ready to render, with the default auto reloading
+environment, with an empty bytecode cache and with a warm bytecode cache.
+
+    python -m benchmarks.startup [rounds]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from templating import configureTemplates, precompileTemplates
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'templates')
+
+
+def newApp():
+    """Create a bare app using the catalog templates."""
+    return Flask('benchmark', template_folder=TEMPLATE_DIR)
+
+
+def timeDefault():
+    """Compile every template with Flask's default environment."""
+    app = newApp()
+    start = time.time()
+    app.jinja_env.auto_reload = True
+    precompileTemplates(app.jinja_env)
+    return time.time() - start
+
+
+def timeCached(cache_dir):
+    """Compile or load every template through the bytecode cache."""
+    app = newApp()
+    start = time.time()
+    configureTemplates(app, cache_dir=cache_dir)
+    return time.time() - start
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    print '%-28s min %8.2fms  median %8.2fms' % (
+        label, samples[0] * 1000, samples[len(samples) // 2] * 1000)
+
+
+def main(rounds=20):
+    default, cold, warm = [], [], []
+    for i in xrange(rounds):
+        default.append(timeDefault())
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cold.append(timeCached(cache_dir))
+            warm.append(timeCached(cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+    summarize('default (auto reload)', default)
+    summarize('bytecode cache, cold', cold)
+    summarize('bytecode cache, warm', warm)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
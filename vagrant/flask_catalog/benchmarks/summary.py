@@ -0,0 +1,179 @@
+"""
+Check of the restaurant summaries, and the cost of the listing with them.
+
+Seeds a database without summaries, checks that create_app fills them in,
+runs every route that changes a menu and checks after each that the stored
+summaries still match the items. Then compares reading the listing from the
+summaries with aggregating the menu items for it on every view.
+
+    python -m benchmarks.summary --restaurants 1000 --items 50
+"""
+# benchmarks.summary would otherwise import itself as summary.
+from __future__ import absolute_import
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import Float, cast, func, inspect
+
+from benchmarks.replica import check
+from benchmarks.routes import LOGIN, ITEM_FORM
+from benchmarks.seed import seedDatabase
+
+
+def storedSummaries(session):
+    """Returns the stored summaries by restaurant id."""
+    from database_setup import RestaurantSummary
+    return dict((row[0], row[1:]) for row in session.query(
+        RestaurantSummary.restaurant_id, RestaurantSummary.item_count,
+        RestaurantSummary.min_price, RestaurantSummary.max_price,
+        RestaurantSummary.courses))
+
+
+def freshSummaries(session):
+    """Returns the summaries computed from the items by restaurant id."""
+    from database_setup import Restaurant, MenuItem
+    from summary import Summary
+    summaries = dict((restaurant_id, Summary(restaurant_id))
+                     for restaurant_id, in session.query(Restaurant.id))
+    for restaurant_id, course, price in session.query(
+            MenuItem.restaurant_id, MenuItem.course, MenuItem.price):
+        summaries[restaurant_id].add(course, price)
+    rows = dict((restaurant_id, summary.row())
+                for restaurant_id, summary in summaries.items())
+    return dict((restaurant_id, (row['item_count'], row['min_price'],
+                                 row['max_price'], row['courses']))
+                for restaurant_id, row in rows.items())
+
+
+def checkRoutes(client, session, items):
+    """
+    Run each route that changes a menu and check the summaries after it.
+    Returns True if they all pass.
+    """
+    # restaurant 1 and its items 1..items are owned by user 1, and so is
+    # restaurant 11.
+    bulk = json.dumps({'update': [{'id': 2, 'price': '$0.50'},
+                                  {'id': 3, 'price': '$99.00'}],
+                       'delete': [4]})
+    steps = [
+        ('new restaurant', lambda: client.post(
+            '/restaurant/new', data={'name': 'Fresh'})),
+        ('new menu item', lambda: client.post(
+            '/restaurant/1/menu/new', data=dict(ITEM_FORM, price='$0.25'))),
+        ('edit menu item', lambda: client.post(
+            '/restaurant/1/menu/1/edit',
+            data=dict(ITEM_FORM, course='Side', price='$123.45'))),
+        ('delete menu item', lambda: client.post(
+            '/restaurant/1/menu/5/delete')),
+        ('import menu items', lambda: client.post(
+            '/restaurant/1/menu/import', content_type='application/json',
+            data=json.dumps([dict(ITEM_FORM, name='Imported %d' % i,
+                                  price='$%d.00' % (200 + i))
+                             for i in xrange(3)]))),
+        ('bulk edit menu items', lambda: client.post(
+            '/restaurant/1/menu/bulk', content_type='application/json',
+            data=bulk)),
+        ('delete restaurant', lambda: client.post('/restaurant/11/delete')),
+    ]
+    ok = True
+    for name, action in steps:
+        status = action().status_code
+        session.expire_all()
+        session.rollback()
+        ok = check('summaries are current after %s' % name,
+                   status < 400 and
+                   storedSummaries(session) == freshSummaries(session)) and ok
+    restaurants = json.loads(client.get('/restaurants/JSON').get_data())[
+        'Restaurants']
+    first = restaurants[0]
+    ok = check('/restaurants/JSON has the summaries',
+               first['id'] == 1 and first['item_count'] == items + 2 and
+               first['min_price'] == '$0.25' and
+               first['max_price'] == '$202.00' and
+               'Side' in first['courses'] and
+               11 not in [r['id'] for r in restaurants]) and ok
+    ok = check('the listing shows the summaries',
+               '$0.25 to $202.00' in client.get('/restaurants').get_data()
+               ) and ok
+    return ok
+
+
+def aggregateListing(session):
+    """
+    The listing computed from the items on every view: the item count and
+    price range of every restaurant, with one GROUP BY over the items.
+    """
+    from database_setup import Restaurant, MenuItem
+    price = cast(func.replace(MenuItem.price, '$', ''), Float)
+    return session.query(Restaurant.id, Restaurant.name,
+                         func.count(MenuItem.id), func.min(price),
+                         func.max(price))\
+        .outerjoin(MenuItem, MenuItem.restaurant_id == Restaurant.id)\
+        .group_by(Restaurant.id, Restaurant.name).all()
+
+
+def timeit(function, iterations):
+    """Returns the mean milliseconds of function()."""
+    start = time.time()
+    for i in xrange(iterations):
+        function()
+    return (time.time() - start) * 1000 / iterations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--restaurants', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import final_project
+    from summary import summaryQuery
+    workdir = tempfile.mkdtemp(prefix='catalog-summary-')
+    try:
+        url = 'sqlite:///' + os.path.join(workdir, 'catalog.db')
+        seedDatabase(url, args.restaurants, args.items).dispose()
+        app = final_project.create_app({'DATABASE_URL': url,
+                                        'WORKER_MODE': 'sync',
+                                        'METRICS_ENABLED': False,
+                                        'COMPRESSION_ENABLED': False})
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session.update(LOGIN)
+        session = final_project.session
+        indexes = [index['name'] for index in
+                   inspect(final_project.engine).get_indexes('menu_item')]
+        ok = check('menu items are indexed by restaurant',
+                   'ix_menu_item_restaurant_id' in indexes)
+        ok = check('create_app fills in missing summaries',
+                   storedSummaries(session) == freshSummaries(session)) and ok
+        session.remove()
+        ok = checkRoutes(client, session, args.items) and ok
+        session.remove()
+
+        print '%-28s %10s' % ('listing of %d restaurants' % args.restaurants,
+                              'ms')
+        for name, function in (
+                ('aggregate items per view',
+                 lambda: aggregateListing(session)),
+                ('read summaries', lambda: summaryQuery(session).all()),
+                ('GET /restaurants/JSON',
+                 lambda: client.get('/restaurants/JSON')),
+                ('GET /restaurants', lambda: client.get('/restaurants'))):
+            print '%-28s %10.1f' % (name, timeit(function, args.iterations))
+        session.remove()
+        final_project.engine.dispose()
+    finally:
+        shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Bulk menu item import, edit and delete.
+
+Parses an uploaded JSON array or CSV file of menu items as a stream, so the
+upload is never held in memory as a whole, validates every row and inserts
+the valid ones in batches with executemany style inserts. Bulk edits and
+deletes check ownership of every item with a single query and are applied
+as set based UPDATE and DELETE statements. An edit giving the version of
+the item it is based on is only applied if the item is still at that
+version.
+"""
+import codecs
+import csv
+import json
+import re
+
+from sqlalchemy import and_, bindparam, select
+
+from database_setup import MenuItem
+
+COLUMNS = ('name', 'description', 'course', 'price')
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# maximum number of row errors reported back.
+MAX_ERRORS = 1000
+
+
+def iterJsonArray(stream, chunk_size=65536):
+    """
+    Yield the elements of a JSON array read from a file like stream, one at
+    a time, reading chunk_size bytes at a time.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = u'', 0, False
+    # what comes next: the opening '[', the first element, a ',' or a value.
+    expect = '['
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf) and not eof:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+            continue
+        if pos == len(buf):
+            raise ValueError('unexpected end of JSON array')
+        if expect == '[':
+            if buf[pos] != '[':
+                raise ValueError('expected a JSON array')
+            pos += 1
+            expect = 'first'
+            continue
+        if expect in ('first', ','):
+            if buf[pos] == ']':
+                return
+            if expect == ',':
+                if buf[pos] != ',':
+                    raise ValueError('expected , or ] at offset %d' % pos)
+                pos += 1
+            expect = 'value'
+            continue
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            value, end = None, None
+        # a value ending with the buffer might continue in the next chunk,
+        # and a number cut off in the middle looks like a shorter number.
+        if end is not None and not eof:
+            after = WHITESPACE.match(buf, end).end()
+            if after == len(buf) or (buf[after] not in ',]' and
+                                     isinstance(value, (int, long, float))):
+                end = None
+        if end is None:
+            if eof:
+                raise ValueError('invalid JSON value at offset %d' % pos)
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+            continue
+        yield value
+        pos = end
+        expect = ','
+
+
+def iterCsvRows(stream):
+    """Yield a dict for every row of a CSV stream with a header row."""
+    for row in csv.DictReader(stream):
+        yield dict((key, value.decode('utf-8') if value else value)
+                   for key, value in row.items() if key)
+
+
+def validateRow(row):
+    """
+    Check a row against the menu_item columns.
+
+    Returns a dict of the row's columns and None, or None and an error
+    message when the row is invalid.
+    """
+    if not isinstance(row, dict):
+        return None, 'row is not an object'
+    item = {}
+    for column in COLUMNS:
+        value = row.get(column)
+        if value is None or value == '':
+            item[column] = None
+            continue
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        length = MenuItem.__table__.c[column].type.length
+        if len(value) > length:
+            return None, '%s is longer than %d characters' % (column, length)
+        item[column] = value
+    if not item['name']:
+        return None, 'name is required'
+    return item, None
+
+
+def importMenuItems(session, restaurant_id, user_id, rows, batch_size=1000):
+    """
+    Insert every valid row as a menu item of the restaurant in the session's
+    transaction, batch_size rows per executemany call. The caller commits.
+
+    Returns the number of inserted and rejected items, and a list of
+    {'row', 'error'} dicts for the first MAX_ERRORS rejected rows, numbered
+    from 1.
+    """
+    insert = MenuItem.__table__.insert()
+    batch, inserted, rejected, errors = [], 0, 0, []
+    for number, row in enumerate(rows, 1):
+        item, error = validateRow(row)
+        if error is not None:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append({'row': number, 'error': error})
+            continue
+        item['restaurant_id'] = restaurant_id
+        item['user_id'] = user_id
+        batch.append(item)
+        if len(batch) >= batch_size:
+            session.execute(insert, batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        session.execute(insert, batch)
+        inserted += len(batch)
+    return inserted, rejected, errors
+
+
+def uploadedRows(request):
+    """
+    Returns an iterator over the rows of the request's upload: a JSON array
+    or CSV request body, or a JSON or CSV file uploaded as 'file' in a
+    multipart form.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files['file']
+        if (upload.mimetype == 'application/json' or
+                (upload.filename or '').endswith('.json')):
+            return iterJsonArray(upload.stream)
+        return iterCsvRows(upload.stream)
+    if request.mimetype == 'application/json':
+        return iterJsonArray(request.stream)
+    return iterCsvRows(request.stream)
+
+
+def chunks(values, size=500):
+    """Split a list into lists of at most size values, e.g. for IN clauses."""
+    for i in xrange(0, len(values), size):
+        yield values[i:i + size]
+
+
+def validatePatch(patch):
+    """
+    Check a bulk edit entry, a dict of a menu item id, optionally the version
+    it is based on and the columns to change. Returns the id, a dict of the
+    changes (including the version if given) and an error message or None.
+    """
+    if not isinstance(patch, dict):
+        return None, None, 'entry is not an object'
+    item_id = patch.get('id')
+    if not isinstance(item_id, (int, long)) or isinstance(item_id, bool):
+        return None, None, 'id must be an integer'
+    changes = {}
+    for column, value in patch.items():
+        if column == 'id':
+            continue
+        if column == 'version':
+            if not isinstance(value, (int, long)) or isinstance(value, bool):
+                return item_id, None, 'version must be an integer'
+            changes[column] = value
+            continue
+        if column not in COLUMNS:
+            return item_id, None, 'unknown column %s' % column
+        if value is not None and not isinstance(value, basestring):
+            value = unicode(value)
+        length = MenuItem.__table__.c[column].type.length
+        if value is not None and len(value) > length:
+            return item_id, None, '%s is longer than %d characters' % (
+                column, length)
+        changes[column] = value
+    if 'name' in changes and not changes['name']:
+        return item_id, None, 'name is required'
+    if not set(changes) - set(['version']):
+        return item_id, None, 'nothing to change'
+    return item_id, changes, None
+
+
+def ownedItemIds(session, restaurant_id, user_id, ids):
+    """
+    Returns the subset of ids that are menu items of the restaurant owned by
+    the user, checked with one query per 500 ids.
+    """
+    table = MenuItem.__table__
+    owned = set()
+    for chunk in chunks(sorted(set(ids))):
+        owned.update(row[0] for row in session.execute(
+            select([table.c.id]).where(and_(
+                table.c.id.in_(chunk),
+                table.c.restaurant_id == restaurant_id,
+                table.c.user_id == user_id))))
+    return owned
+
+
+def updateMenuItems(session, patches):
+    """
+    Apply a list of (id, changes) pairs as set based UPDATEs: items getting
+    identical changes are updated by one statement with an IN clause, and
+    the rest are grouped by the columns they change into executemany
+    UPDATEs. Changes giving a version only update the item at that version.
+    Every updated item's version is incremented. Returns the number of
+    updated rows, which is less than the number of patches if some items
+    changed since their given version.
+    """
+    table = MenuItem.__table__
+    identical = {}
+    by_columns = {}
+    for item_id, changes in patches:
+        if 'version' not in changes:
+            key = tuple(sorted(changes.items()))
+            identical.setdefault(key, []).append(item_id)
+            continue
+        # bind names can't be column names in an UPDATE, so prefix them.
+        row = dict(('_' + column, value) for column, value in changes.items())
+        row['_id'] = item_id
+        by_columns.setdefault(tuple(sorted(changes)), []).append(row)
+    updated = 0
+    for key, ids in identical.items():
+        if len(ids) == 1:
+            row = dict(('_' + column, value) for column, value in key)
+            row['_id'] = ids[0]
+            by_columns.setdefault(tuple(column for column, value in key),
+                                  []).append(row)
+            continue
+        for chunk in chunks(ids):
+            updated += session.execute(
+                table.update().where(table.c.id.in_(chunk))
+                .values(dict(key, version=table.c.version + 1))).rowcount
+    for columns, rows in by_columns.items():
+        condition = table.c.id == bindparam('_id')
+        if 'version' in columns:
+            condition = and_(condition,
+                             table.c.version == bindparam('_version'))
+        values = dict((column, bindparam('_' + column))
+                      for column in columns if column != 'version')
+        values['version'] = table.c.version + 1
+        statement = table.update().where(condition).values(values)
+        updated += session.execute(statement, rows).rowcount
+    return updated
+
+
+def staleItems(session, patches):
+    """
+    Returns a {id: current version} dict of the items in a list of
+    (id, changes) pairs that are no longer at the version given in changes.
+    """
+    table = MenuItem.__table__
+    expected = dict((item_id, changes['version'])
+                    for item_id, changes in patches if 'version' in changes)
+    stale = {}
+    for chunk in chunks(sorted(expected)):
+        for item_id, version in session.execute(
+                select([table.c.id, table.c.version])
+                .where(table.c.id.in_(chunk))):
+            if version != expected[item_id]:
+                stale[item_id] = version
+    return stale
+
+
+def deleteMenuItems(session, ids):
+    """Delete the menu items with the given ids, returning the count."""
+    table = MenuItem.__table__
+    deleted = 0
+    for chunk in chunks(sorted(set(ids))):
+        deleted += session.execute(
+            table.delete().where(table.c.id.in_(chunk))).rowcount
+    return deleted
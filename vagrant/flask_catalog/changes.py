@@ -0,0 +1,135 @@
+"""
+Append-only change log of the catalog, for incremental sync.
+
+Every route creating, editing or deleting restaurants or menu items adds
+an entry per changed row to the change table, in the same transaction as
+the change itself. The id of the last entry a mirror has seen is its sync
+token: changesSince() collapses the entries after it to the latest action
+per row and returns the current data of the rows that still exist and the
+ids of the deleted ones, so a sync costs as much as what changed instead
+of the whole catalog.
+
+A token is only safe if entries become visible in id order: were entry 11
+committed while entry 10 was still in flight, a mirror reading in between
+would continue after 11 and never see 10. SQLite serializes writers, so
+this holds there. Elsewhere ids come from a sequence when the row is
+inserted, so lockLog() makes the writers of the log take turns from their
+log INSERT until they commit. Routes log their changes as the last
+statement before committing, so writers still run side by side and only
+queue for that INSERT and the commit. The trade-off is that commits of
+writers to the catalog happen one at a time, as on SQLite.
+"""
+from sqlalchemy import func, literal, select
+
+from database_setup import Change, Restaurant, MenuItem
+from bulk import chunks
+
+# models in the change log by table name, with the key of their rows in
+# the changes response, as in the other JSON endpoints.
+MODELS = {'restaurant': (Restaurant, 'Restaurants'),
+          'menu_item': (MenuItem, 'MenuItems')}
+# columns sent for changed rows besides serialize_columns, so a mirror
+# knows where an item belongs.
+EXTRA_COLUMNS = {'menu_item': ('restaurant_id',)}
+# key of the PostgreSQL advisory lock taken by lockLog().
+LOG_LOCK = 4242
+
+
+def lockLog(session):
+    """
+    Wait until no other transaction is writing to the change log, and keep
+    the others waiting until the session's transaction ends, so entries
+    commit in id order. Only the log INSERT and the commit should follow,
+    so the lock is held briefly and never while waiting for another lock.
+    """
+    conn = session.connection(clause=Change.__table__.insert())
+    if conn.dialect.name == 'postgresql':
+        conn.execute(select([func.pg_advisory_xact_lock(LOG_LOCK)]))
+    elif conn.dialect.name != 'sqlite':
+        # lock the latest entry, the next writer locks it too.
+        conn.execute(select([Change.id]).order_by(Change.id.desc())
+                     .limit(1).with_for_update())
+
+
+def logChanges(session, model, action, ids, restaurant_id=None):
+    """
+    Add a change log entry for each of the ids, menu items giving the id of
+    their restaurant. The caller commits, right after, see lockLog().
+    """
+    rows = [{'table_name': model.__tablename__, 'row_id': row_id,
+             'action': action,
+             'restaurant_id': row_id if model is Restaurant else restaurant_id}
+            for row_id in sorted(set(ids))]
+    if rows:
+        lockLog(session)
+        session.execute(Change.__table__.insert(), rows)
+
+
+def logMatching(session, model, action, condition):
+    """
+    Add a change log entry for every row of model matching condition, with
+    one INSERT ... SELECT, e.g. for rows just inserted by a bulk INSERT.
+    The caller commits, right after, see lockLog().
+    """
+    table = model.__table__
+    restaurant = table.c.id if model is Restaurant else table.c.restaurant_id
+    lockLog(session)
+    session.execute(Change.__table__.insert().from_select(
+        ['table_name', 'row_id', 'action', 'restaurant_id'],
+        select([literal(model.__tablename__), table.c.id, literal(action),
+                restaurant]).where(condition)))
+
+
+def latestToken(session):
+    """Returns the token of the latest change, 0 if there is none."""
+    return session.query(Change.id).order_by(Change.id.desc())\
+        .limit(1).scalar() or 0
+
+
+def changedRows(session, table_name, ids):
+    """
+    Returns the serialize dicts, with the extra columns, of the rows of a
+    table with the given ids that still exist.
+    """
+    model = MODELS[table_name][0]
+    columns = model.serialize_columns + EXTRA_COLUMNS.get(table_name, ())
+    rows = []
+    for chunk in chunks(sorted(ids)):
+        rows.extend(dict(zip(columns, row)) for row in session.query(
+            *[getattr(model, column) for column in columns])
+            .filter(model.id.in_(chunk)))
+    return rows
+
+
+def changesSince(session, since, limit=1000):
+    """
+    Returns the changes after token since as a dict with the changed rows
+    under the keys of the JSON endpoints, the deleted ids under 'deleted',
+    the token to continue from under 'next' and whether there are more
+    changes after it under 'more'. At most limit log entries are read.
+    """
+    entries = session.query(Change.id, Change.table_name, Change.row_id,
+                            Change.action)\
+        .filter(Change.id > since).order_by(Change.id).limit(limit + 1).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    # the latest action for every changed row.
+    latest = {}
+    for change_id, table_name, row_id, action in entries:
+        if table_name in MODELS:
+            latest[table_name, row_id] = action
+    result = {'since': since,
+              'next': entries[-1][0] if entries else since,
+              'more': more,
+              'deleted': {}}
+    for table_name, (model, key) in sorted(MODELS.items()):
+        changed = set(row_id for (name, row_id), action in latest.items()
+                      if name == table_name and action != 'delete')
+        rows = changedRows(session, table_name, changed)
+        # rows deleted after the entries read are reported as deleted.
+        deleted = set(row_id for (name, row_id), action in latest.items()
+                      if name == table_name and action == 'delete')
+        deleted |= changed - set(row['id'] for row in rows)
+        result[key] = rows
+        result['deleted'][key] = sorted(deleted)
+    return result
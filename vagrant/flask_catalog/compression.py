@@ -0,0 +1,138 @@
+"""
+Negotiated gzip and brotli response compression.
+
+A Compressor picks the best encoding the client accepts (brotli when the
+brotli package is installed, then gzip) for textual bodies above a size
+threshold. Compressed bodies are kept in an LRU cache keyed by a hash of
+the uncompressed body, so a page or JSON payload served again unchanged is
+not compressed again.
+
+Compressor.initApp() hooks it into a Flask app; other servers call
+compress() themselves.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('text/html', 'text/plain', 'text/css', 'text/javascript',
+                'application/javascript', 'application/json')
+
+
+def acceptedEncodings(header):
+    """Parse an Accept-Encoding header into an {encoding: quality} dict."""
+    accepted = {}
+    for part in (header or '').split(','):
+        fields = part.strip().split(';')
+        encoding = fields[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for field in fields[1:]:
+            name, _, value = field.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding] = quality
+    return accepted
+
+
+class Compressor(object):
+    """
+    Compresses response bodies of at least min_size bytes, caching up to
+    cache_bytes of compressed output.
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5,
+                 cache_bytes=16 * 1024 * 1024):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def chooseEncoding(self, accept_encoding):
+        """Returns 'br', 'gzip' or None for an Accept-Encoding header."""
+        accepted = acceptedEncodings(accept_encoding)
+        if brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', 0) > 0:
+            return 'gzip'
+        return None
+
+    def shouldCompress(self, mimetype, body):
+        """Check if a body is textual and large enough to compress."""
+        return mimetype in COMPRESSIBLE and len(body) >= self.min_size
+
+    def encode(self, body, encoding):
+        """Compress body with encoding, without the cache."""
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        out = BytesIO()
+        f = gzip.GzipFile(fileobj=out, mode='wb',
+                          compresslevel=self.gzip_level, mtime=0)
+        f.write(body)
+        f.close()
+        return out.getvalue()
+
+    def compress(self, body, encoding):
+        """
+        Returns body compressed with encoding, from the cache when the same
+        body has been compressed before.
+        """
+        key = (hashlib.sha1(body).digest(), encoding)
+        with self.lock:
+            compressed = self.cache.pop(key, None)
+            if compressed is not None:
+                # move it to the most recently used end.
+                self.cache[key] = compressed
+                self.hits += 1
+                return compressed
+            self.misses += 1
+        compressed = self.encode(body, encoding)
+        if len(compressed) > self.cache_bytes:
+            return compressed
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = compressed
+                self.cached_bytes += len(compressed)
+            while self.cached_bytes > self.cache_bytes:
+                self.cached_bytes -= len(self.cache.popitem(last=False)[1])
+        return compressed
+
+    def initApp(self, app):
+        """Compress the Flask app's responses in an after_request hook."""
+        from flask import request
+
+        def compressResponse(response):
+            if (response.status_code != 200 or response.direct_passthrough or
+                    response.is_streamed or
+                    'Content-Encoding' in response.headers):
+                return response
+            body = response.get_data()
+            if not self.shouldCompress(response.mimetype, body):
+                return response
+            response.vary.add('Accept-Encoding')
+            encoding = self.chooseEncoding(
+                request.headers.get('Accept-Encoding'))
+            if encoding is None:
+                return response
+            response.set_data(self.compress(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+            etag, weak = response.get_etag()
+            if etag:
+                response.set_etag('%s-%s' % (etag, encoding), weak)
+            return response
+        app.after_request(compressResponse)
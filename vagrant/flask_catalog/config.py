@@ -0,0 +1,139 @@
+"""
+Configuration for the restaurant catalog app.
+
+Every setting can be given in the environment as CATALOG_<NAME>, e.g.
+CATALOG_DATABASE_URL or CATALOG_DATABASE_POOL_SIZE, or passed directly to
+final_project.create_app().
+"""
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# setting name -> (default, type used to parse it from the environment)
+SETTINGS = {
+    # 'development' runs the debug server with template reloading, 'sync'
+    # and 'threaded' are for process and thread based WSGI workers.
+    'WORKER_MODE': ('development', str),
+    'SECRET_KEY': ('super_secret_key', str),
+    # any SQLAlchemy URL, engines are tuned for its dialect by db.py.
+    'DATABASE_URL': ('sqlite:///' + os.path.join(BASE_DIR,
+                                                 'restaurantmenu.db'), str),
+    # pool settings are only passed to the engine when set.
+    'DATABASE_POOL_SIZE': (None, int),
+    'DATABASE_MAX_OVERFLOW': (None, int),
+    'DATABASE_POOL_TIMEOUT': (None, int),
+    'DATABASE_POOL_RECYCLE': (None, int),
+    'DATABASE_ECHO': (False, bool),
+    # PRAGMA profile applied to SQLite connections, see db.sqlitePragmas().
+    'SQLITE_PRAGMAS': ('tuned', str),
+    # read only routes are served from this database when set, see
+    # routing.py. users read from the primary for REPLICA_STICKY_SECONDS
+    # after they change something.
+    'REPLICA_DATABASE_URL': (None, str),
+    'REPLICA_STICKY_SECONDS': (10, float),
+    'TEMPLATE_CACHE_DIR': (os.path.join(BASE_DIR, '.jinja_cache'), str),
+    'TEMPLATE_PRECOMPILE': (True, bool),
+    # change log entries read per /changes response, see changes.py.
+    'CHANGES_PAGE_SIZE': (1000, int),
+    # Server-Sent Events of menu changes, see events.py: events queued per
+    # subscriber before it is evicted, seconds between polls of the change
+    # log and between keepalive comments.
+    'EVENTS_QUEUE_SIZE': (100, int),
+    'EVENTS_POLL_INTERVAL': (0.5, float),
+    'EVENTS_HEARTBEAT': (15, float),
+    # database threads of the gevent JSON API, see async_api.py.
+    'API_DB_THREADS': (10, int),
+    # record request, sql and template timings, served at /metrics, see
+    # metrics.py. off by default, as /metrics isn't authenticated.
+    'METRICS_ENABLED': (False, bool),
+    # send per request sql/template/total timings to the browser.
+    'METRICS_SERVER_TIMING': (False, bool),
+    # 'cookie' keeps sessions in a signed cookie, 'memory' and 'sqlite'
+    # keep them on the server, see sessions.py. use 'sqlite' when several
+    # worker processes serve the app.
+    'SESSION_BACKEND': ('cookie', str),
+    'SESSION_MAX_ENTRIES': (10000, int),
+    'SESSION_SQLITE_PATH': (os.path.join(BASE_DIR, 'sessions.db'), str),
+    'SESSION_SWEEP_INTERVAL': (60, int),
+    # log statements slower than this many milliseconds, see slowquery.py.
+    'SLOW_QUERY_MS': (None, float),
+    # gzip/brotli compress html and json responses of at least
+    # COMPRESSION_MIN_SIZE bytes, caching COMPRESSION_CACHE_BYTES of
+    # compressed bodies, see compression.py.
+    'COMPRESSION_ENABLED': (True, bool),
+    'COMPRESSION_MIN_SIZE': (1024, int),
+    'COMPRESSION_CACHE_BYTES': (16 * 1024 * 1024, int),
+    # serve user portraits from a local cache of resized copies, see
+    # avatars.py. a picture that can't be fetched isn't tried again for
+    # AVATAR_FAILURE_TTL seconds. AVATAR_RESIZE shrinks the pictures, which
+    # needs Pillow.
+    'AVATAR_CACHE_ENABLED': (True, bool),
+    'AVATAR_CACHE_DIR': (os.path.join(BASE_DIR, '.avatar_cache'), str),
+    'AVATAR_CACHE_BYTES': (64 * 1024 * 1024, int),
+    'AVATAR_FETCH_TIMEOUT': (5, float),
+    'AVATAR_FAILURE_TTL': (60, float),
+    'AVATAR_RESIZE': (True, bool),
+    # online snapshots of a SQLite database, see backup.py. POST
+    # /admin/backup with 'Authorization: Bearer <BACKUP_TOKEN>' takes one
+    # and keeps the newest BACKUP_KEEP in BACKUP_DIR, copying BACKUP_PAGES
+    # pages at a time with BACKUP_PAUSE seconds between steps. without a
+    # token the endpoint is off.
+    'BACKUP_TOKEN': (None, str),
+    'BACKUP_DIR': (os.path.join(BASE_DIR, 'backups'), str),
+    'BACKUP_KEEP': (7, int),
+    'BACKUP_PAGES': (256, int),
+    'BACKUP_PAUSE': (0.01, float),
+    'GOOGLE_CLIENT_SECRETS': (os.path.join(BASE_DIR, 'client_secrets.json'),
+                              str),
+    'FACEBOOK_CLIENT_SECRETS': (os.path.join(BASE_DIR,
+                                             'fb_client_secrets.json'), str),
+}
+
+WORKER_MODES = ('development', 'sync', 'threaded')
+
+# maps config names to create_engine() keyword arguments.
+POOL_ARGUMENTS = {
+    'DATABASE_POOL_SIZE': 'pool_size',
+    'DATABASE_MAX_OVERFLOW': 'max_overflow',
+    'DATABASE_POOL_TIMEOUT': 'pool_timeout',
+    'DATABASE_POOL_RECYCLE': 'pool_recycle',
+}
+
+
+def parseBool(value):
+    """Parse a boolean flag from an environment variable."""
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def loadConfig(overrides=None, environ=None):
+    """
+    Build the app configuration.
+
+    Starts from the defaults, applies CATALOG_* environment variables and
+    then any explicit overrides, returning a plain dict.
+    """
+    if environ is None:
+        environ = os.environ
+    config = {}
+    for name, (default, kind) in SETTINGS.items():
+        value = environ.get('CATALOG_' + name)
+        if value is None:
+            config[name] = default
+        elif kind is bool:
+            config[name] = parseBool(value)
+        else:
+            config[name] = kind(value)
+    config.update(overrides or {})
+    if config['WORKER_MODE'] not in WORKER_MODES:
+        raise ValueError('unknown worker mode %r' % config['WORKER_MODE'])
+    return config
+
+
+def engineOptions(config):
+    """Returns the db.makeEngine() keyword arguments for a config."""
+    options = {'echo': config.get('DATABASE_ECHO', False),
+               'pragmas': config.get('SQLITE_PRAGMAS')}
+    for name, argument in POOL_ARGUMENTS.items():
+        if config.get(name) is not None:
+            options[argument] = config[name]
+    return options
@@ -3,7 +3,10 @@ import sys
 from sqlalchemy import Column, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy import inspect
+
+from config import loadConfig, engineOptions
+from db import makeEngine
 
 Base = declarative_base()
 
@@ -28,13 +31,18 @@ class Restaurant(Base):
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
 
+    # incremented by every UPDATE, so stale edits can be detected.
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+
+    # the columns returned by serialize.
+    serialize_columns = ('name', 'id')
+
     @property
     def serialize(self):
         """Returns object data in easily serializable format"""
-        return {
-            'name': self.name,
-            'id': self.id,
-        }
+        return dict((column, getattr(self, column))
+                    for column in self.serialize_columns)
 
 
 class MenuItem(Base):
@@ -48,23 +56,88 @@ class MenuItem(Base):
     description = Column(String(250))
     price = Column(String(8))
 
-    restaurant_id = Column(Integer, ForeignKey('restaurant.id'))
+    # indexed, as menus and summaries are read by restaurant.
+    restaurant_id = Column(Integer, ForeignKey('restaurant.id'), index=True)
     restaurant = relationship(Restaurant)
 
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
 
+    # incremented by every UPDATE, so stale edits can be detected.
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+
+    # the columns returned by serialize.
+    serialize_columns = ('name', 'description', 'id', 'price', 'course')
+
     @property
     def serialize(self):
         """Returns object data in easily serializable format"""
-        return {
-            'name': self.name,
-            'description': self.description,
-            'id': self.id,
-            'price': self.price,
-            'course': self.course,
-        }
+        return dict((column, getattr(self, column))
+                    for column in self.serialize_columns)
+
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+class Change(Base):
+    """Change log table definition, see changes.py"""
+    __tablename__ = 'change'
+    # ids are never reused, even if old entries are removed.
+    __table_args__ = {'sqlite_autoincrement': True}
 
-Base.metadata.create_all(engine)
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String(20), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    # 'create', 'update' or 'delete'.
+    action = Column(String(6), nullable=False)
+    # the restaurant of the row, or the restaurant itself.
+    restaurant_id = Column(Integer, index=True)
+
+
+class RestaurantSummary(Base):
+    """Restaurant menu summary table definition, see summary.py"""
+    __tablename__ = 'restaurant_summary'
+
+    restaurant_id = Column(Integer, ForeignKey('restaurant.id'),
+                           primary_key=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    # the price range in cents, of the items with a readable price.
+    min_price = Column(Integer)
+    max_price = Column(Integer)
+    # the distinct courses on the menu, sorted and comma separated.
+    courses = Column(String(250), nullable=False, default='')
+
+
+# columns added since the tables were first released, with their types.
+ADDED_COLUMNS = [
+    (Restaurant.__table__, 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    (MenuItem.__table__, 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    (Change.__table__, 'restaurant_id', 'INTEGER'),
+]
+
+
+def upgradeSchema(engine):
+    """
+    Add the tables, columns and indexes introduced since the database was
+    created to an existing database.
+    """
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table, column, kind in ADDED_COLUMNS:
+        columns = [c['name'] for c in inspector.get_columns(table.name)]
+        if columns and column not in columns:
+            engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table.name, column, kind))
+    for table in Base.metadata.sorted_tables:
+        existing = set(index['name']
+                       for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+
+
+if __name__ == '__main__':
+    # create or upgrade the configured database. the app and scripts do
+    # this for the database they open, so importing the models has no side
+    # effects.
+    config = loadConfig()
+    engine = makeEngine(config['DATABASE_URL'], **engineOptions(config))
+    upgradeSchema(engine)
@@ -0,0 +1,115 @@
+"""
+Database engines for any SQLAlchemy database URL.
+
+makeEngine() creates an engine tuned for the URL's dialect, so the same code
+runs against SQLite and a multi-writer database like PostgreSQL:
+
+- SQLite files get a PRAGMA profile applied to every new connection. The
+  default, 'tuned', switches to the WAL journal with synchronous=NORMAL,
+  letting readers run alongside the single writer, and enlarges the page
+  cache and memory map. Connections are pooled and shared between threads,
+  so the pragmas run once per connection instead of once per request.
+- PostgreSQL gets a bounded connection pool whose connections are checked
+  before use and recycled, so restarts and idle timeouts don't break
+  requests. Large reads can stream rows through server side cursors with
+  Query.yield_per() or the stream_results execution option.
+
+Scripts take their URL from the DATABASE_URL environment variable and the
+SQLite profile from SQLITE_PRAGMAS, e.g.
+
+    DATABASE_URL=postgresql://catalog@localhost/catalog python webserver.py
+    SQLITE_PRAGMAS=wal,cache_size=-20000 python webserver.py
+"""
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+# PRAGMA name, value pairs applied in order to every new SQLite connection.
+WAL_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+]
+PRAGMA_PROFILES = {
+    # SQLite's own defaults: rollback journal, full fsync on every commit.
+    # set explicitly, as the journal mode is stored in the database file.
+    'defaults': [('journal_mode', 'DELETE'), ('synchronous', 'FULL')],
+    'wal': WAL_PRAGMAS,
+    'tuned': WAL_PRAGMAS + [
+        # 64MB page cache (negative sizes are in KiB) and 256MB memory map.
+        ('cache_size', -65536),
+        ('mmap_size', 268435456),
+        ('temp_store', 'MEMORY'),
+        # wait up to 5s for the write lock instead of failing at once.
+        ('busy_timeout', 5000),
+    ],
+}
+DEFAULT_PROFILE = 'tuned'
+
+# create_engine() defaults for PostgreSQL, explicit options win.
+POSTGRES_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+}
+
+
+def databaseUrl(default):
+    """Returns the DATABASE_URL environment variable, or default."""
+    return os.environ.get('DATABASE_URL') or default
+
+
+def sqlitePragmas(spec=None):
+    """
+    Returns the PRAGMA list for a comma separated spec of profile names and
+    name=value overrides, e.g. 'wal,cache_size=-20000'. Without a spec the
+    SQLITE_PRAGMAS environment variable, or else DEFAULT_PROFILE, is used.
+    """
+    if spec is None:
+        spec = os.environ.get('SQLITE_PRAGMAS') or DEFAULT_PROFILE
+    pragmas = []
+    for part in spec.split(','):
+        part = part.strip()
+        if '=' in part:
+            name, value = part.split('=', 1)
+            pragmas.append((name.strip(), value.strip()))
+        elif part in PRAGMA_PROFILES:
+            pragmas.extend(PRAGMA_PROFILES[part])
+        elif part:
+            raise ValueError('unknown SQLite pragma profile %r' % part)
+    return pragmas
+
+
+def applyPragmas(engine, pragmas):
+    """Run PRAGMA name=value for every pragma on each new connection."""
+    def setPragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
+    event.listen(engine, 'connect', setPragmas)
+
+
+def makeEngine(url, pragmas=None, **options):
+    """
+    Create an engine for url with the settings for its dialect. pragmas is
+    the SQLite PRAGMA spec, see sqlitePragmas(). Other keyword arguments are
+    passed on to create_engine().
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    sqlite_file = (backend == 'sqlite' and
+                   url.database not in (None, '', ':memory:'))
+    if backend == 'postgresql':
+        options = dict(POSTGRES_OPTIONS, **options)
+    elif sqlite_file and 'poolclass' not in options:
+        # pool file connections instead of reopening one per checkout.
+        options['poolclass'] = QueuePool
+        options.setdefault('connect_args', {})['check_same_thread'] = False
+    engine = create_engine(url, **options)
+    # in memory databases keep SQLite's defaults.
+    if sqlite_file:
+        applyPragmas(engine, sqlitePragmas(pragmas))
+    return engine
@@ -0,0 +1,273 @@
+"""
+Server-Sent Events of menu item changes.
+
+A ChangeTailer follows the change log (see changes.py) and publishes every
+committed menu item create, edit and delete to an in-process Broker, which
+fans each event out to the subscribers of its restaurant and of the global
+stream. Reading the log rather than hooking the routes means every worker
+process sees the changes made by all the others, and an event is only sent
+once its transaction has committed. The log id is the SSE event id, so a
+client reconnecting with Last-Event-ID is sent what it missed. Both the
+tailer and the replay continue after the highest id read, which relies on
+entries committing in id order, see lockLog() in changes.py.
+
+Every subscriber has a bounded queue. A subscriber that falls so far behind
+that its queue is full is evicted: its queue is dropped and it is sent an
+'evicted' event, after which the client reconnects and catches up from the
+log. So a stalled client costs at most a queue's worth of memory. Idle
+subscribers wait on their queue without a timeout, as a timed wait on a
+Python 2 Condition polls, and the tailer queues a keepalive for all of them
+every heartbeat seconds instead.
+"""
+import json
+import logging
+import threading
+import time
+from Queue import Queue, Full
+
+from sqlalchemy.orm import sessionmaker
+
+from changes import changedRows, latestToken
+from database_setup import Change
+
+# the channel every event is also published to.
+GLOBAL = 'all'
+# put in an evicted subscriber's queue.
+EVICTED = object()
+# put in every queue each heartbeat.
+KEEPALIVE = object()
+# log entries read at a time when replaying to a reconnecting client.
+REPLAY_PAGE = 1000
+
+log = logging.getLogger('events')
+
+
+def restaurantChannel(restaurant_id):
+    return 'restaurant:%d' % restaurant_id
+
+
+class Subscription(object):
+    """A subscriber's bounded queue of events from one channel."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.queue = Queue(maxsize)
+        self.evicted = False
+
+    def offer(self, event):
+        """Queue an event. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except Full:
+            return False
+
+    def evict(self):
+        """Drop the queued events and leave only the eviction notice."""
+        self.evicted = True
+        with self.queue.mutex:
+            self.queue.queue.clear()
+            self.queue.queue.append(EVICTED)
+            self.queue.not_empty.notify()
+
+    def get(self):
+        """Returns the next event, EVICTED or KEEPALIVE."""
+        return self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker(object):
+    """In-process publish/subscribe of events by channel."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.channels[subscription.channel]
+
+    def subscribers(self):
+        """Returns the number of subscriptions."""
+        with self.lock:
+            return sum(len(s) for s in self.channels.values())
+
+    def keepalive(self):
+        """Queue a keepalive for every subscriber with room for it."""
+        with self.lock:
+            subscribers = [s for channel in self.channels.values()
+                           for s in channel]
+        for subscription in subscribers:
+            subscription.offer(KEEPALIVE)
+
+    def publish(self, channels, event):
+        """Send an event to the subscribers of channels, evicting full ones."""
+        with self.lock:
+            subscribers = [s for channel in channels
+                           for s in self.channels.get(channel, ())]
+        self.published += 1
+        for subscription in subscribers:
+            if not subscription.offer(event):
+                self.unsubscribe(subscription)
+                subscription.evict()
+                self.evictions += 1
+
+
+def menuEvents(session, since, limit=1000, restaurant_id=None):
+    """
+    Returns the menu item changes logged after id since as a list of
+    (id, action, restaurant_id, data) events, data being the item's current
+    serialize dict with its restaurant_id, or just the ids once deleted,
+    and the id of the last log entry read.
+    """
+    query = session.query(Change.id, Change.action, Change.row_id,
+                          Change.restaurant_id)\
+        .filter(Change.id > since, Change.table_name == 'menu_item')
+    if restaurant_id is not None:
+        query = query.filter(Change.restaurant_id == restaurant_id)
+    entries = query.order_by(Change.id).limit(limit).all()
+    current = dict((row['id'], row) for row in changedRows(
+        session, 'menu_item', set(entry[2] for entry in entries
+                                  if entry[1] != 'delete')))
+    events = []
+    for change_id, action, row_id, restaurant in entries:
+        if action == 'delete':
+            data = {'id': row_id, 'restaurant_id': restaurant}
+        elif row_id in current:
+            data = current[row_id]
+        else:
+            # deleted by a later change, which has its own event.
+            continue
+        events.append((change_id, action, restaurant, data))
+    return events, entries[-1][0] if entries else since
+
+
+def formatEvent(event):
+    """Format an event as an SSE message."""
+    change_id, action, restaurant_id, data = event
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+        change_id, action, json.dumps({'MenuItem': data},
+                                      separators=(',', ':')))
+
+
+class ChangeTailer(object):
+    """
+    Polls the change log every interval seconds while there are subscribers
+    and publishes the new menu item events to the broker, with a keepalive
+    every heartbeat seconds. Database calls go through run(function), e.g.
+    a thread pool under gevent.
+    """
+
+    def __init__(self, broker, engine, interval=0.5, heartbeat=15, run=None):
+        self.broker = broker
+        self.DBSession = sessionmaker(bind=engine)
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.run = run or (lambda function: function())
+        self.last = None
+        self.thread = None
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def query(self, function, *args):
+        """Run function(session, *args) in a short lived session."""
+        def call():
+            session = self.DBSession()
+            try:
+                return function(session, *args)
+            finally:
+                session.close()
+        return self.run(call)
+
+    def start(self):
+        """Start polling, unless it has already started."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.last = self.query(latestToken)
+            self.thread = threading.Thread(target=self.loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """Stop polling after the current poll."""
+        self.stopped = True
+
+    def loop(self):
+        keepalive = time.time()
+        while not self.stopped:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception:
+                # the database may be briefly unavailable, try again.
+                log.exception('polling the change log failed')
+            if time.time() - keepalive >= self.heartbeat:
+                self.broker.keepalive()
+                keepalive = time.time()
+
+    def poll(self):
+        """Publish the events logged since the last poll."""
+        if not self.broker.subscribers():
+            # nobody to tell, skip the changes made meanwhile.
+            self.last = self.query(latestToken)
+            return
+        events, self.last = self.query(menuEvents, self.last)
+        for event in events:
+            self.broker.publish([GLOBAL, restaurantChannel(event[2])], event)
+
+    def subscribe(self, restaurant_id=None):
+        self.start()
+        if restaurant_id is None:
+            return self.broker.subscribe(GLOBAL)
+        return self.broker.subscribe(restaurantChannel(restaurant_id))
+
+    def stream(self, restaurant_id=None, last_event_id=None):
+        """
+        Returns an iterator of SSE messages for a subscriber, starting with
+        the events after last_event_id when it is given.
+        """
+        def messages():
+            # subscribe first, so nothing is lost between the replay and the
+            # published events. events in both are only sent once.
+            subscription = self.subscribe(restaurant_id)
+            last = last_event_id
+            try:
+                yield 'retry: 2000\n\n'
+                while last is not None:
+                    events, read = self.query(menuEvents, last, REPLAY_PAGE,
+                                              restaurant_id)
+                    for event in events:
+                        yield formatEvent(event)
+                    if read == last:
+                        break
+                    last = read
+                while True:
+                    event = subscription.get()
+                    if event is KEEPALIVE:
+                        yield ': keepalive\n\n'
+                    elif event is EVICTED:
+                        yield 'event: evicted\ndata: {}\n\n'
+                        return
+                    elif last is None or event[0] > last:
+                        last = event[0]
+                        yield formatEvent(event)
+            finally:
+                subscription.close()
+        return messages()
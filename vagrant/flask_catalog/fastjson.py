@@ -0,0 +1,77 @@
+"""
+Fast serialization for the catalog's JSON endpoints.
+
+Instead of loading ORM objects and building their serialize dicts, the
+endpoints query only a model's serialize_columns as plain row tuples and
+encode the result compactly with the fastest encoder installed: orjson,
+then ujson, then the standard library's json. loads() decodes with the
+same library.
+"""
+import json
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+if orjson is not None:
+    ENCODER = 'orjson'
+
+    def dumps(obj):
+        """Encode obj as compact JSON."""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Decode JSON."""
+        return orjson.loads(data)
+elif ujson is not None:
+    ENCODER = 'ujson'
+
+    def dumps(obj):
+        """Encode obj as compact JSON."""
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+    def loads(data):
+        """Decode JSON."""
+        return ujson.loads(data)
+else:
+    ENCODER = 'json'
+
+    def dumps(obj):
+        """Encode obj as compact JSON."""
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(data):
+        """Decode JSON."""
+        return json.loads(data)
+
+
+def serializedQuery(session, model):
+    """
+    Returns a query for the serialize_columns of model, as row tuples in
+    the order of serialize_columns.
+    """
+    return session.query(*[getattr(model, column)
+                           for column in model.serialize_columns])
+
+
+def serializeRows(model, rows):
+    """
+    Returns the serialize dicts of rows from serializedQuery(), without
+    creating any ORM objects.
+    """
+    columns = model.serialize_columns
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def fastJsonify(**data):
+    """Like flask.jsonify(**data), with compact output from dumps()."""
+    return current_app.response_class(dumps(data),
+                                      mimetype='application/json')
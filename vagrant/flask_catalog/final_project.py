@@ -1,44 +1,167 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, \
-                  jsonify
+                  jsonify, abort
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database_setup import Base, Restaurant, MenuItem, User
+from sqlalchemy import select, func
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+from database_setup import Base, Restaurant, MenuItem, User, \
+    RestaurantSummary, upgradeSchema
 
 from flask import session as login_session
 import random
 import string
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-import httplib2
+import csv
+import hmac
+import os
 import json
+import logging
 from flask import make_response
-import requests
+from config import loadConfig, engineOptions
+from db import makeEngine
+from templating import configureTemplates
+from assets import initAssets
+from compression import Compressor
+from avatars import AvatarCache, AVATAR_SIZES, avatarUrl, sendAvatar
+from metrics import metrics
+from slowquery import SlowQueryLog
+from sessions import createSessionInterface
+from routing import RoutingSession, readOnly, recordWrite
+from fastjson import serializedQuery, serializeRows, fastJsonify
+from ownership import getOwned, isOwned, checkOwned, updateOwned, \
+    deleteOwned, ownedFilter, StaleEditError
+from bulk import importMenuItems, uploadedRows, validatePatch, ownedItemIds, \
+    updateMenuItems, staleItems, deleteMenuItems
+from changes import logChanges, logMatching, latestToken, changesSince
+from events import Broker, ChangeTailer
+from backup import BackupError, takeSnapshot, listSnapshots
+from summary import refreshSummaries, rebuildSummaries, summariesStale, \
+    summaryQuery, serializeSummary, formatPrice
 
 # initialize flask
 app = Flask(__name__)
 
-# get client id for google oauth
-G_CLIENT_ID = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
+# the database connections are created by create_app(). each thread gets
+# its own session, which is removed again at the end of every request.
+# routes decorated with @replicaRead read from the replica, if configured.
+engine = None
+replica_engine = None
+DBSession = sessionmaker(class_=RoutingSession)
+session = scoped_session(DBSession)
+replicaRead = readOnly(session)
+
+
+def create_app(config=None):
+    """
+    Application factory.
+
+    Configures the app from the environment and the given config dict (see
+    config.py), creates the database engine and prepares the templates for
+    the configured worker mode, then returns the app.
+    """
+    global engine, replica_engine
+    app.config.update(loadConfig(config))
+    app.secret_key = app.config['SECRET_KEY']
+    app.session_interface = createSessionInterface(app.config)
+    app.debug = app.config['WORKER_MODE'] == 'development'
+
+    # initialize the database connection
+    engine = makeEngine(app.config['DATABASE_URL'],
+                        **engineOptions(app.config))
+    Base.metadata.bind = engine
+    # add the columns missing from databases created by older versions.
+    upgradeSchema(engine)
+    # read only routes use the replica's own pool.
+    replica_engine = None
+    if app.config['REPLICA_DATABASE_URL']:
+        replica_engine = makeEngine(app.config['REPLICA_DATABASE_URL'],
+                                    **engineOptions(app.config))
+    engines = [e for e in (engine, replica_engine) if e is not None]
+    session.remove()
+    session.configure(bind=engine, info={'replica_engine': replica_engine})
+    # summarize the menus of databases written without summaries.
+    if summariesStale(session):
+        rebuildSummaries(session)
+        session.commit()
+    session.remove()
+
+    # record request, sql and template timings, served at /metrics.
+    if app.config['METRICS_ENABLED']:
+        for e in engines:
+            metrics.initApp(app, e, app.config['METRICS_SERVER_TIMING'])
+    # log slow statements with their query plans.
+    if app.config['SLOW_QUERY_MS'] is not None:
+        logging.basicConfig()
+        slow = SlowQueryLog(app.config['SLOW_QUERY_MS'] / 1000.0)
+        for e in engines:
+            slow.attach(e)
+        app.extensions['slowquery'] = slow
+
+    # compress large html and json responses the client accepts compressed.
+    if (app.config['COMPRESSION_ENABLED'] and
+            'compression' not in app.extensions):
+        compressor = Compressor(
+            min_size=app.config['COMPRESSION_MIN_SIZE'],
+            cache_bytes=app.config['COMPRESSION_CACHE_BYTES'])
+        compressor.initApp(app)
+        app.extensions['compression'] = compressor
+
+    # push committed menu changes to Server-Sent Events subscribers.
+    if app.extensions.get('events') is not None:
+        app.extensions['events'].stop()
+    app.extensions['events'] = ChangeTailer(
+        Broker(app.config['EVENTS_QUEUE_SIZE']), engine,
+        app.config['EVENTS_POLL_INTERVAL'], app.config['EVENTS_HEARTBEAT'])
+
+    # proxy user portraits through a local cache.
+    app.extensions['avatars'] = None
+    if app.config['AVATAR_CACHE_ENABLED']:
+        app.extensions['avatars'] = AvatarCache(
+            app.config['AVATAR_CACHE_DIR'],
+            max_bytes=app.config['AVATAR_CACHE_BYTES'],
+            timeout=app.config['AVATAR_FETCH_TIMEOUT'],
+            failure_ttl=app.config['AVATAR_FAILURE_TTL'],
+            resize=app.config['AVATAR_RESIZE'])
+
+    if app.debug:
+        # reload edited templates while developing.
+        app.jinja_env.auto_reload = True
+    else:
+        # disable template reloading, cache template bytecode on disk and
+        # compile every template now so the first request doesn't have to.
+        configureTemplates(app, app.config['TEMPLATE_CACHE_DIR'],
+                           app.config['TEMPLATE_PRECOMPILE'])
+        # serve the fingerprinted static files of the last asset build.
+        initAssets(app)
+    return app
+
+
+@app.teardown_appcontext
+def removeSession(exception=None):
+    """Discard the request's database session."""
+    session.remove()
+
 
-# initialize the database connection
-engine = create_engine('sqlite:///restaurantmenu.db')
-Base.metadata.bind = engine
+# templates link portraits through the avatar cache.
+app.add_template_global(avatarUrl)
+# and show prices in cents from the menu summaries.
+app.add_template_filter(formatPrice, 'price')
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+
+# send the user's reads to the primary for a while after they change
+# something.
+app.after_request(recordWrite)
 
 
 @app.route('/')
 @app.route('/restaurants')
+@replicaRead
 def showRestaurants():
     """
     root route.
     Displays(READ) item categories, in this context restaurants.
     """
-    # READ the list of restaurants
-    restaurants = session.query(Restaurant).all()
+    # READ the list of restaurants with the summaries of their menus.
+    restaurants = summaryQuery(session).all()
     # check if user is logged in.
     if 'user_id' not in login_session:
         # if not logged in return a public list of restaurants
@@ -71,6 +194,9 @@ def newRestaurant():
         newRest = Restaurant(name=request.form['name'],
                              user_id=login_session['user_id'])
         session.add(newRest)
+        session.flush()
+        refreshSummaries(session, [newRest.id])
+        logChanges(session, Restaurant, 'create', [newRest.id])
         session.commit()
         flash("new restaurant created!")
         return redirect(url_for('showRestaurants'))
@@ -89,29 +215,35 @@ def editRestaurant(restaurant_id):
     if 'username' not in login_session:
         # redirect to login if not logged in.
         return redirect('/login')
-    # get the restaurant to UPDATE
-    restaurant = session.query(Restaurant).filter_by(id=restaurant_id).one()
-    # check to see if the current user is authorized to UPDATE the restaurant
-    if restaurant.user_id != login_session['user_id']:
-        # return an alert chastising the user.
-        return """
-        <script>
-            function unauthAlert() {alert('Current user is not authorized.');}
-        </script>
-        <body onload='unauthAlert()'>
-        """
     # check if the method is POST
     if request.method == 'POST':
         # check if the form has a name and replace the old name with the
-        # submitted name. UPDATE the restaurant and redirect.
+        # submitted name. UPDATE the restaurant if the current user owns it
+        # and redirect.
+        # the edit is rejected if the restaurant changed since the form
+        # was rendered with its version.
+        values = {}
         if request.form['name']:
-            restaurant.name = request.form['name']
-        session.add(restaurant)
+            values['name'] = request.form['name']
+        try:
+            updateOwned(session, Restaurant, restaurant_id,
+                        login_session['user_id'], values,
+                        version=request.form.get('version', type=int))
+        except StaleEditError:
+            session.rollback()
+            flash("restaurant was changed by someone else, "
+                  "please review and edit again.")
+            return redirect(url_for('editRestaurant',
+                                    restaurant_id=restaurant_id))
+        logChanges(session, Restaurant, 'update', [restaurant_id])
         session.commit()
         flash("restaurant edited!")
         return redirect(url_for('showRestaurants'))
     else:
-        # on GET return the form to POST.
+        # get the name and version of the restaurant to UPDATE if the
+        # current user owns it, and return the form to POST.
+        restaurant = getOwned(session, Restaurant, restaurant_id,
+                              login_session['user_id'], ['name', 'version'])
         return render_template('editrestaurant.html',
                                restaurant_id=restaurant_id,
                                restaurant=restaurant,
@@ -128,30 +260,34 @@ def deleteRestaurant(restaurant_id):
     if 'username' not in login_session:
         # redirect to login if not logged in.
         return redirect('/login')
-    # get the restaurant to DELETE
-    restaurant = session.query(Restaurant).filter_by(id=restaurant_id).one()
-    # check to see if the current user is authorized to DELETE the restaurant
-    if restaurant.user_id != login_session['user_id']:
-        # return an alert chastising the user.
-        return """
-        <script>
-            function unauthAlert() {alert('Current user is not authorized.');}
-        </script>
-        <body onload='unauthAlert()'>
-        """
     # check if the method is POST
     if request.method == 'POST':
-        # get all items belonging to the restaurant and DELETE them all.
-        # then DELETE the restaurant and redirect.
-        items = session.query(MenuItem).filter_by(restaurant_id=restaurant_id)
-        for item in items:
-            session.delete(item)
-        session.delete(restaurant)
+        # DELETE all items belonging to the restaurant with one statement
+        # if the current user owns it, then the restaurant, so no item is
+        # left referencing a missing restaurant, and redirect.
+        owned = select([Restaurant.id]).where(ownedFilter(
+            Restaurant, restaurant_id, login_session['user_id'], {}))
+        # lock the restaurant, so no items are added to it meanwhile, and
+        # get the ids of its items to log them as deleted.
+        session.execute(owned.with_for_update())
+        items = [item_id for item_id, in session.execute(
+            select([MenuItem.id]).where(MenuItem.restaurant_id.in_(owned)))]
+        session.execute(MenuItem.__table__.delete().where(
+            MenuItem.restaurant_id.in_(owned)))
+        session.execute(RestaurantSummary.__table__.delete().where(
+            RestaurantSummary.restaurant_id.in_(owned)))
+        deleteOwned(session, Restaurant, restaurant_id,
+                    login_session['user_id'])
+        logChanges(session, MenuItem, 'delete', items, restaurant_id)
+        logChanges(session, Restaurant, 'delete', [restaurant_id])
         session.commit()
         flash("restaurant and menu deleted!")
         return redirect(url_for('showRestaurants'))
     else:
-        # on GET return the form to POST.
+        # get the name of the restaurant to DELETE if the current user owns
+        # it, and return the form to POST.
+        restaurant = getOwned(session, Restaurant, restaurant_id,
+                              login_session['user_id'], ['name'])
         return render_template('deleterestaurant.html',
                                restaurant_id=restaurant_id,
                                restaurant=restaurant)
@@ -159,6 +295,7 @@ def deleteRestaurant(restaurant_id):
 
 @app.route('/restaurant/<int:restaurant_id>')
 @app.route('/restaurant/<int:restaurant_id>/menu')
+@replicaRead
 def showMenu(restaurant_id):
     """
     Item READ route.
@@ -200,18 +337,21 @@ def newMenuItem(restaurant_id):
         return redirect('/login')
     # check if the method is POST.
     if request.method == 'POST':
-        # get the restaurant the new item belongs to, and then populate a new
-        # item with submitted form fields. Insert the new item into the
-        # database and redirect.
-        restaurant = session.query(Restaurant).filter_by(
-                     id=restaurant_id).one()
+        # check to see if the current user owns the restaurant the new item
+        # belongs to, and then populate a new item with submitted form
+        # fields. Insert the new item into the database and redirect.
+        checkOwned(session, Restaurant, restaurant_id,
+                   login_session['user_id'])
         newItem = MenuItem(name=request.form['name'],
                            description=request.form['description'],
                            course=request.form['course'],
                            price=request.form['price'],
                            restaurant_id=restaurant_id,
-                           user_id=restaurant.user_id)
+                           user_id=login_session['user_id'])
         session.add(newItem)
+        session.flush()
+        refreshSummaries(session, [restaurant_id])
+        logChanges(session, MenuItem, 'create', [newItem.id], restaurant_id)
         session.commit()
         flash("new menu item created!")
         return redirect(url_for('showMenu',
@@ -223,6 +363,109 @@ def newMenuItem(restaurant_id):
                                session=login_session)
 
 
+@app.route('/restaurant/<int:restaurant_id>/menu/import', methods=['POST'])
+def importMenu(restaurant_id):
+    """
+    Bulk CREATE items route.
+    Imports menu items from an uploaded JSON array or CSV file.
+
+    Every valid row is inserted in a single transaction, and the response
+    reports the rows that were rejected and why. With ?strict=1 nothing is
+    imported if any row is invalid.
+    """
+    # check if the user is logged in.
+    if 'username' not in login_session:
+        return jsonResponse('Not logged in.', 401)
+    # check to see if the current user is authorized to add to the menu.
+    if not isOwned(session, Restaurant, restaurant_id,
+                   login_session['user_id']):
+        return jsonResponse('Current user is not authorized.', 403)
+    # stream the upload into the database.
+    before = session.query(func.max(MenuItem.id)).scalar() or 0
+    try:
+        imported, rejected, errors = importMenuItems(
+            session, restaurant_id, login_session['user_id'],
+            uploadedRows(request))
+    except (ValueError, csv.Error) as e:
+        session.rollback()
+        return jsonResponse('Invalid upload: %s' % e, 400)
+    if rejected and request.args.get('strict'):
+        session.rollback()
+        return jsonify(imported=0, rejected=rejected, errors=errors), 422
+    refreshSummaries(session, [restaurant_id])
+    # the imported items are the restaurant's items with new ids.
+    logMatching(session, MenuItem, 'create',
+                (MenuItem.id > before) &
+                (MenuItem.restaurant_id == restaurant_id))
+    session.commit()
+    return jsonify(imported=imported, rejected=rejected, errors=errors)
+
+
+@app.route('/restaurant/<int:restaurant_id>/menu/bulk', methods=['POST'])
+def bulkEditMenu(restaurant_id):
+    """
+    Bulk UPDATE and DELETE items route.
+
+    Takes a JSON object with a list of item patches, e.g.
+    {"update": [{"id": 3, "version": 2, "price": "$4.50"}], "delete": [4, 5]},
+    checks that the current user owns every item with one query and applies
+    the changes as set based UPDATEs and DELETEs in a single transaction.
+    Nothing is changed if an item is no longer at the version given for it,
+    and a body that isn't of this form, or patches an item twice, is
+    rejected with a 400.
+    """
+    # check if the user is logged in.
+    if 'username' not in login_session:
+        return jsonResponse('Not logged in.', 401)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonResponse('Expected a JSON object.', 400)
+    # validate the patches and deletes.
+    updates = body.get('update') or []
+    deletes = body.get('delete') or []
+    if not isinstance(updates, list):
+        return jsonify(errors=[{'error': 'update must be a list'}]), 400
+    patches, errors, seen = [], [], set()
+    for number, patch in enumerate(updates, 1):
+        item_id, changes, error = validatePatch(patch)
+        if error is None and item_id in seen:
+            error = 'id is updated more than once'
+        if error is not None:
+            errors.append({'entry': number, 'id': item_id, 'error': error})
+        else:
+            patches.append((item_id, changes))
+            seen.add(item_id)
+    if not isinstance(deletes, list) or not all(
+            isinstance(i, (int, long)) and not isinstance(i, bool)
+            for i in deletes):
+        errors.append({'error': 'delete must be a list of ids'})
+    if errors:
+        return jsonify(errors=errors), 400
+    # check to see if the current user is authorized to change every item.
+    ids = set(item_id for item_id, changes in patches) | set(deletes)
+    owned = ownedItemIds(session, restaurant_id, login_session['user_id'], ids)
+    if owned != ids:
+        return jsonify(error='Current user is not authorized.',
+                       ids=sorted(ids - owned)), 403
+    # UPDATE the items, rolling back if any changed since the version given
+    # for it, then DELETE the items and commit.
+    updated = updateMenuItems(session, patches)
+    if updated < len(patches):
+        # report the current versions of the stale items, as committed.
+        session.rollback()
+        versions = dict((str(item_id), version) for item_id, version
+                        in staleItems(session, patches).items())
+        return jsonify(error='Items were changed by someone else.',
+                       versions=versions), 409
+    deleted = deleteMenuItems(session, deletes)
+    refreshSummaries(session, [restaurant_id])
+    logChanges(session, MenuItem, 'update',
+               [item_id for item_id, changes in patches], restaurant_id)
+    logChanges(session, MenuItem, 'delete', deletes, restaurant_id)
+    session.commit()
+    return jsonify(updated=updated, deleted=deleted)
+
+
 @app.route('/restaurant/<int:restaurant_id>/menu/<int:menu_id>/edit',
            methods=['GET', 'POST'])
 def editMenuItem(restaurant_id, menu_id):
@@ -233,35 +476,40 @@ def editMenuItem(restaurant_id, menu_id):
     # check if the user is logged in.
     if 'username' not in login_session:
         return redirect('/login')
-    # get the item to UPDATE
-    editedItem = session.query(MenuItem).filter_by(id=menu_id).one()
-    # check to see if the current user is authorized to UPDATE the item
-    if editedItem.user_id != login_session['user_id']:
-        # return an alert chastising the user.
-        return """
-        <script>
-            function unauthAlert() {alert('Current user is not authorized.');}
-        </script>
-        <body onload='unauthAlert()'>
-        """
     # check if the method is POST
     if request.method == 'POST':
-        # check for edited fields and UPDATE the item accordingly. commit and
-        # redirect afterwards.
-        if request.form['name']:
-            editedItem.name = request.form['name']
-        if request.form['description']:
-            editedItem.description = request.form['description']
-        if request.form['course']:
-            editedItem.course = request.form['course']
-        if request.form['price']:
-            editedItem.price = request.form['price']
-        session.add(editedItem)
+        # check for edited fields and UPDATE the item accordingly if the
+        # current user owns it. commit and redirect afterwards.
+        # the edit is rejected if the item changed since the form was
+        # rendered with its version.
+        values = {}
+        for field in ('name', 'description', 'course', 'price'):
+            if request.form[field]:
+                values[field] = request.form[field]
+        try:
+            updateOwned(session, MenuItem, menu_id, login_session['user_id'],
+                        values, version=request.form.get('version', type=int),
+                        restaurant_id=restaurant_id)
+        except StaleEditError:
+            session.rollback()
+            flash("menu item was changed by someone else, "
+                  "please review and edit again.")
+            return redirect(url_for('editMenuItem',
+                                    restaurant_id=restaurant_id,
+                                    menu_id=menu_id))
+        refreshSummaries(session, [restaurant_id])
+        logChanges(session, MenuItem, 'update', [menu_id], restaurant_id)
         session.commit()
         flash("menu item edited!")
         return redirect(url_for('showMenu', restaurant_id=restaurant_id))
     else:
-        # on GET return the form to POST.
+        # get the fields and version of the item to UPDATE if the current
+        # user owns it, and return the form to POST.
+        editedItem = getOwned(session, MenuItem, menu_id,
+                              login_session['user_id'],
+                              ['name', 'description', 'course', 'price',
+                               'version'],
+                              restaurant_id=restaurant_id)
         return render_template('editmenuitem.html',
                                restaurant_id=restaurant_id,
                                menu_id=menu_id,
@@ -280,26 +528,22 @@ def deleteMenuItem(restaurant_id, menu_id):
     if 'username' not in login_session:
         # redirect to login if not logged in.
         return redirect('/login')
-    # get the item to DELETE
-    item = session.query(MenuItem).filter_by(id=menu_id).one()
-    # check to see if the current user is authorized to DELETE the restaurant
-    if item.user_id != login_session['user_id']:
-        # return an alert chastising the user.
-        return """
-        <script>
-            function unauthAlert() {alert('Current user is not authorized.');}
-        </script>
-        <body onload='unauthAlert()'>
-        """
     # check if the method is POST
     if request.method == 'POST':
-        # DELETE the item and redirect.
-        session.delete(item)
+        # DELETE the item if the current user owns it and redirect.
+        deleteOwned(session, MenuItem, menu_id, login_session['user_id'],
+                    restaurant_id=restaurant_id)
+        refreshSummaries(session, [restaurant_id])
+        logChanges(session, MenuItem, 'delete', [menu_id], restaurant_id)
         session.commit()
         flash("menu item deleted!")
         return redirect(url_for('showMenu', restaurant_id=restaurant_id))
     else:
-        # on GET return the form to POST.
+        # get the item to DELETE if the current user owns it, and return the
+        # form to POST.
+        item = getOwned(session, MenuItem, menu_id, login_session['user_id'],
+                        ['id', 'name', 'restaurant_id'],
+                        restaurant_id=restaurant_id)
         return render_template('deletemenuitem.html',
                                restaurant_id=restaurant_id,
                                item=item,
@@ -307,42 +551,158 @@ def deleteMenuItem(restaurant_id, menu_id):
 
 
 @app.route('/restaurant/<int:restaurant_id>/menu/JSON')
+@replicaRead
 def restaurantMenuJSON(restaurant_id):
     """
     JSON endpoint for all items under a category,
     in this context the menu items of a specified restaurant.
 
-    Gets the specified restaurant by id, then gets all items belonging to the
-    restaurant and returns a JSON object representing the menu.
+    Checks the specified restaurant exists, then gets the serialized columns
+    of all items belonging to the restaurant as tuples and returns a JSON
+    object representing the menu.
     """
-    restaurant = session.query(Restaurant).filter_by(id=restaurant_id).one()
-    items = session.query(MenuItem).filter_by(restaurant_id=restaurant.id)\
-        .all()
-    return jsonify(MenuItems=[i.serialize for i in items])
+    session.query(Restaurant.id).filter_by(id=restaurant_id).one()
+    items = serializedQuery(session, MenuItem)\
+        .filter_by(restaurant_id=restaurant_id).yield_per(1000)
+    return fastJsonify(MenuItems=serializeRows(MenuItem, items))
 
 
 @app.route('/restaurant/<int:restaurant_id>/menu/<int:menu_id>/JSON')
+@replicaRead
 def menuItemJSON(restaurant_id, menu_id):
     """
     JSON endpoint for a specific item, in this context a menu item.
 
-    Gets a specified item and returns a JSON object representing the item.
+    Gets the serialized columns of a specified item and returns a JSON
+    object representing the item.
     """
-    item = session.query(MenuItem).filter_by(id=menu_id).one()
-    return jsonify(MenuItem=item.serialize)
+    item = serializedQuery(session, MenuItem).filter_by(id=menu_id).one()
+    return fastJsonify(MenuItem=serializeRows(MenuItem, [item])[0])
 
 
 @app.route('/restaurants/JSON')
+@replicaRead
 def restaurantJSON():
     """
     JSON endpoint for a list of categories,
     in this context a list of restaurants.
 
-    Gets a list of restaurants, then returns a JSON object
-    representing the list of restaurants.
+    Gets every restaurant with the summary of its menu, its item count,
+    price range and courses, then returns a JSON object representing the
+    list of restaurants.
     """
-    restaurants = session.query(Restaurant).all()
-    return jsonify(Restaurants=[r.serialize for r in restaurants])
+    # stream the rows, through a server side cursor where the database has
+    # them.
+    restaurants = summaryQuery(session).yield_per(1000)
+    return fastJsonify(Restaurants=[serializeSummary(row)
+                                    for row in restaurants])
+
+
+@app.route('/changes')
+@replicaRead
+def changesJSON():
+    """
+    JSON endpoint for incremental sync of restaurants and menu items.
+
+    Without a since token, returns the current token: a mirror downloads
+    the catalog once and then polls /changes?since=<token> with the 'next'
+    token of each response, getting only the rows that changed since and
+    the ids of the deleted ones. 'more' is true while there are further
+    changes to fetch.
+    """
+    since = request.args.get('since')
+    if since is None:
+        return fastJsonify(next=latestToken(session))
+    if not since.isdigit():
+        return jsonResponse('since must be a token from /changes.', 400)
+    return fastJsonify(**changesSince(session, int(since),
+                                      app.config['CHANGES_PAGE_SIZE']))
+
+
+@app.route('/menu/events')
+@app.route('/restaurant/<int:restaurant_id>/menu/events')
+def menuEventStream(restaurant_id=None):
+    """
+    Server-Sent Events stream of menu item changes, of one restaurant or of
+    all of them.
+
+    Sends a create, update or delete event with the item as JSON for every
+    committed change, resuming after the Last-Event-ID of a reconnecting
+    client. Every open stream holds a worker thread here; async_api.py
+    serves the same streams to many more clients per process.
+    """
+    if restaurant_id is not None:
+        session.query(Restaurant.id).filter_by(id=restaurant_id).one()
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id is not None:
+        last_event_id = int(last_event_id) if last_event_id.isdigit() \
+            else None
+    stream = app.extensions['events'].stream(restaurant_id, last_event_id)
+    return app.response_class(stream, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache',
+                                       'X-Accel-Buffering': 'no'})
+
+
+@app.route('/metrics/slow-queries')
+def slowQueriesJSON():
+    """
+    JSON endpoint for the slow query log, when it is enabled.
+
+    Returns the slow statements aggregated by normalized statement text,
+    slowest in total first, with their query plans.
+    """
+    slowlog = app.extensions.get('slowquery')
+    if slowlog is None:
+        abort(404)
+    return jsonify(SlowQueries=slowlog.report())
+
+
+def backupDatabasePath():
+    """
+    Returns the path of the database file to back up, or aborts unless the
+    request has the backup token and the database is a SQLite file.
+    """
+    token = app.config['BACKUP_TOKEN']
+    if not token:
+        abort(404)
+    given = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(str(given), 'Bearer ' + str(token)):
+        abort(401)
+    url = make_url(app.config['DATABASE_URL'])
+    if url.get_backend_name() != 'sqlite' or \
+            url.database in (None, '', ':memory:'):
+        abort(400)
+    return url.database
+
+
+@app.route('/admin/backup', methods=['POST'])
+def backupNow():
+    """
+    Admin route taking an online snapshot of the database, without
+    stopping the app, and deleting the snapshots past BACKUP_KEEP.
+    """
+    database = backupDatabasePath()
+    try:
+        result = takeSnapshot(database, app.config['BACKUP_DIR'],
+                              app.config['BACKUP_KEEP'],
+                              pages=app.config['BACKUP_PAGES'],
+                              pause=app.config['BACKUP_PAUSE'])
+    except (BackupError, OSError) as e:
+        return jsonResponse('Backup failed: %s' % e, 500)
+    return jsonify(snapshot=os.path.basename(result['snapshot']),
+                   pages=result['pages'], restarts=result['restarts'],
+                   seconds=round(result['seconds'], 3),
+                   deleted=[os.path.basename(path)
+                            for path in result['deleted']])
+
+
+@app.route('/admin/backups')
+def listBackups():
+    """Admin JSON endpoint for the snapshots kept, oldest first."""
+    database = backupDatabasePath()
+    return jsonify(snapshots=[
+        {'name': os.path.basename(path), 'bytes': os.path.getsize(path)}
+        for path in listSnapshots(database, app.config['BACKUP_DIR'])])
 
 
 @app.route('/login')
@@ -359,20 +719,49 @@ def showLogin():
     return render_template('login.html', STATE=state)
 
 
+# parsed client secrets files by path, read on first use.
+clientSecretsCache = {}
+
+
+def clientSecrets(path):
+    """
+    Returns the parsed client secrets file of a login provider, read on
+    first use, or None if it is missing.
+    """
+    if path not in clientSecretsCache:
+        try:
+            with open(path, 'r') as f:
+                clientSecretsCache[path] = json.load(f)
+        except IOError:
+            return None
+    return clientSecretsCache[path]
+
+
 @app.route('/gconnect', methods=['POST'])
 def gconnect():
     """handler for google oauth2 login"""
+    # the provider libraries are only needed to log in, so they are
+    # imported on first use instead of by every starting worker.
+    from oauth2client.client import flow_from_clientsecrets
+    from oauth2client.client import FlowExchangeError
+    import httplib2
+    import requests
     # verify the CSRF state token.
     if request.args.get('state') != login_session['state']:
         response = make_response(json.dumps('Invalid state parameter'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
+    # check that google login is configured.
+    secrets = clientSecrets(app.config['GOOGLE_CLIENT_SECRETS'])
+    if secrets is None:
+        return jsonResponse('Google login is not configured.', 503)
 
     # get the Google one-time-code from the user.
     code = request.data
     # upgrade the code to the user's credentials.
     try:
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
+        oauth_flow = flow_from_clientsecrets(
+            app.config['GOOGLE_CLIENT_SECRETS'], scope='')
         oauth_flow.redirect_uri = 'postmessage'
         credentials = oauth_flow.step2_exchange(code)
     except FlowExchangeError:
@@ -400,7 +789,7 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
     # check if the recieved client id matches this app's
-    if result['issued_to'] != G_CLIENT_ID:
+    if result['issued_to'] != secrets['web']['client_id']:
         response = make_response(
             json.dumps("Token's client ID does not match app's"), 401)
         print "Token's client ID doe not match app's"
@@ -436,7 +825,8 @@ def gconnect():
     output = ''
     output += '<h1>Welcome, %s' % login_session['username']
     output += '!<br>User ID is %d' % login_session['user_id']
-    output += '</h1><img src="%s' % login_session['picture']
+    output += '</h1><img src="%s' % avatarUrl(user_id,
+                                              login_session['picture'], 300)
     output += """
      " style = "width: 300px;
                 height: 300px;
@@ -451,15 +841,20 @@ def gconnect():
 @app.route("/fbconnect", methods=['POST'])
 def fbconnect():
     """handler for facebook oauth2 login"""
+    # imported on first use, as in gconnect.
+    import httplib2
     # verify the CSRF state token.
     if request.args.get('state') != login_session['state']:
         response = make_response(json.dumps('Invalid state parameter'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
+    # check that facebook login is configured.
+    fb_client_secrets = clientSecrets(app.config['FACEBOOK_CLIENT_SECRETS'])
+    if fb_client_secrets is None:
+        return jsonResponse('Facebook login is not configured.', 503)
     # get the Facebook access token from the user.
     access_token = request.data
     # upgrade the access token.
-    fb_client_secrets = json.loads(open('fb_client_secrets.json', 'r').read())
     app_id = fb_client_secrets['web']['app_id']
     app_secret = fb_client_secrets['web']['app_secret']
     url = ('https://graph.facebook.com/oauth/access_token?' +
@@ -499,7 +894,8 @@ def fbconnect():
     output = ''
     output += '<h1>Welcome, %s' % login_session['username']
     output += '!<br>User ID is %d' % login_session['user_id']
-    output += '</h1><img src="%s"' % login_session['picture']
+    output += '</h1><img src="%s"' % avatarUrl(user_id,
+                                               login_session['picture'])
     output += ' class="portrait">'
     flash("you are now logged in as %s" % login_session['username'])
     return output
@@ -512,6 +908,7 @@ def fbdisconnect():
     Gets the relevant information and creates a url. Sends an http request to
     the url to disconnect.
     """
+    import httplib2
     facebook_id = login_session['facebook_id']
     access_token = login_session['access_token']
     url = (('https://graph.facebook.com/%s' % facebook_id) +
@@ -527,6 +924,7 @@ def gdisconnect():
     Gets the relevant information and creates a url. Sends an http request to
     the url to disconnect.
     """
+    import httplib2
     access_token = login_session['access_token']
     url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
     h = httplib2.Http()
@@ -563,6 +961,26 @@ def disconnect():
         redirect(url_for('showRestaurants'))
 
 
+def jsonResponse(message, status):
+    """Helper method for returning a JSON encoded message."""
+    response = make_response(json.dumps(message), status)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
+@app.route('/user/<int:user_id>/avatar/<int:size>')
+@replicaRead
+def userAvatar(user_id, size):
+    """Serves a user's portrait from the local avatar cache."""
+    cache = app.extensions.get('avatars')
+    if cache is None or size not in AVATAR_SIZES:
+        abort(404)
+    user = session.query(User).filter_by(id=user_id).first()
+    if user is None or not user.picture:
+        abort(404)
+    return sendAvatar(cache, user.picture, size)
+
+
 def createUser(login_session):
     """
     Helper method for adding a user to the database.
@@ -597,8 +1015,8 @@ def getUserID(email):
         return None
 
 
-# runs the server
+# runs the development server
 if __name__ == '__main__':
-    app.secret_key = 'super_secret_key'
-    app.debug = True
-    app.run(host='0.0.0.0', port=5000)
+    create_app()
+    app.run(host='0.0.0.0', port=5000,
+            threaded=app.config['WORKER_MODE'] == 'threaded')
@@ -1,12 +1,17 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from database_setup import Restaurant, Base, MenuItem, User
+from database_setup import Restaurant, Base, MenuItem, User, upgradeSchema
+from summary import rebuildSummaries
+from config import loadConfig, engineOptions
+from db import makeEngine
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+config = loadConfig()
+engine = makeEngine(config['DATABASE_URL'], **engineOptions(config))
 # Bind the engine to the metadata of the Base class so that the
 # declaratives can be accessed through a DBSession instance
 Base.metadata.bind = engine
+# create the tables, if this is a new database.
+upgradeSchema(engine)
 
 DBSession = sessionmaker(bind=engine)
 # A DBSession() instance establishes all conversations with the database
@@ -382,5 +387,9 @@ menuItem1 = MenuItem(user_id=1, name="Lemon Curd Ice Cream Sandwich",
 session.add(menuItem1)
 session.commit()
 
+# summarize the menus for the restaurant listing.
+rebuildSummaries(session)
+session.commit()
+
 
 print "added menu items!"
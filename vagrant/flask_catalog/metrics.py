@@ -0,0 +1,215 @@
+"""
+Request, SQL and template instrumentation for the catalog app.
+
+Records a latency histogram per endpoint, the number of SQL statements and
+the time spent executing them per endpoint, and a render time histogram per
+template. The numbers are served at /metrics in the Prometheus text format
+and can optionally be sent to the browser as a Server-Timing header.
+
+/metrics tells anyone who asks the app's routes and timings, so it is off
+unless CATALOG_METRICS_ENABLED=1 is set. Then keep /metrics away from the
+public, e.g. by only proxying it to the monitoring network.
+"""
+import threading
+import time
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+
+# histogram bucket upper bounds in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed durations."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record a single duration."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestStats(object):
+    """Timings collected while handling a single request."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.recorded = False
+
+
+class Metrics(object):
+    """
+    Collects the app's metrics.
+
+    Call initApp() with the app and its database engine to start recording.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.sql_count = {}
+        self.sql_time = {}
+        self.templates = {}
+
+    def initApp(self, app, engine, server_timing=False):
+        """
+        Hook the metrics into the app's request cycle, template environment
+        and database engine, and add the /metrics endpoint.
+
+        Must be called before any template is loaded, as render timing is
+        done by the environment's template class.
+        """
+        self.server_timing = server_timing
+        event.listen(engine, 'before_cursor_execute', self.beforeExecute)
+        event.listen(engine, 'after_cursor_execute', self.afterExecute)
+        if 'metrics' in app.extensions:
+            return
+        app.extensions['metrics'] = self
+        app.before_request(self.beforeRequest)
+        app.after_request(self.afterRequest)
+        app.teardown_request(self.teardownRequest)
+        app.jinja_env.template_class = self.timedTemplateClass()
+        app.add_url_rule('/metrics', 'metrics', self.metricsView)
+
+    def timedTemplateClass(self):
+        """Returns a template class that records its render time."""
+        metrics = self
+
+        class TimedTemplate(Template):
+            def render(self, *args, **kwargs):
+                start = time.time()
+                try:
+                    return Template.render(self, *args, **kwargs)
+                finally:
+                    metrics.observeTemplate(self.name, time.time() - start)
+
+        return TimedTemplate
+
+    def beforeRequest(self):
+        g.request_stats = RequestStats()
+
+    def afterRequest(self, response):
+        stats = self.recordRequest()
+        if stats is not None and self.server_timing:
+            response.headers['Server-Timing'] = serverTiming(stats)
+        return response
+
+    def teardownRequest(self, exception=None):
+        # requests that raised never reach afterRequest.
+        self.recordRequest()
+
+    def recordRequest(self):
+        """Add the current request's timings to the totals, once."""
+        stats = getattr(g, 'request_stats', None)
+        if stats is None or stats.recorded:
+            return None
+        stats.recorded = True
+        elapsed = time.time() - stats.start
+        endpoint = request.endpoint or 'none'
+        with self.lock:
+            if endpoint not in self.requests:
+                self.requests[endpoint] = Histogram()
+            self.requests[endpoint].observe(elapsed)
+            self.sql_count[endpoint] = (self.sql_count.get(endpoint, 0) +
+                                        stats.sql_count)
+            self.sql_time[endpoint] = (self.sql_time.get(endpoint, 0.0) +
+                                       stats.sql_time)
+        return stats
+
+    def observeTemplate(self, name, elapsed):
+        with self.lock:
+            if name not in self.templates:
+                self.templates[name] = Histogram()
+            self.templates[name].observe(elapsed)
+        if has_request_context():
+            stats = getattr(g, 'request_stats', None)
+            if stats is not None:
+                stats.template_time += elapsed
+
+    def beforeExecute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    def afterExecute(self, conn, cursor, statement, parameters, context,
+                     executemany):
+        elapsed = time.time() - conn.info['query_start'].pop()
+        if has_request_context():
+            stats = getattr(g, 'request_stats', None)
+            if stats is not None:
+                stats.sql_count += 1
+                stats.sql_time += elapsed
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            renderHistograms(lines, 'catalog_request_duration_seconds',
+                             'Request latency by endpoint.', 'endpoint',
+                             self.requests)
+            renderCounters(lines, 'catalog_sql_statements_total',
+                           'SQL statements executed by endpoint.',
+                           'endpoint', self.sql_count)
+            renderCounters(lines, 'catalog_sql_duration_seconds_total',
+                           'Time spent executing SQL by endpoint.',
+                           'endpoint', self.sql_time)
+            renderHistograms(lines, 'catalog_template_render_seconds',
+                             'Template render time by template.', 'template',
+                             self.templates)
+        return '\n'.join(lines) + '\n'
+
+    def metricsView(self):
+        return self.render(), 200, {
+            'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def serverTiming(stats):
+    """Format a request's timings as a Server-Timing header value."""
+    total = time.time() - stats.start
+    return ('sql;dur=%.2f;desc="%d queries", tpl;dur=%.2f, total;dur=%.2f' %
+            (stats.sql_time * 1000, stats.sql_count,
+             stats.template_time * 1000, total * 1000))
+
+
+def escapeLabel(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def renderCounters(lines, name, help, label, values):
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s counter' % name)
+    for key in sorted(values):
+        lines.append('%s{%s="%s"} %s' % (name, label, escapeLabel(key),
+                                         repr(values[key])))
+
+
+def renderHistograms(lines, name, help, label, histograms):
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s histogram' % name)
+    for key in sorted(histograms):
+        histogram = histograms[key]
+        labels = '%s="%s"' % (label, escapeLabel(key))
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append('%s_bucket{%s,le="%s"} %d' %
+                         (name, labels, repr(bound), count))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' %
+                     (name, labels, histogram.count))
+        lines.append('%s_sum{%s} %s' % (name, labels, repr(histogram.sum)))
+        lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+
+metrics = Metrics()
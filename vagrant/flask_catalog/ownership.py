@@ -0,0 +1,112 @@
+"""
+Ownership checks expressed in SQL.
+
+Instead of loading a whole row and comparing its user_id to the current user
+in Python, these helpers add the owner to the query itself, load only the
+columns a route needs and update or delete with a single conditional
+statement. Only when nothing matches is a second query made, to tell a
+missing row (404) from one owned by someone else (403).
+
+Updates can also be made conditional on the version a form was rendered
+with, so an edit based on stale data is rejected instead of silently
+overwriting a concurrent one.
+"""
+from flask import abort, make_response
+from sqlalchemy import and_, exists
+
+# returned to users trying to change something they don't own.
+UNAUTHORIZED_ALERT = """
+        <script>
+            function unauthAlert() {alert('Current user is not authorized.');}
+        </script>
+        <body onload='unauthAlert()'>
+        """
+
+
+class StaleEditError(Exception):
+    """Raised when an object changed since the version being edited."""
+
+
+def abortNotOwned(session, model, object_id, criteria):
+    """
+    Abort with 403 if the object exists and matches the criteria, or 404 if
+    it doesn't.
+    """
+    conditions = [model.id == object_id]
+    conditions.extend(getattr(model, column) == value
+                      for column, value in criteria.items())
+    if session.query(exists().where(and_(*conditions))).scalar():
+        abort(make_response(UNAUTHORIZED_ALERT, 403))
+    abort(404)
+
+
+def ownedFilter(model, object_id, user_id, criteria):
+    """Returns the WHERE clause matching the object if user_id owns it."""
+    conditions = [model.id == object_id, model.user_id == user_id]
+    conditions.extend(getattr(model, column) == value
+                      for column, value in criteria.items())
+    return and_(*conditions)
+
+
+def getOwned(session, model, object_id, user_id, columns, **criteria):
+    """
+    Returns the named columns of the object owned by user_id as a named
+    tuple, or aborts with 403 or 404. Extra criteria, like the restaurant a
+    menu item must belong to, are given as keyword arguments.
+    """
+    row = session.query(*[getattr(model, column) for column in columns])\
+        .filter(ownedFilter(model, object_id, user_id, criteria)).first()
+    if row is None:
+        abortNotOwned(session, model, object_id, criteria)
+    return row
+
+
+def isOwned(session, model, object_id, user_id, **criteria):
+    """Check if user_id owns the object without loading it."""
+    return session.query(exists().where(ownedFilter(
+        model, object_id, user_id, criteria))).scalar()
+
+
+def checkOwned(session, model, object_id, user_id, **criteria):
+    """Abort with 403 or 404 unless user_id owns the object."""
+    if not isOwned(session, model, object_id, user_id, **criteria):
+        abortNotOwned(session, model, object_id, criteria)
+
+
+def updateOwned(session, model, object_id, user_id, values, version=None,
+                **criteria):
+    """
+    UPDATE the object with values if user_id owns it, or abort with 403 or
+    404. The caller commits.
+
+    The object's version is incremented. If version is given the UPDATE
+    only matches that version, and StaleEditError is raised when the object
+    has been changed since.
+    """
+    if not values:
+        return checkOwned(session, model, object_id, user_id, **criteria)
+    table = model.__table__
+    values = dict(values, version=table.c.version + 1)
+    condition = ownedFilter(model, object_id, user_id, criteria)
+    if version is not None:
+        condition = and_(condition, table.c.version == version)
+    count = session.execute(
+        table.update().where(condition).values(values)).rowcount
+    if count == 0:
+        if version is not None and isOwned(session, model, object_id,
+                                           user_id, **criteria):
+            raise StaleEditError(object_id)
+        abortNotOwned(session, model, object_id, criteria)
+
+
+def deleteOwned(session, model, object_id, user_id, **criteria):
+    """
+    DELETE the object if user_id owns it, or abort with 403 or 404. The
+    caller commits.
+    """
+    table = model.__table__
+    count = session.execute(
+        table.delete()
+        .where(ownedFilter(model, object_id, user_id, criteria))).rowcount
+    if count == 0:
+        abortNotOwned(session, model, object_id, criteria)
@@ -1,14 +1,17 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, \
                   jsonify
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from database_setup import Base, Restaurant, MenuItem
+from database_setup import Base, Restaurant, MenuItem, upgradeSchema
+from config import loadConfig, engineOptions
+from db import makeEngine
 
 app = Flask(__name__)
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+config = loadConfig()
+engine = makeEngine(config['DATABASE_URL'], **engineOptions(config))
 Base.metadata.bind = engine
+upgradeSchema(engine)
 
 DBSession = sessionmaker(bind=engine)
 session = DBSession()
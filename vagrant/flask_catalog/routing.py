@@ -0,0 +1,69 @@
+"""
+Read replica routing for the catalog's database session.
+
+RoutingSession sends the statements of read only routes to a replica engine
+and everything else to the primary. A route opts in with the decorator
+returned by readOnly(). Replicas lag behind the primary, so a user who just
+made a change keeps reading from the primary for REPLICA_STICKY_SECONDS
+(read your writes): every successful write request by a logged in user
+records its time in their session.
+"""
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask import session as login_session
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import UpdateBase
+
+# login_session key holding the time of the user's last write.
+LAST_WRITE_KEY = 'last_write'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RoutingSession(Session):
+    """
+    Session reading from info['replica_engine'] while info['use_replica']
+    is set, and writing to its bind.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica_engine')
+        if (replica is not None and self.info.get('use_replica') and
+                not self._flushing and not isinstance(clause, UpdateBase)):
+            return replica
+        return Session.get_bind(self, mapper, clause)
+
+
+def wroteRecently(seconds):
+    """Check if the current user made a change in the last seconds."""
+    last_write = login_session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < seconds
+
+
+def readOnly(session):
+    """
+    Returns a route decorator making the route read from the replica, unless
+    the user wrote in the last REPLICA_STICKY_SECONDS.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not wroteRecently(current_app.config['REPLICA_STICKY_SECONDS']):
+                session.info['use_replica'] = True
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def recordWrite(response):
+    """
+    after_request hook recording the time of every successful write request
+    by a logged in user, so their next reads go to the primary.
+    """
+    if not current_app.config['REPLICA_DATABASE_URL']:
+        return response
+    if (request.method in WRITE_METHODS and response.status_code < 400 and
+            'user_id' in login_session):
+        login_session[LAST_WRITE_KEY] = time.time()
+    return response
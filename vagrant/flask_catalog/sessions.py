@@ -0,0 +1,219 @@
+"""
+Server side sessions for the catalog app.
+
+Flask's default session stores login_session in a signed cookie, which is
+sent with and verified on every request. These session interfaces keep the
+session data on the server instead and only send the browser a short random
+session id. Two stores are provided: MemoryStore, an in process LRU cache for
+single process deployments, and SqliteStore, a SQLite file shared by every
+worker process on a machine. Expired sessions are swept by a background
+thread.
+"""
+import base64
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin, \
+    SecureCookieSessionInterface, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+
+def newSessionId():
+    """Returns a random, url safe 22 character session id."""
+    return base64.urlsafe_b64encode(os.urandom(16)).rstrip(b'=').decode(
+        'ascii')
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a store, identified by sid."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def onUpdate(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, onUpdate)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemoryStore(object):
+    """
+    In process session store.
+
+    Keeps at most max_entries sessions, evicting the least recently used
+    ones first. Only suitable when a single process serves every request.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.pop(sid, None)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                return None
+            # move the session to the most recently used end.
+            self.entries[sid] = entry
+            return entry[0]
+
+    def set(self, sid, data, expires):
+        with self.lock:
+            self.entries.pop(sid, None)
+            self.entries[sid] = (data, expires)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def sweep(self):
+        """Remove every expired session."""
+        now = time.time()
+        with self.lock:
+            expired = [sid for sid, (data, expires) in self.entries.items()
+                       if expires < now]
+            for sid in expired:
+                del self.entries[sid]
+        return len(expired)
+
+
+class SqliteStore(object):
+    """
+    Session store in a SQLite database file, shared by every worker process
+    that opens the same path. Each thread uses its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute(
+            'CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL, expires REAL NOT NULL)')
+        self.connection().execute(
+            'CREATE INDEX IF NOT EXISTS session_expires ON session (expires)')
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self.connection().execute(
+            'SELECT data FROM session WHERE sid = ? AND expires >= ?',
+            (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, expires):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO session (sid, data, expires) '
+            'VALUES (?, ?, ?)', (sid, data, expires))
+
+    def delete(self, sid):
+        self.connection().execute('DELETE FROM session WHERE sid = ?',
+                                  (sid,))
+
+    def sweep(self):
+        """Remove every expired session."""
+        return self.connection().execute(
+            'DELETE FROM session WHERE expires < ?', (time.time(),)).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Session interface keeping session data in store.
+
+    A session id is only issued once something is written to the session,
+    so anonymous requests never get a cookie or a store entry.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store, sweep_interval=60):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.sweeper = None
+        self.sweeper_lock = threading.Lock()
+
+    def startSweeper(self):
+        """
+        Start the background thread removing expired sessions. Started on
+        the first request so every forked worker gets its own thread.
+        """
+        with self.sweeper_lock:
+            if self.sweeper is not None or not self.sweep_interval:
+                return
+
+            def sweep():
+                while True:
+                    time.sleep(self.sweep_interval)
+                    try:
+                        self.store.sweep()
+                    except Exception:
+                        pass
+            self.sweeper = threading.Thread(target=sweep,
+                                            name='session-sweeper')
+            self.sweeper.daemon = True
+            self.sweeper.start()
+
+    def open_session(self, app, request):
+        self.startSweeper()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        if session.sid is None:
+            session.sid = newSessionId()
+        elif not session.modified:
+            return
+        expires = self.get_expiration_time(app, session)
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       time.time() +
+                       app.permanent_session_lifetime.total_seconds())
+        if session.new:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                                expires=expires,
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app))
+
+
+def createSessionInterface(config):
+    """
+    Returns the session interface for config['SESSION_BACKEND'], which is
+    one of 'cookie' (Flask's signed cookie sessions), 'memory' or 'sqlite'.
+    """
+    backend = config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return SecureCookieSessionInterface()
+    if backend == 'memory':
+        store = MemoryStore(config['SESSION_MAX_ENTRIES'])
+    elif backend == 'sqlite':
+        store = SqliteStore(config['SESSION_SQLITE_PATH'])
+    else:
+        raise ValueError('unknown session backend %r' % backend)
+    return ServerSideSessionInterface(store, config['SESSION_SWEEP_INTERVAL'])
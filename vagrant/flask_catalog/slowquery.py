@@ -0,0 +1,185 @@
+"""
+Opt-in slow query log for SQLAlchemy engines.
+
+Statements that take longer than a threshold are logged together with their
+parameters. The first time a statement is seen to be slow its query plan is
+captured with EXPLAIN QUERY PLAN (EXPLAIN on other databases), and slow
+statements are aggregated by their normalized text, so a statement scanning
+a whole table because of a missing index shows up at the top of report().
+
+Enable it for a script's engine by setting SLOW_QUERY_MS in the environment:
+
+    SLOW_QUERY_MS=20 python webserver.py
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+log = logging.getLogger('slowquery')
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+
+
+def normalize(statement):
+    """
+    Reduce a statement to a form shared by all executions of the same query,
+    replacing literals with ? and parameter lists with (...).
+    """
+    statement = STRING_LITERAL.sub('?', statement)
+    statement = NUMBER_LITERAL.sub('?', statement)
+    statement = WHITESPACE.sub(' ', statement).strip()
+    return PARAMETER_LIST.sub('(...)', statement)
+
+
+def isFullScan(plan):
+    """Check a captured query plan for a table scan that skips indexes."""
+    for line in plan or []:
+        if 'Seq Scan' in line:
+            return True
+        if line.startswith('SCAN ') and 'INDEX' not in line:
+            return True
+    return False
+
+
+class SlowStatement(object):
+    """Aggregated timings of one normalized statement."""
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.plan = None
+
+    def serialize(self):
+        return {
+            'statement': self.statement,
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'full_scan': isFullScan(self.plan),
+            'plan': self.plan,
+        }
+
+
+class SlowQueryLog(object):
+    """
+    Records statements slower than threshold seconds on attached engines.
+    """
+
+    def __init__(self, threshold=0.1, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    def attach(self, engine):
+        """Start timing the statements executed through engine."""
+        event.listen(engine, 'before_cursor_execute', self.beforeExecute)
+        event.listen(engine, 'after_cursor_execute', self.afterExecute)
+        return self
+
+    def beforeExecute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        conn.info.setdefault('slowquery_start', []).append(time.time())
+
+    def afterExecute(self, conn, cursor, statement, parameters, context,
+                     executemany):
+        elapsed = time.time() - conn.info['slowquery_start'].pop()
+        if elapsed < self.threshold:
+            return
+        key = normalize(statement)
+        with self.lock:
+            slow = self.statements.get(key)
+            if slow is None:
+                slow = self.statements[key] = SlowStatement(key)
+            slow.count += 1
+            slow.total += elapsed
+            slow.max = max(slow.max, elapsed)
+            capture = self.explain and slow.plan is None
+            if capture:
+                # only the first slow execution pays for the EXPLAIN.
+                slow.plan = []
+        if executemany and parameters:
+            parameters = parameters[0]
+        log.warning('slow query (%.1fms): %s; parameters: %r',
+                    elapsed * 1000, statement, parameters)
+        if capture:
+            slow.plan = self.explainStatement(conn, statement, parameters)
+            log.warning('query plan: %s', '; '.join(slow.plan))
+
+    def explainStatement(self, conn, statement, parameters):
+        """Returns the database's query plan for a statement as lines."""
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        if conn.dialect.name == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+        # on PostgreSQL a failed statement aborts the whole transaction, which
+        # psycopg2 has open unless in autocommit mode, so the EXPLAIN runs in
+        # a savepoint, rolled back if it fails.
+        savepoint = (conn.dialect.name == 'postgresql' and
+                     not conn.connection.connection.autocommit)
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                if savepoint:
+                    cursor.execute('SAVEPOINT slowquery_explain')
+                try:
+                    cursor.execute(prefix + statement, parameters)
+                    # the plan detail is the last column on every database.
+                    plan = [str(row[-1]) for row in cursor.fetchall()]
+                except Exception:
+                    if savepoint:
+                        cursor.execute(
+                            'ROLLBACK TO SAVEPOINT slowquery_explain')
+                    raise
+                if savepoint:
+                    cursor.execute('RELEASE SAVEPOINT slowquery_explain')
+                return plan
+            finally:
+                cursor.close()
+        except Exception as e:
+            return ['EXPLAIN failed: %s' % e]
+
+    def report(self):
+        """Returns the slow statements, slowest in total first."""
+        with self.lock:
+            statements = sorted(self.statements.values(),
+                                key=lambda s: s.total, reverse=True)
+            return [s.serialize() for s in statements]
+
+    def logReport(self):
+        """Log a summary of every slow statement seen."""
+        for slow in self.report():
+            log.warning('%d slow executions, %.1fms total, %.1fms max%s: %s',
+                        slow['count'], slow['total_ms'], slow['max_ms'],
+                        ' (full table scan)' if slow['full_scan'] else '',
+                        slow['statement'])
+
+
+def enableFromEnvironment(engine, environ=None):
+    """
+    Attach a slow query log to engine if SLOW_QUERY_MS is set in the
+    environment, logging a summary when the process exits. Returns the log,
+    or None when it isn't enabled.
+    """
+    if environ is None:
+        environ = os.environ
+    threshold = environ.get('SLOW_QUERY_MS')
+    if not threshold:
+        return None
+    logging.basicConfig()
+    slowlog = SlowQueryLog(float(threshold) / 1000).attach(engine)
+    atexit.register(slowlog.logReport)
+    return slowlog
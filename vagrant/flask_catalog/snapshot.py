@@ -0,0 +1,223 @@
+"""
+Snapshot export and import of the catalog, as gzipped NDJSON.
+
+A snapshot holds the user, restaurant and menu_item tables, one after the
+other, each as a JSON object line naming the table and its columns followed
+by one JSON array line per row. Rows are read in id order a batch at a time
+and inserted a batch at a time with executemany, so both directions run in
+memory bounded by the batch size, however large the catalog. Derived
+tables are not exported: the restaurant summaries are computed from the
+imported items as they stream by, and the change log starts empty.
+
+    python snapshot.py export catalog.ndjson.gz
+    python snapshot.py import catalog.ndjson.gz
+
+Both use the database configured by CATALOG_DATABASE_URL (see config.py).
+Import only fills an empty catalog, e.g. a new database file.
+"""
+import gzip
+import io
+import sys
+
+from sqlalchemy import func, select, text
+
+from database_setup import User, Restaurant, MenuItem, upgradeSchema
+from fastjson import dumps, loads
+from summary import Summary, insertSummaries
+
+# the exported tables, in an order that satisfies their foreign keys.
+TABLES = (User.__table__, Restaurant.__table__, MenuItem.__table__)
+# columns a snapshot must have: the ids, and what the summaries need.
+REQUIRED_COLUMNS = {'user': ('id',), 'restaurant': ('id',),
+                    'menu_item': ('id', 'restaurant_id', 'course', 'price')}
+# rows read or inserted at a time.
+BATCH_SIZE = 10000
+# gzip level: most of the size of level 9 in a fraction of the time.
+COMPRESS_LEVEL = 6
+
+
+class SnapshotError(Exception):
+    """A snapshot can't be imported."""
+
+
+def exportRows(conn, table, batch_size=BATCH_SIZE):
+    """Yields the rows of a table as lists, in id order, batch by batch."""
+    last = None
+    while True:
+        query = select(list(table.c)).order_by(table.c.id).limit(batch_size)
+        if last is not None:
+            query = query.where(table.c.id > last)
+        rows = conn.execute(query).fetchall()
+        for row in rows:
+            yield list(row)
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][table.c.id]
+
+
+def exportSnapshot(engine, path, batch_size=BATCH_SIZE):
+    """
+    Write the catalog at engine to a snapshot file at path, from a single
+    transaction. Returns the number of rows written by table name.
+    """
+    counts = {}
+    conn = engine.connect()
+    if engine.dialect.name == 'postgresql':
+        # read every batch from the same snapshot of the database.
+        conn = conn.execution_options(isolation_level='REPEATABLE READ')
+    try:
+        with conn.begin(), gzip.open(path, 'wb', COMPRESS_LEVEL) as out:
+            if engine.dialect.name == 'sqlite':
+                # pysqlite only begins a transaction before a write, so
+                # begin one for the batches to read the same snapshot.
+                conn.execute('BEGIN')
+            for table in TABLES:
+                out.write(dumps({'table': table.name,
+                                 'columns': [c.name for c in table.c]}) +
+                          '\n')
+                lines, count = [], 0
+                for row in exportRows(conn, table, batch_size):
+                    lines.append(dumps(row))
+                    if len(lines) == batch_size:
+                        out.write('\n'.join(lines) + '\n')
+                        count += len(lines)
+                        lines = []
+                if lines:
+                    out.write('\n'.join(lines) + '\n')
+                    count += len(lines)
+                counts[table.name] = count
+    finally:
+        conn.close()
+    return counts
+
+
+def readSnapshot(path):
+    """
+    Yields (table name, columns, row) for every row of a snapshot file, and
+    (table name, columns, None) before the rows of each table.
+    """
+    with io.BufferedReader(gzip.open(path, 'rb')) as lines:
+        table = columns = None
+        for line in lines:
+            record = loads(line)
+            if isinstance(record, dict):
+                table, columns = record['table'], record['columns']
+                yield table, columns, None
+            elif table is None:
+                raise SnapshotError('row before any table header')
+            else:
+                yield table, columns, record
+
+
+def insertRows(conn, table, columns, rows):
+    """
+    INSERT rows given as lists in the order of columns, with executemany on
+    the DBAPI cursor. The values are plain JSON types, so SQLAlchemy's per
+    row parameter processing can be skipped, which halves the import time.
+    """
+    compiled = table.insert().compile(dialect=conn.dialect,
+                                      column_keys=columns)
+    if compiled.positional:
+        order = [columns.index(name) for name in compiled.positiontup]
+        params = [[row[i] for i in order] for row in rows]
+    else:
+        params = [dict(zip(columns, row)) for row in rows]
+    cursor = conn.connection.cursor()
+    try:
+        cursor.executemany(unicode(compiled), params)
+    finally:
+        cursor.close()
+
+
+def importSnapshot(engine, path, batch_size=BATCH_SIZE):
+    """
+    Load a snapshot file at path into the empty catalog at engine, in a
+    single transaction, with the restaurant summaries. Returns the number
+    of rows inserted by table name.
+    """
+    upgradeSchema(engine)
+    tables = dict((table.name, table) for table in TABLES)
+    counts = {}
+    summaries = {}
+    conn = engine.connect()
+    try:
+        with conn.begin():
+            for table in TABLES:
+                if conn.execute(select([func.count()])
+                                .select_from(table)).scalar():
+                    raise SnapshotError('table %s is not empty' % table.name)
+            batch, table, columns = [], None, None
+            for name, names, row in readSnapshot(path):
+                if row is None:
+                    if batch:
+                        insertRows(conn, table, columns, batch)
+                        batch = []
+                    if name not in tables:
+                        raise SnapshotError('unknown table %s' % name)
+                    table, columns = tables[name], names
+                    unknown = set(columns) - set(c.name for c in table.c)
+                    if unknown:
+                        raise SnapshotError('unknown columns %s in %s' % (
+                            ', '.join(sorted(unknown)), name))
+                    missing = set(REQUIRED_COLUMNS[name]) - set(columns)
+                    if missing:
+                        raise SnapshotError('missing columns %s in %s' % (
+                            ', '.join(sorted(missing)), name))
+                    counts.setdefault(name, 0)
+                    # where the summaries' columns are in the rows.
+                    if name == 'restaurant':
+                        id_column = columns.index('id')
+                    elif name == 'menu_item':
+                        restaurant_column = columns.index('restaurant_id')
+                        course_column = columns.index('course')
+                        price_column = columns.index('price')
+                    continue
+                batch.append(row)
+                counts[name] += 1
+                if name == 'restaurant':
+                    summaries[row[id_column]] = Summary(row[id_column])
+                elif (name == 'menu_item' and
+                      row[restaurant_column] in summaries):
+                    summaries[row[restaurant_column]].add(
+                        row[course_column], row[price_column])
+                if len(batch) == batch_size:
+                    insertRows(conn, table, columns, batch)
+                    batch = []
+            if batch:
+                insertRows(conn, table, columns, batch)
+            if engine.dialect.name == 'postgresql':
+                # the ids were given explicitly, so move the sequences past
+                # them.
+                for table in TABLES:
+                    conn.execute(text(
+                        "SELECT setval(pg_get_serial_sequence('\"%s\"', "
+                        "'id'), (SELECT coalesce(max(id), 1) FROM \"%s\"))"
+                        % (table.name, table.name)))
+            insertSummaries(conn, summaries.values())
+    finally:
+        conn.close()
+    return counts
+
+
+if __name__ == '__main__':
+    import time
+
+    from config import loadConfig, engineOptions
+    from db import makeEngine
+    if len(sys.argv) != 3 or sys.argv[1] not in ('export', 'import'):
+        print 'usage: python snapshot.py export|import <file.ndjson.gz>'
+        sys.exit(2)
+    config = loadConfig()
+    engine = makeEngine(config['DATABASE_URL'], **engineOptions(config))
+    start = time.time()
+    try:
+        if sys.argv[1] == 'export':
+            counts = exportSnapshot(engine, sys.argv[2])
+        else:
+            counts = importSnapshot(engine, sys.argv[2])
+    except SnapshotError as e:
+        print 'cannot import %s: %s' % (sys.argv[2], e)
+        sys.exit(1)
+    print '%sed %s in %.1fs' % (sys.argv[1], ', '.join(
+        '%d %s rows' % (counts.get(table.name, 0), table.name)
+        for table in TABLES), time.time() - start)
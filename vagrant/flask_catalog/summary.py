@@ -0,0 +1,170 @@
+"""
+Denormalized menu summaries for the restaurant listing.
+
+The listing and /restaurants/JSON show every restaurant's item count, price
+range and courses. Rather than aggregating menu_item for them on every view,
+the restaurant_summary table keeps one row per restaurant, refreshed by the
+routes that change a menu from the items of that restaurant alone. Listing
+reads one summary row per restaurant, however many items there are.
+
+Rebuild every summary, e.g. after editing the database by hand, with
+
+    python summary.py
+"""
+import re
+
+from sqlalchemy import func, select
+
+from bulk import chunks
+from database_setup import Restaurant, MenuItem, RestaurantSummary
+
+PRICE = re.compile(r'^\s*\$?\s*(\d+)(?:\.(\d{1,2}))?\s*$')
+
+
+def parsePrice(price):
+    """Returns a price like '$4.50' in cents, or None if it isn't one."""
+    match = PRICE.match(price or '')
+    if match is None:
+        return None
+    cents = (match.group(2) or '0').ljust(2, '0')
+    return int(match.group(1)) * 100 + int(cents)
+
+
+def formatPrice(cents):
+    """Format a price in cents like the menu prices, e.g. '$4.50'."""
+    if cents is None:
+        return None
+    return '$%d.%02d' % divmod(cents, 100)
+
+
+class Summary(object):
+    """
+    Accumulates the summary of one restaurant's items, keeping only the
+    price range seen so far, so its size doesn't grow with the items.
+    """
+
+    def __init__(self, restaurant_id):
+        self.restaurant_id = restaurant_id
+        self.item_count = 0
+        self.min_price = None
+        self.max_price = None
+        self.courses = set()
+
+    def add(self, course, price):
+        self.item_count += 1
+        cents = parsePrice(price)
+        if cents is not None:
+            if self.min_price is None or cents < self.min_price:
+                self.min_price = cents
+            if self.max_price is None or cents > self.max_price:
+                self.max_price = cents
+        if course:
+            self.courses.add(course)
+
+    def row(self):
+        return {'restaurant_id': self.restaurant_id,
+                'item_count': self.item_count,
+                'min_price': self.min_price,
+                'max_price': self.max_price,
+                'courses': ','.join(sorted(self.courses))[:250]}
+
+
+def refreshSummaries(session, restaurant_ids):
+    """
+    Recompute the summaries of the given restaurants from their items, in
+    the session's transaction, dropping those of restaurants that no
+    longer exist. The caller commits.
+    """
+    table = RestaurantSummary.__table__
+    items = MenuItem.__table__
+    for chunk in chunks(sorted(set(restaurant_ids))):
+        # lock the rows first, so concurrent refreshes of a restaurant run
+        # one after the other where the database supports it.
+        session.execute(select([table.c.restaurant_id])
+                        .where(table.c.restaurant_id.in_(chunk))
+                        .with_for_update())
+        summaries = dict((restaurant_id, Summary(restaurant_id))
+                         for restaurant_id, in session.query(Restaurant.id)
+                         .filter(Restaurant.id.in_(chunk)))
+        for restaurant_id, course, price in session.execute(
+                select([items.c.restaurant_id, items.c.course,
+                        items.c.price])
+                .where(items.c.restaurant_id.in_(chunk))):
+            if restaurant_id in summaries:
+                summaries[restaurant_id].add(course, price)
+        session.execute(table.delete().where(table.c.restaurant_id.in_(chunk)))
+        if summaries:
+            session.execute(table.insert(),
+                            [summary.row() for summary in summaries.values()])
+
+
+def rebuildSummaries(session, batch_size=1000):
+    """
+    Recompute every summary with one pass over the items, e.g. for a
+    database written without them. The caller commits.
+    """
+    table = RestaurantSummary.__table__
+    items = MenuItem.__table__
+    summaries = dict((restaurant_id, Summary(restaurant_id))
+                     for restaurant_id, in session.query(Restaurant.id))
+    for restaurant_id, course, price in session.execute(
+            select([items.c.restaurant_id, items.c.course, items.c.price])):
+        if restaurant_id in summaries:
+            summaries[restaurant_id].add(course, price)
+    session.execute(table.delete())
+    insertSummaries(session, summaries.values(), batch_size)
+
+
+def insertSummaries(session, summaries, batch_size=1000):
+    """
+    Insert the rows of Summary objects, batch_size at a time, with a session
+    or a connection.
+    """
+    table = RestaurantSummary.__table__
+    rows = [summary.row() for summary in summaries]
+    for i in xrange(0, len(rows), batch_size):
+        session.execute(table.insert(), rows[i:i + batch_size])
+
+
+def summariesStale(session):
+    """Check if some restaurants have no summary, or vice versa."""
+    return (session.query(func.count(RestaurantSummary.restaurant_id))
+            .scalar() != session.query(func.count(Restaurant.id)).scalar())
+
+
+def summaryQuery(session):
+    """
+    Returns a query for every restaurant's id, name and owner with the
+    columns of its summary.
+    """
+    return session.query(Restaurant.id, Restaurant.name, Restaurant.user_id,
+                         RestaurantSummary.item_count,
+                         RestaurantSummary.min_price,
+                         RestaurantSummary.max_price,
+                         RestaurantSummary.courses)\
+        .outerjoin(RestaurantSummary,
+                   RestaurantSummary.restaurant_id == Restaurant.id)\
+        .order_by(Restaurant.id)
+
+
+def serializeSummary(row):
+    """Returns the JSON form of a row of summaryQuery()."""
+    return {'id': row.id, 'name': row.name,
+            'item_count': row.item_count or 0,
+            'min_price': formatPrice(row.min_price),
+            'max_price': formatPrice(row.max_price),
+            'courses': row.courses.split(',') if row.courses else []}
+
+
+if __name__ == '__main__':
+    from sqlalchemy.orm import sessionmaker
+
+    from config import loadConfig, engineOptions
+    from db import makeEngine
+    config = loadConfig()
+    engine = makeEngine(config['DATABASE_URL'], **engineOptions(config))
+    session = sessionmaker(bind=engine)()
+    rebuildSummaries(session)
+    session.commit()
+    print 'summarized %d restaurants' % session.query(
+        func.count(RestaurantSummary.restaurant_id)).scalar()
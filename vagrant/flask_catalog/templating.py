@@ -0,0 +1,36 @@
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def configureTemplates(app, cache_dir=None, precompile=True):
+    """
+    Configure the app's jinja environment for production use.
+
+    Disables template auto reloading, stores compiled template bytecode in a
+    persistent on disk cache so new workers don't recompile the templates,
+    and optionally compiles every template up front so the first request
+    doesn't pay for it. Returns the number of templates precompiled.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(app.root_path, '.jinja_cache')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    env = app.jinja_env
+    # never stat the template files to check for changes.
+    env.auto_reload = False
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if not precompile:
+        return 0
+    return precompileTemplates(env)
+
+
+def precompileTemplates(env):
+    """
+    Load every template known to the environment's loader, filling both the
+    in memory template cache and the bytecode cache.
+    """
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    return len(names)
@@ -0,0 +1,17 @@
+"""
+WSGI entry point for running the catalog under a production server, e.g.
+
+    gunicorn --workers 4 wsgi:application
+    uwsgi --http :5000 --processes 4 --module wsgi:application
+
+Configure the app with CATALOG_* environment variables (see config.py). The
+worker mode defaults to 'sync' here instead of the development server.
+Run the asset build (python assets.py) first to serve fingerprinted,
+precompressed static files.
+"""
+import os
+
+from final_project import create_app
+
+application = create_app({
+    'WORKER_MODE': os.environ.get('CATALOG_WORKER_MODE', 'sync')})
@@ -1,9 +1,17 @@
+import os
 import sys
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Date, Numeric
+# db.py and slowquery.py are shared with flask_catalog, import them from
+# there.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'flask_catalog'))
+
+from sqlalchemy import Column, ForeignKey, Integer, String, Date, DateTime, \
+    Numeric
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+
+from db import makeEngine, databaseUrl
 
 Base = declarative_base()
 
@@ -34,6 +42,20 @@ class Puppy(Base):
     shelter_id = Column(Integer, ForeignKey('shelter.id'))
     shelter = relationship(Shelter)
 
-engine = create_engine('sqlite:///puppies.db')
+
+class Picture(Base):
+    """
+    A distinct puppy picture url as last checked by thumbnails.py, with the
+    local thumbnail of its image, or the error if it couldn't be fetched.
+    """
+    __tablename__ = 'picture'
+
+    url = Column(String, primary_key=True)
+    sha256 = Column(String(64), index=True)
+    thumbnail = Column(String)
+    error = Column(String)
+    checked = Column(DateTime, nullable=False)
+
+engine = makeEngine(databaseUrl('sqlite:///puppies.db'))
 
 Base.metadata.create_all(engine)
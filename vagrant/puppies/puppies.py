@@ -1,12 +1,15 @@
-from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
 
 from database_setup import Base, Shelter, Puppy
+from db import makeEngine, databaseUrl
+from slowquery import enableFromEnvironment
 
 import datetime
 
-engine = create_engine('sqlite:///puppies.db')
+engine = makeEngine(databaseUrl('sqlite:///puppies.db'))
+# log slow statements when SLOW_QUERY_MS is set.
+enableFromEnvironment(engine)
 
 Base.metadata.bind = engine
 
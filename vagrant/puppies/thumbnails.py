@@ -0,0 +1,160 @@
+"""
+Validate the puppy picture urls and precompute local thumbnails.
+
+Fetches every distinct Puppy.picture concurrently on a bounded thread pool,
+stores one thumbnail per distinct image (by the SHA-256 of its bytes) in
+thumbnails/ and records the outcome for each url in the picture table,
+including the error for the ones that are broken, so pages can show the
+local thumbnail and never wait for the remote image hosts.
+
+    python thumbnails.py --workers 8
+
+Urls that were checked before are skipped unless --recheck is given. The
+images are shrunk when PIL is installed and stored as fetched otherwise.
+"""
+import argparse
+import datetime
+import hashlib
+import mimetypes
+import os
+import socket
+import urllib2
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy.orm import sessionmaker
+
+from database_setup import Base, Puppy, Picture
+from db import makeEngine, databaseUrl
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'thumbnails')
+# pictures larger than this are treated as broken.
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+
+def fetch(url, timeout):
+    """
+    Download a picture. Returns (url, data, mimetype, None), or
+    (url, None, None, error) if it is broken.
+    """
+    try:
+        response = urllib2.urlopen(url, timeout=timeout)
+        data = response.read(MAX_IMAGE_BYTES + 1)
+        mimetype = response.info().gettype()
+    except (urllib2.URLError, socket.error, ValueError) as e:
+        return url, None, None, str(e)
+    if len(data) > MAX_IMAGE_BYTES:
+        return url, None, None, 'larger than %d bytes' % MAX_IMAGE_BYTES
+    if not mimetype.startswith('image/'):
+        return url, None, None, 'not an image: %s' % mimetype
+    return url, data, mimetype, None
+
+
+def makeThumbnail(data, mimetype, size):
+    """
+    Returns the thumbnail data and file extension of an image, or the image
+    itself when PIL isn't installed.
+    """
+    if Image is None:
+        return data, mimetypes.guess_extension(mimetype) or '.img'
+    image = Image.open(BytesIO(data))
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    out = BytesIO()
+    image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue(), '.jpg'
+
+
+def storeThumbnail(digest, data, mimetype, size, directory):
+    """
+    Write the thumbnail of an image unless one with the same digest exists.
+    Returns its path relative to this directory.
+    """
+    for name in os.listdir(directory):
+        if name.startswith(digest + '.'):
+            break
+    else:
+        thumbnail, extension = makeThumbnail(data, mimetype, size)
+        name = digest + extension
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(thumbnail)
+    return os.path.relpath(os.path.join(directory, name),
+                           os.path.dirname(THUMBNAIL_DIR))
+
+
+def checkPictures(session, workers=8, timeout=10, size=200, recheck=False,
+                  directory=THUMBNAIL_DIR):
+    """
+    Fetch the distinct puppy pictures on a pool of workers threads and
+    record them in the picture table. Returns (checked, images, broken).
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    urls = set(url for url, in session.query(Puppy.picture).distinct()
+               if url)
+    if not recheck:
+        urls -= set(url for url, in session.query(Picture.url))
+    pool = ThreadPool(workers)
+    images = set()
+    broken = 0
+    try:
+        # the downloads run on the pool, the hashing, thumbnails and
+        # database writes here, in the order the downloads finish.
+        jobs = pool.imap_unordered(lambda url: fetch(url, timeout),
+                                   sorted(urls))
+        for url, data, mimetype, error in jobs:
+            # every column is set, so a recheck overwrites what the last
+            # check found.
+            picture = Picture(url=url, checked=datetime.datetime.utcnow(),
+                              sha256=None, thumbnail=None, error=None)
+            if error is None:
+                digest = hashlib.sha256(data).hexdigest()
+                try:
+                    picture.thumbnail = storeThumbnail(
+                        digest, data, mimetype, size, directory)
+                    picture.sha256 = digest
+                    images.add(digest)
+                except IOError as e:
+                    error = 'not a readable image: %s' % e
+            if error is not None:
+                picture.error = error
+                broken += 1
+            session.merge(picture)
+        session.commit()
+    finally:
+        pool.close()
+        pool.join()
+    return len(urls), len(images), broken
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=8,
+                        help='concurrent downloads')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds to wait for a picture')
+    parser.add_argument('--size', type=int, default=200,
+                        help='thumbnail size in pixels')
+    parser.add_argument('--recheck', action='store_true',
+                        help='fetch the urls checked before again')
+    args = parser.parse_args(argv)
+
+    engine = makeEngine(databaseUrl('sqlite:///puppies.db'))
+    Base.metadata.bind = engine
+    session = sessionmaker(bind=engine)()
+    checked, images, broken = checkPictures(
+        session, args.workers, args.timeout, args.size, args.recheck)
+    print '%d urls checked, %d distinct images, %d broken' % (
+        checked, images, broken)
+    for url, error in session.query(Picture.url, Picture.error)\
+            .filter(Picture.error.isnot(None)).order_by(Picture.url):
+        print 'broken: %s (%s)' % (url, error)
+
+
+if __name__ == '__main__':
+    main()